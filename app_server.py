@@ -2,7 +2,6 @@
 from nose.tools import set_trace
 from psycopg2 import DatabaseError
 import flask
-import gzip
 import json
 import os
 import sys
@@ -11,8 +10,12 @@ from lxml import etree
 from functools import wraps
 from flask import url_for, make_response
 from flask_babel import lazy_gettext as _
-from io import BytesIO
-from util.flask_util import problem
+from util.flask_util import (
+    client_accepts_gzip,
+    gzip_compress,
+    gzip_stream,
+    problem,
+)
 from util.problem_detail import ProblemDetail
 import traceback
 import logging
@@ -135,8 +138,7 @@ def compressible(f):
                 # already been encoded.
                 return response
 
-            accept_encoding = flask.request.headers.get('Accept-Encoding', '')
-            if not 'gzip' in accept_encoding.lower():
+            if not client_accepts_gzip():
                 return response
 
             # At this point we know we're going to be changing the
@@ -148,15 +150,17 @@ def compressible(f):
             # fail. This is pure copy-and-paste magic.
             response.direct_passthrough = False
 
-            buffer = BytesIO()
-            gzipped = gzip.GzipFile(mode='wb', fileobj=buffer)
-            gzipped.write(response.data)
-            gzipped.close()
-            response.data = buffer.getvalue()
+            if response.is_streamed:
+                # Compress the response as it's generated rather than
+                # waiting for the whole thing.
+                response.response = gzip_stream(response.iter_encoded())
+                response.headers.pop('Content-Length', None)
+            else:
+                response.data = gzip_compress(response.data)
+                response.headers['Content-Length'] = len(response.data)
 
             response.headers['Content-Encoding'] = 'gzip'
             response.vary.add('Accept-Encoding')
-            response.headers['Content-Length'] = len(response.data)
 
             return response
 
@@ -290,8 +294,13 @@ class URNLookupController(object):
         """
         self._db = _db
 
-    def work_lookup(self, annotator, route_name='lookup', **process_urn_kwargs):
-        """Generate an OPDS feed describing works identified by identifier."""
+    def work_lookup(self, annotator, route_name='lookup', stream=False,
+                    **process_urn_kwargs):
+        """Generate an OPDS feed describing works identified by identifier.
+
+        :param stream: If this is True, send the feed to the client a
+            piece at a time, as each entry is generated.
+        """
         urns = flask.request.args.getlist('urn')
 
         this_url = cdn_url_for(route_name, _external=True, urn=urns)
@@ -301,9 +310,21 @@ class URNLookupController(object):
             # In a subclass, self.process_urns may return a ProblemDetail
             return handler
 
+        if stream:
+            opds_feed = LookupAcquisitionFeed(
+                self._db, "Lookup results", this_url, [], annotator,
+                splice_cached_entries=True
+            )
+            return OPDSFeedResponse(
+                opds_feed.stream_works(
+                    handler.works, handler.precomposed_entries
+                )
+            )
+
         opds_feed = LookupAcquisitionFeed(
             self._db, "Lookup results", this_url, handler.works, annotator,
             precomposed_entries=handler.precomposed_entries,
+            splice_cached_entries=True
         )
         return OPDSFeedResponse(opds_feed)
 
@@ -95,6 +95,11 @@ class CoverageProviderProgress(TimestampData):
         # a single run of the CoverageProvider.
         self.offset = 0
 
+        # If these are set, only items whose IDs fall in this
+        # (inclusive) range will be given coverage.
+        self.min_id = None
+        self.max_id = None
+
         self.successes = 0
         self.transient_failures = 0
         self.persistent_failures = 0
@@ -283,6 +288,66 @@ class BaseCoverageProvider(object):
         # not just one.
         return progress
 
+    def run_on_id_range(self, min_id, max_id):
+        """Try to grant coverage to every item whose ID is in the given
+        range, as run_once_and_update_timestamp() does for every item.
+
+        The Timestamp is left alone; this is one shard of a larger
+        run, and whoever is running the shards is responsible for
+        combining their progress and writing the Timestamp.
+
+        :param min_id: The smallest ID to cover, or None for no limit.
+        :param max_id: The largest ID to cover, or None for no limit.
+        :return: A CoverageProviderProgress.
+        """
+        progress = CoverageProviderProgress(start=datetime.datetime.utcnow())
+        progress.min_id = min_id
+        progress.max_id = max_id
+        for covered_statuses in [
+            BaseCoverageRecord.PREVIOUSLY_ATTEMPTED,
+            BaseCoverageRecord.DEFAULT_COUNT_AS_COVERED
+        ]:
+            progress.finish = None
+            progress.offset = 0
+            while not progress.is_complete:
+                new_progress = self.run_once(
+                    progress, count_as_covered=covered_statuses
+                )
+                if new_progress is not None:
+                    progress = new_progress
+        return progress
+
+    def id_ranges(self, shards, count_as_covered=None):
+        """Split the items that need coverage into ranges of IDs, with
+        about the same number of items in each range.
+
+        The ranges are contiguous and the first and last are
+        open-ended, so every item falls in exactly one range, even if
+        it comes to need coverage after the ranges are calculated.
+
+        :param shards: The maximum number of ranges.
+        :return: A list of 2-tuples (min_id, max_id), suitable for
+            passing into run_on_id_range().
+        """
+        count_as_covered = (
+            count_as_covered or BaseCoverageRecord.DEFAULT_COUNT_AS_COVERED
+        )
+        column = self.item_id_column()
+        qu = self.items_that_need_coverage(count_as_covered=count_as_covered)
+        ids = qu.with_entities(
+            column.label('id'),
+            func.ntile(shards).over(order_by=column).label('shard')
+        ).subquery()
+        qu = self._db.query(func.min(ids.c.id)).group_by(
+            ids.c.shard
+        ).order_by(ids.c.shard)
+        starts = [start for [start] in qu]
+        if not starts:
+            return []
+        min_ids = [None] + starts[1:]
+        max_ids = [start-1 for start in starts[1:]] + [None]
+        return zip(min_ids, max_ids)
+
     @property
     def timestamp(self):
         """Look up the Timestamp object for this CoverageProvider."""
@@ -330,6 +395,7 @@ class BaseCoverageProvider(object):
         count_as_covered_message = ' (counting %s as covered)' % (', '.join(count_as_covered))
 
         qu = self.items_that_need_coverage(count_as_covered=count_as_covered)
+        qu = self.restrict_to_id_range(qu, progress.min_id, progress.max_id)
         self.log.info("%d items need coverage%s", qu.count(),
                       count_as_covered_message)
         batch = qu.limit(self.batch_size).offset(progress.offset)
@@ -385,8 +451,18 @@ class BaseCoverageProvider(object):
         # a list ensures that all subsequent code will run on the same items.
         batch = list(batch)
 
-        offset_increment = 0
         results = self.process_batch(batch)
+        return self.handle_batch_results(batch, results)
+
+    def handle_batch_results(self, batch, results):
+        """Record the results of processing a batch of items.
+
+        :param batch: A list of items.
+        :param results: A mixed list of items and CoverageFailures, as
+            returned by process_batch().
+        :return: A 2-tuple (counts, records), as with
+            process_batch_and_handle_results().
+        """
         successes = 0
         transient_failures = 0
         persistent_failures = 0
@@ -499,6 +575,17 @@ class BaseCoverageProvider(object):
         # cutoff_time.
         return coverage_record.timestamp < self.cutoff_time
 
+    def restrict_to_id_range(self, qu, min_id, max_id):
+        """Restrict a query for items that need coverage to items
+        whose IDs are in the given range.
+        """
+        column = self.item_id_column()
+        if min_id is not None:
+            qu = qu.filter(column >= min_id)
+        if max_id is not None:
+            qu = qu.filter(column <= max_id)
+        return qu
+
     def finalize_batch(self):
         """Do whatever is necessary to complete this batch before moving on to
         the next one.
@@ -524,6 +611,14 @@ class BaseCoverageProvider(object):
         """
         raise NotImplementedError()
 
+    def item_id_column(self):
+        """The database column holding the IDs of the items that
+        need coverage.
+
+        Implemented in IdentifierCoverageProvider and WorkCoverageProvider.
+        """
+        raise NotImplementedError()
+
     def add_coverage_record_for(self, item):
         """Add a coverage record for the given item.
 
@@ -981,6 +1076,9 @@ class IdentifierCoverageProvider(BaseCoverageProvider):
 
         return qu
 
+    def item_id_column(self):
+        return Identifier.id
+
     def add_coverage_record_for(self, item):
         """Record this CoverageProvider's coverage for the given
         Edition/Identifier, as a CoverageRecord.
@@ -1328,6 +1426,40 @@ class CollectionCoverageProviderJob(DatabaseJob):
         provider.finalize_timestampdata(self.progress)
 
 
+class CoverageProviderShardJob(DatabaseJob):
+    """Run a CoverageProvider on the items in one range of IDs.
+
+    The job is meant to be pickled and run in a DatabaseProcessPool's
+    worker process, so it keeps track of the provider's class and
+    Collection ID rather than the provider itself. Any
+    `provider_kwargs` must also be picklable.
+    """
+
+    def __init__(self, provider_class, min_id, max_id, collection_id=None,
+        **provider_kwargs
+    ):
+        self.provider_class = provider_class
+        self.min_id = min_id
+        self.max_id = max_id
+        self.collection_id = collection_id
+        self.provider_kwargs = provider_kwargs
+
+    def do_run(self, _db):
+        """Cover the items in this range.
+
+        :return: A 3-tuple (successes, transient failures, persistent
+            failures).
+        """
+        if self.collection_id is None:
+            provider = self.provider_class(_db, **self.provider_kwargs)
+        else:
+            collection = get_one(_db, Collection, id=self.collection_id)
+            provider = self.provider_class(collection, **self.provider_kwargs)
+        progress = provider.run_on_id_range(self.min_id, self.max_id)
+        return (progress.successes, progress.transient_failures,
+                progress.persistent_failures)
+
+
 class CatalogCoverageProvider(CollectionCoverageProvider):
     """Most CollectionCoverageProviders provide coverage to Identifiers
     that are licensed through a given Collection.
@@ -1430,6 +1562,9 @@ class WorkCoverageProvider(BaseCoverageProvider):
 
         return qu
 
+    def item_id_column(self):
+        return Work.id
+
     def failure(self, work, error, transient=True):
         """Create a CoverageFailure object."""
         return CoverageFailure(work, error, transient=transient)
@@ -1,6 +1,8 @@
 from collections import defaultdict
 import contextlib
+import copy
 import datetime
+import hashlib
 from nose.tools import set_trace
 import json
 from elasticsearch import Elasticsearch
@@ -48,6 +50,7 @@ from facets import FacetConstants
 from metadata_layer import IdentifierData
 from model import (
     numericrange_to_tuple,
+    site_configuration_is_settled,
     Collection,
     Contributor,
     ConfigurationSetting,
@@ -63,6 +66,7 @@ from lane import Pagination
 from monitor import WorkSweepMonitor
 from coverage import (
     CoverageFailure,
+    CoverageProviderProgress,
     WorkPresentationProvider,
 )
 from problem_details import INVALID_INPUT
@@ -70,14 +74,25 @@ from selftest import (
     HasSelfTests,
     SelfTestResult,
 )
+from util.cache import LRUCache
 from util.personal_names import display_name_to_sort_name
+from util.worker_pools import (
+    Job,
+    Pool,
+)
 from util.problem_detail import ProblemDetail
 from util.stopwords import ENGLISH_STOPWORDS
 
 import os
 import logging
+from Queue import (
+    Empty,
+    Queue,
+)
 import re
+from threading import Lock
 import time
+import traceback
 
 @contextlib.contextmanager
 def mock_search_index(mock=None):
@@ -128,6 +143,37 @@ class ExternalSearchIndex(HasSelfTests):
 
     SITEWIDE = True
 
+    # If this is set to an LRUCache, the results of recent searches
+    # are kept for a short time and reused. See enable_result_cache().
+    result_cache = None
+    DEFAULT_RESULT_CACHE_SIZE = 1000
+    DEFAULT_RESULT_CACHE_AGE = 5
+
+    @classmethod
+    def enable_result_cache(cls, max_size=None, max_age=None):
+        """Start reusing the results of recent searches.
+
+        This sheds repeated work from Elasticsearch when many
+        identical searches come in at once, e.g. requests for the same
+        grouped feed.
+
+        :param max_size: The maximum number of result sets to keep
+            in memory.
+        :param max_age: Results will be reused for this many seconds
+            after they're retrieved.
+        :return: The LRUCache, whose .stats can be used to monitor it.
+        """
+        cls.result_cache = LRUCache(
+            max_size or cls.DEFAULT_RESULT_CACHE_SIZE,
+            max_age=max_age or cls.DEFAULT_RESULT_CACHE_AGE
+        )
+        return cls.result_cache
+
+    @classmethod
+    def disable_result_cache(cls):
+        """Stop reusing the results of recent searches."""
+        cls.result_cache = None
+
     @classmethod
     def reset(cls):
         """Resets the __client object to None so a new configuration
@@ -440,6 +486,10 @@ class ExternalSearchIndex(HasSelfTests):
             fields = ["work_id"]
             if filter:
                 fields += filter.script_fields.keys()
+                # The caller may also want some data that _is_
+                # available through the database, to avoid having to
+                # go get it.
+                fields += filter.source_fields
 
         # Change the Search object so it only retrieves the fields
         # we're asking for.
@@ -482,6 +532,9 @@ class ExternalSearchIndex(HasSelfTests):
         """Run several queries simultaneously and return the results
         as a big list.
 
+        If the result cache is enabled, queries that were run
+        recently are not sent to Elasticsearch again.
+
         :param queries: A list of (query string, Filter, Pagination) 3-tuples,
             each representing an Elasticsearch query to be run.
 
@@ -498,53 +551,156 @@ class ExternalSearchIndex(HasSelfTests):
             for q in queries:
                 yield []
 
-        # Create a MultiSearch.
-        multi = MultiSearch(using=self.__client)
-
-        # Give it a Search object for every query definition passed in
+        # Create a Search object for every query definition passed in
         # as part of `queries`.
+        searches = []
         for (query_string, filter, pagination) in queries:
-            search = self.create_search_doc(
-                query_string, filter=filter, pagination=pagination, debug=debug
+            searches.append(
+                self._create_search(query_string, filter, pagination, debug)
             )
-            function_scores = filter.scoring_functions if filter else None
-            if function_scores:
-                function_score = FunctionScore(
-                    query=dict(match_all=dict()),
-                    functions=function_scores,
-                    score_mode="sum"
-                )
-                search = search.query(function_score)
-            multi = multi.add(search)
+        for results in self._run_searches(queries, searches, debug):
+            yield results
 
-        a = time.time()
-        # NOTE: This is the code that actually executes the ElasticSearch
-        # request.
-        resultset = [x for x in multi.execute()]
+    def query_works_with_facet_counts(self, query_string, filter,
+                                      pagination, facet_filters, debug=False):
+        """Run a search query and, in the same request, count the works
+        that match the same query string under each of a number of
+        other Filters.
 
-        if debug:
-            b = time.time()
-            self.log.debug(
-                "Elasticsearch query %r completed in %.3fsec",
-                query_string, b-a
+        This is how a feed finds out how many works it would contain
+        under each of its facets, while loading a page of the feed.
+
+        :param facet_filters: A list of Filter objects, usually one
+            per facet.
+        :return: A 2-tuple (results, counts). `results` is what
+            query_works() would return. `counts` contains one count
+            per item in `facet_filters`.
+        """
+        pagination = pagination or Pagination.default()
+        counts = [0] * len(facet_filters)
+        if not self.works_alias:
+            return [], counts
+        if isinstance(filter, Filter) and filter.match_nothing is True:
+            # There's no page of results to get, but the facets might
+            # still have something in them.
+            return [], self.count_works_multi(facet_filters, query_string)
+
+        search = self._create_search(query_string, filter, pagination, debug)
+        buckets = self._count_buckets(facet_filters, query_string)
+        if buckets:
+            # A 'global' aggregation ignores the query for the page of
+            # results, so each bucket is counted across the whole index.
+            search.aggs.bucket('facet_counts', 'global').bucket(
+                'counts', 'filters', filters=dict(buckets)
             )
-            for results in resultset:
-                for i, result in enumerate(results):
-                    self.log.debug(
-                        '%02d "%s" (%s) work=%s score=%.3f shard=%s',
-                        i, result.sort_title, result.sort_author, result.meta['id'],
-                        result.meta.explanation['value'] or 0, result.meta['shard']
-                    )
+        query_data = (query_string, filter, pagination)
+        [results] = self._run_searches([query_data], [search], debug)
+        if buckets:
+            self._read_counts(
+                results.aggregations.facet_counts.counts.buckets, counts
+            )
+        return results, counts
+
+    def _create_search(self, query_string, filter, pagination, debug):
+        """Create the Search object for one query, including any
+        scoring functions provided by the Filter.
+        """
+        search = self.create_search_doc(
+            query_string, filter=filter, pagination=pagination, debug=debug
+        )
+        function_scores = filter.scoring_functions if filter else None
+        if function_scores:
+            function_score = FunctionScore(
+                query=dict(match_all=dict()),
+                functions=function_scores,
+                score_mode="sum"
+            )
+            search = search.query(function_score)
+        return search
+
+    def _run_searches(self, queries, searches, debug):
+        """Get the results for a number of Search objects, from the
+        result cache if possible, and from Elasticsearch otherwise.
 
-        for i, results in enumerate(resultset):
+        :param queries: A list of (query string, Filter, Pagination)
+            3-tuples, one per Search.
+        :yield: A sequence of result sets, one per Search.
+        """
+        # Debugging output is only gathered when a query actually runs,
+        # so don't use the cache in debug mode.
+        cache = self.result_cache
+        if debug:
+            cache = None
+
+        resultset = [None] * len(searches)
+        keys = [None] * len(searches)
+        if cache is not None:
+            for i, search in enumerate(searches):
+                keys[i] = self.result_cache_key(search)
+                resultset[i] = cache.get(keys[i])
+        to_run = [i for i, results in enumerate(resultset) if results is None]
+
+        if to_run:
+            a = time.time()
+            executed = self._execute_searches([searches[i] for i in to_run])
+            for i, results in zip(to_run, executed):
+                resultset[i] = results
+                if cache is not None:
+                    cache.set(keys[i], results)
+
+            if debug:
+                b = time.time()
+                self.log.debug(
+                    "Elasticsearch queries %r completed in %.3fsec",
+                    [x[0] for x in queries], b-a
+                )
+                for results in resultset:
+                    for i, result in enumerate(results):
+                        self.log.debug(
+                            '%02d "%s" (%s) work=%s score=%.3f shard=%s',
+                            i, result.sort_title, result.sort_author,
+                            result.meta['id'],
+                            result.meta.explanation['value'] or 0,
+                            result.meta['shard']
+                        )
+
+        for (query_string, filter, pagination), results in zip(
+            queries, resultset
+        ):
             # Tell the Pagination object about the page that was just
-            # 'loaded' so that Pagination.next_page will work.
+            # 'loaded' so that Pagination.next_page will work. This
+            # happens whether or not the results came from the cache.
             #
             # The pagination itself happened inside the Elasticsearch
             # server when the query ran.
             pagination.page_loaded(results)
             yield results
 
+    def _execute_searches(self, searches):
+        """Send a number of Search objects to Elasticsearch as a single
+        MultiSearch.
+
+        :return: A list of result sets, one per Search.
+        """
+        multi = MultiSearch(using=self.__client)
+        for search in searches:
+            multi = multi.add(search)
+
+        # NOTE: This is the code that actually executes the ElasticSearch
+        # request.
+        return [x for x in multi.execute()]
+
+    def result_cache_key(self, search):
+        """The key under which the results of a Search are cached.
+
+        Two Searches have the same key if they would send the same
+        request to the same index -- including the same pagination.
+        """
+        return (
+            self.works_alias,
+            json.dumps(search.to_dict(), sort_keys=True, default=unicode)
+        )
+
     def count_works(self, filter):
         """Instead of retrieving works that match `filter`, count the total."""
         if filter is not None and filter.match_nothing is True:
@@ -556,6 +712,67 @@ class ExternalSearchIndex(HasSelfTests):
         )
         return qu.count()
 
+    # This many Filters are counted in a single 'filters' aggregation
+    # by count_works_multi.
+    COUNT_BATCH_SIZE = 100
+
+    def count_works_multi(self, filters, query_string=None):
+        """Count the works that match each of a number of Filters.
+
+        Rather than sending one count request per Filter, this turns
+        each Filter into a bucket of a 'filters' aggregation, and sends
+        all the aggregations as a single MultiSearch.
+
+        :param filters: A list of Filter objects.
+        :param query_string: Only count works that match this search
+            query.
+        :return: A list of counts, one per Filter.
+        """
+        counts = [0] * len(filters)
+        buckets = self._count_buckets(filters, query_string)
+
+        searches = []
+        for start in range(0, len(buckets), self.COUNT_BATCH_SIZE):
+            batch = dict(buckets[start:start+self.COUNT_BATCH_SIZE])
+            search = self.search.extra(size=0)
+            search.aggs.bucket('counts', 'filters', filters=batch)
+            searches.append(search)
+        if not searches:
+            return counts
+
+        for response in self._execute_searches(searches):
+            self._read_counts(response.aggregations.counts.buckets, counts)
+        return counts
+
+    def _count_buckets(self, filters, query_string=None):
+        """Turn a list of Filters into buckets for a 'filters'
+        aggregation.
+
+        :return: A list of (key, query) 2-tuples. The key is the
+            Filter's position in `filters`. A Filter known to match
+            nothing gets no bucket.
+        """
+        buckets = []
+        for i, filter in enumerate(filters):
+            if filter is not None and filter.match_nothing is True:
+                # We already know that the filter should match nothing.
+                continue
+            search = self.create_search_doc(
+                query_string=query_string, filter=filter, pagination=None,
+                debug=False
+            )
+            buckets.append((str(i), search.to_dict()['query']))
+        return buckets
+
+    def _read_counts(self, buckets, counts):
+        """Copy the document counts out of the buckets of a 'filters'
+        aggregation created from _count_buckets.
+
+        :param counts: A list of counts to be filled in.
+        """
+        for key in buckets:
+            counts[int(key)] = buckets[key].doc_count
+
     def bulk_update(self, works, retry_on_batch_failure=True):
         """Upload a batch of works to the search index at once."""
 
@@ -565,18 +782,101 @@ class ExternalSearchIndex(HasSelfTests):
             return [], []
 
         time1 = time.time()
-        needs_add = []
-        successes = []
-        for work in works:
-            needs_add.append(work)
-
-        # Add/update any works that need adding/updating.
-        docs = Work.to_search_documents(needs_add)
+        docs = self.search_documents(works)
+        docs, unchanged, fingerprints = self.skip_unchanged_documents(
+            works, docs
+        )
+        time2 = time.time()
+        docs, success_count, errors = self.upload_documents(
+            docs, retry_on_batch_failure
+        )
+        time3 = time.time()
+        self.log.info("Created %i search documents in %.2f seconds" % (len(docs) + len(unchanged), time2 - time1))
+        self.log.info("Uploaded %i search documents in  %.2f seconds" % (len(docs), time3 - time2))
+        return self.bulk_update_results(
+            works, docs + unchanged, success_count + len(unchanged), errors,
+            fingerprints
+        )
 
+    def search_documents(self, works):
+        """Create the search documents for a batch of works, ready to
+        be uploaded.
+        """
+        docs = Work.to_search_documents(works)
         for doc in docs:
             doc["_index"] = self.works_index
             doc["_type"] = self.work_document_type
-        time2 = time.time()
+        return docs
+
+    def stream_search_documents(self, _db, **kwargs):
+        """Create the search documents for a large number of works, a
+        chunk at a time, ready to be uploaded.
+
+        The Works don't need to be loaded. The keyword arguments are
+        passed into Work.stream_search_documents, and the same
+        warning applies: `_db` can't be committed until the generator
+        is exhausted.
+
+        :yield: A series of lists of search documents.
+        """
+        for docs in Work.stream_search_documents(_db, **kwargs):
+            for doc in docs:
+                doc["_index"] = self.works_index
+                doc["_type"] = self.work_document_type
+            yield docs
+
+    @classmethod
+    def fingerprint(cls, doc):
+        """Calculate a hash of a search document that changes only if
+        the document itself changes.
+
+        The document includes the name of its index, so moving to a
+        new index changes every fingerprint.
+        """
+        return hashlib.sha1(json.dumps(doc, sort_keys=True)).hexdigest()
+
+    def skip_unchanged_documents(self, works, docs):
+        """Find the search documents that are identical to the ones
+        most recently uploaded for their works.
+
+        There's no need to upload those documents again. This happens
+        a lot, since many changes that make a work need reindexing
+        (e.g. circulation events) don't change its search document.
+
+        :return: A 3-tuple (changed, unchanged, fingerprints).
+            `fingerprints` maps each work ID to the fingerprint of
+            its new document.
+        """
+        stored = dict(
+            (work.id, work.search_document_fingerprint) for work in works
+        )
+        changed = []
+        unchanged = []
+        fingerprints = {}
+        for doc in docs:
+            fingerprint = fingerprints[doc['_id']] = self.fingerprint(doc)
+            if fingerprint == stored.get(doc['_id']):
+                unchanged.append(doc)
+            else:
+                changed.append(doc)
+        if unchanged:
+            self.log.info(
+                "Skipping %d unchanged search documents.", len(unchanged)
+            )
+        return changed, unchanged, fingerprints
+
+    def upload_documents(self, docs, retry_on_batch_failure=True):
+        """Upload a batch of search documents.
+
+        This doesn't touch the database, so it's safe to call from
+        a thread other than the one that created the documents.
+
+        :return: A 3-tuple (docs, success_count, errors). If every
+            document failed to upload, even after a retry, `docs` is
+            empty.
+        """
+        if not docs:
+            return docs, 0, []
 
         success_count, errors = self.bulk(
             docs,
@@ -589,54 +889,122 @@ class ExternalSearchIndex(HasSelfTests):
         if len(errors) == len(docs):
             if retry_on_batch_failure:
                 self.log.info("Elasticsearch bulk update timed out, trying again.")
-                return self.bulk_update(needs_add, retry_on_batch_failure=False)
+                return self.upload_documents(docs, retry_on_batch_failure=False)
             else:
                 docs = []
+        return docs, success_count, errors
 
-        time3 = time.time()
-        self.log.info("Created %i search documents in %.2f seconds" % (len(docs), time2 - time1))
-        self.log.info("Uploaded %i search documents in  %.2f seconds" % (len(docs), time3 - time2))
+    def bulk_update_results(self, works, docs, success_count, errors,
+                            fingerprints=None):
+        """Find out which works in a batch were indexed, given the
+        outcome of uploading their search documents.
 
-        doc_ids = [d['_id'] for d in docs]
+        :param fingerprints: A dictionary mapping work IDs to the
+            fingerprints of their search documents. Each successfully
+            indexed work will remember its fingerprint.
 
-        # We weren't able to create search documents for these works, maybe
-        # because they don't have presentation editions yet.
-        def get_error_id(error):
-            return error.get('data', {}).get('_id', None) or error.get('index', {}).get('_id', None)
-        error_ids = [get_error_id(error) for error in errors]
+        :return: A 2-tuple (successes, failures). `successes` is a
+            list of Works; `failures` is a list of (Work, error message)
+            2-tuples.
+        """
+        # Everything here is done with sets and dictionaries keyed on
+        # work ID, so it takes time proportional to the size of the
+        # batch.
+        works_by_id = {}
+        for work in works:
+            works_by_id.setdefault(work.id, work)
+        doc_ids = set(d['_id'] for d in docs)
 
-        missing_works = [
-            work for work in works
-            if work.id not in doc_ids and work.id not in error_ids
-            and work not in successes
-        ]
+        errors = [self.upload_error(error) for error in errors]
+        error_ids = set(work_id for work_id, message in errors)
 
-        successes.extend(
-            [work for work in works
-             if work.id in doc_ids and work.id not in error_ids]
-        )
+        successes = []
+        missing_works = []
+        for work in works:
+            if work.id in error_ids:
+                continue
+            if work.id in doc_ids:
+                successes.append(work)
+            else:
+                missing_works.append(work)
+
+        if fingerprints:
+            for work in successes:
+                work.search_document_fingerprint = fingerprints.get(work.id)
 
         failures = []
         for missing in missing_works:
-            failures.append((work, "Work not indexed"))
+            failures.append((missing, "Work not indexed"))
 
-        for error in errors:
+        for work_id, error_message in errors:
+            failures.append((works_by_id.get(work_id), error_message))
 
-            error_id = get_error_id(error)
-            work = None
-            works_with_error = [work for work in works if work.id == error_id]
-            if works_with_error:
-                work = works_with_error[0]
+        self.log.info("Successfully indexed %i documents, failed to index %i." % (success_count, len(failures)))
 
-            exception = error.get('exception', None)
-            error_message = error.get('error', None)
-            if not error_message:
-                error_message = error.get('index', {}).get('error', None)
+        return successes, failures
 
-            failures.append((work, error_message))
+    @classmethod
+    def upload_error(cls, error):
+        """Find out what went wrong with one search document, given an
+        error from upload_documents().
 
-        self.log.info("Successfully indexed %i documents, failed to index %i." % (success_count, len(failures)))
+        :return: A 2-tuple (work ID, error message).
+        """
+        work_id = (
+            error.get('data', {}).get('_id', None)
+            or error.get('index', {}).get('_id', None)
+            or error.get('update', {}).get('_id', None)
+        )
+        error_message = error.get('error', None)
+        if not error_message:
+            error_message = error.get('index', {}).get('error', None)
+        if not error_message:
+            error_message = error.get('update', {}).get('error', None)
+        return work_id, error_message
+
+    def bulk_update_fields(self, works, fields):
+        """Update some of the fields in the search documents for a
+        batch of works, leaving the other fields alone.
+
+        A work that doesn't have a search document yet can't be
+        partially updated. It's registered for a full reindex instead.
+
+        :param fields: A list of field names, e.g.
+            Work.LICENSEPOOLS_SEARCH_FIELDS.
+        :return: A 2-tuple (successes, failures), as with bulk_update().
+        """
+        if not works:
+            return [], []
+
+        docs = Work.to_search_documents(works, fields=fields)
+        actions = [
+            dict(_op_type='update', _index=self.works_index,
+                 _type=self.work_document_type, _id=doc.pop('_id'), doc=doc)
+            for doc in docs
+        ]
+        ignore, success_count, errors = self.upload_documents(actions)
+
+        not_in_index = set()
+        real_errors = []
+        for error in errors:
+            update = error.get('update', {})
+            if '_id' in update:
+                # Elasticsearch reports document IDs as strings.
+                update['_id'] = int(update['_id'])
+            if update.get('status') == 404:
+                not_in_index.add(update.get('_id'))
+            else:
+                real_errors.append(error)
 
+        successes, failures = self.bulk_update_results(
+            works, actions, success_count + len(not_in_index), real_errors
+        )
+        for work in successes:
+            # The full search document has changed, so it will need to
+            # be uploaded the next time it's reindexed.
+            work.search_document_fingerprint = None
+            if work.id in not_in_index:
+                work.external_index_needs_updating()
         return successes, failures
 
     def remove_work(self, work):
@@ -646,6 +1014,7 @@ class ExternalSearchIndex(HasSelfTests):
                     id=work.id)
         if self.exists(**args):
             self.delete(**args)
+        work.search_document_fingerprint = None
 
     def _run_self_tests(self, _db, in_testing=False):
         # Helper methods for setting up the self-tests:
@@ -1408,6 +1777,28 @@ class Query(SearchBase):
     # a class-level instance.
     SPELLCHECKER = SpellChecker()
 
+    # If this is set to an LRUCache, the Elasticsearch-DSL query built
+    # for a query string will be reused the next time someone searches
+    # for the same string. See enable_query_cache().
+    query_cache = None
+    DEFAULT_QUERY_CACHE_SIZE = 1000
+
+    @classmethod
+    def enable_query_cache(cls, max_size=None):
+        """Start reusing the output of elasticsearch_query for repeated
+        query strings.
+
+        :param max_size: The maximum number of queries to keep in memory.
+        :return: The LRUCache, whose .stats can be used to monitor it.
+        """
+        cls.query_cache = LRUCache(max_size or cls.DEFAULT_QUERY_CACHE_SIZE)
+        return cls.query_cache
+
+    @classmethod
+    def disable_query_cache(cls):
+        """Stop reusing the output of elasticsearch_query."""
+        cls.query_cache = None
+
     def __init__(self, query_string, filter=None, use_query_parser=True):
         """Store a query string and filter.
 
@@ -1422,7 +1813,11 @@ class Query(SearchBase):
             build a subquery from the _remaining_ portion of a larger
             query string?
         """
-        self.query_string = query_string or ""
+        # Collapse runs of whitespace, so that query strings that
+        # differ only in whitespace build (and can share) the same
+        # Elasticsearch-dsl query.
+        self.words = (query_string or "").split()
+        self.query_string = " ".join(self.words)
         self.filter = filter
         self.use_query_parser = use_query_parser
 
@@ -1430,31 +1825,36 @@ class Query(SearchBase):
         # when generating the Elasticsearch-dsl query.
 
         # Check if the string contains English stopwords.
-        if query_string:
-            self.words = query_string.split()
-        else:
-            self.words = []
         self.contains_stopwords = query_string and any(
             word in ENGLISH_STOPWORDS for word in self.words
         )
 
-        # Determine how heavily to weight fuzzy hypotheses.
-        #
-        # The "fuzzy" version of a hypothesis tests the idea that
-        # someone meant to trigger the original hypothesis, but they
-        # made a typo.
-        #
-        # The strength of a fuzzy hypothesis is always lower than the
-        # non-fuzzy version of the same hypothesis.
-        #
-        # Depending on the query, the stregnth of a fuzzy hypothesis
-        # may be reduced even further -- that's determined here.
+        # How heavily to weight fuzzy hypotheses is calculated the
+        # first time it's needed, since it requires a spell check.
+        self._fuzzy_coefficient = None
+
+    @property
+    def fuzzy_coefficient(self):
+        """Determine how heavily to weight fuzzy hypotheses.
+
+        The "fuzzy" version of a hypothesis tests the idea that
+        someone meant to trigger the original hypothesis, but they
+        made a typo.
+
+        The strength of a fuzzy hypothesis is always lower than the
+        non-fuzzy version of the same hypothesis.
+
+        Depending on the query, the stregnth of a fuzzy hypothesis
+        may be reduced even further -- that's determined here.
+        """
+        if self._fuzzy_coefficient is not None:
+            return self._fuzzy_coefficient
         if self.words:
             if self.SPELLCHECKER.unknown(self.words):
                 # Spell check failed. This is the default behavior, if
                 # only because peoples' names will generally fail spell
                 # check. Fuzzy queries will be given their full weight.
-                self.fuzzy_coefficient = 1.0
+                self._fuzzy_coefficient = 1.0
             else:
                 # Everything seems to be spelled correctly. But sometimes
                 # a word can be misspelled as another word, e.g. "came" ->
@@ -1462,12 +1862,17 @@ class Query(SearchBase):
                 # still check the fuzzy hypotheses, but we can improve
                 # results overall by giving them only half their normal
                 # strength.
-                self.fuzzy_coefficient = 0.5
+                self._fuzzy_coefficient = 0.5
         else:
             # Since this query does not contain any words, there is no
             # risk that a word might be misspelled. Do not create or
             # run the 'fuzzy' hypotheses at all.
-            self.fuzzy_coefficient = 0
+            self._fuzzy_coefficient = 0
+        return self._fuzzy_coefficient
+
+    @fuzzy_coefficient.setter
+    def fuzzy_coefficient(self, value):
+        self._fuzzy_coefficient = value
 
     def build(self, elasticsearch, pagination=None):
         """Make an Elasticsearch-DSL Search object out of this query.
@@ -1550,9 +1955,40 @@ class Query(SearchBase):
         # All done!
         return search
 
+    @property
+    def query_cache_key(self):
+        """The key under which this query's elasticsearch_query is cached.
+
+        Whitespace in the query string was normalized in the
+        constructor, so query strings that differ only in whitespace
+        share a key.
+        """
+        return (
+            self.__class__, self.query_string, bool(self.use_query_parser)
+        )
+
     @property
     def elasticsearch_query(self):
-        """Build an Elasticsearch-DSL Query object for this query string."""
+        """Build an Elasticsearch-DSL Query object for this query string.
+
+        The result doesn't depend on the Filter. If the query cache is
+        enabled, it may be shared with other Query objects for the same
+        query string, so it must not be modified.
+        """
+        cache = self.query_cache
+        if cache is None:
+            return self._elasticsearch_query()
+        key = self.query_cache_key
+        query = cache.get(key)
+        if query is None:
+            query = self._elasticsearch_query()
+            cache.set(key, query)
+        return query
+
+    def _elasticsearch_query(self):
+        """Actually build an Elasticsearch-DSL Query object for this query
+        string, bypassing the cache.
+        """
 
         # The query will most likely be a dis_max query, which tests a
         # number of hypotheses about what the query string might
@@ -2124,14 +2560,107 @@ class Filter(SearchBase):
         Contributor.DIRECTOR_ROLE, Contributor.ACTOR_ROLE
     ]
 
+    # If this is set to an LRUCache, Filters created by from_worklist
+    # for Lanes will be kept around and reused. See
+    # enable_worklist_cache().
+    worklist_cache = None
+    DEFAULT_WORKLIST_CACHE_SIZE = 1000
+
+    @classmethod
+    def enable_worklist_cache(cls, max_size=None):
+        """Start reusing the Filters (and the Elasticsearch filters they
+        build) created by from_worklist.
+
+        Cached Filters are discarded whenever the site configuration
+        changes, since that's how changes to Lanes and Libraries are
+        announced.
+
+        :param max_size: The maximum number of Filters to keep in memory.
+        :return: The LRUCache, whose .stats can be used to monitor it.
+        """
+        cls.worklist_cache = LRUCache(
+            max_size or cls.DEFAULT_WORKLIST_CACHE_SIZE
+        )
+        return cls.worklist_cache
+
+    @classmethod
+    def disable_worklist_cache(cls):
+        """Stop reusing Filters created by from_worklist."""
+        cls.worklist_cache = None
+
+    @classmethod
+    def worklist_cache_key(cls, worklist, facets):
+        """Find the key under which the Filter for this WorkList and
+        faceting object should be cached.
+
+        :return: A tuple, or None if this Filter can't be cached.
+        """
+        # Only a Lane is guaranteed to be fully described by its
+        # database ID. Other WorkLists are configured in code, and
+        # any change to a Lane triggers a site configuration change.
+        from lane import Lane
+        if not isinstance(worklist, Lane) or worklist.id is None:
+            return None
+        if worklist.inherited_value('list_datasource_id') is not None:
+            # The Lane takes every CustomList from a DataSource, and a
+            # new list doesn't change the site configuration.
+            return None
+        if facets is None:
+            facets_key = None
+        else:
+            facets_key = facets.filter_cache_key
+            if facets_key is None:
+                return None
+        return (worklist.id, facets_key)
+
     @classmethod
     def from_worklist(cls, _db, worklist, facets):
         """Create a Filter that finds only works that belong in the given
         WorkList and EntryPoint.
 
+        If the worklist cache is enabled, a copy of a previously
+        created Filter may be returned instead of a new one.
+
         :param worklist: A WorkList
         :param facets: A SearchFacets object.
         """
+        cache = cls.worklist_cache
+        key = None
+        if cache is not None:
+            key = cls.worklist_cache_key(worklist, facets)
+        if key is None:
+            return cls._from_worklist(_db, worklist, facets)
+
+        stamp = Configuration._site_configuration_last_update()
+        is_current = lambda entry: entry[0] == stamp
+        entry = cache.get(key, is_valid=is_current)
+        if entry is None:
+            filter = cls._from_worklist(_db, worklist, facets)
+            state = copy.deepcopy(filter._state)
+            entry = (stamp, state, filter.build())
+            # Right after a change, another change might not update
+            # the timestamp, so the Filter can't be trusted for long.
+            if site_configuration_is_settled(stamp):
+                cache.set(key, entry)
+        else:
+            # Hand out a copy so the caller can modify it without
+            # affecting the cached version.
+            ignore, state, built = entry
+            filter = cls.__new__(cls)
+            filter.__dict__.update(copy.deepcopy(state))
+            if facets is not None:
+                # Scoring functions may have a random component
+                # (e.g. FeaturedFacets with no random seed), so they
+                # must not be reused from the cached Filter.
+                filter.scoring_functions = facets.scoring_functions(filter)
+        filter._prebuilt = entry[1:]
+        return filter
+
+    @classmethod
+    def _from_worklist(cls, _db, worklist, facets):
+        """Actually create a Filter for the given WorkList and EntryPoint,
+        bypassing the cache.
+        """
         library = worklist.get_library(_db)
         # For most configuration settings there is a single value --
         # either defined on the WorkList or defined by its parent.
@@ -2164,12 +2693,19 @@ class Filter(SearchBase):
             allow_holds = True
         else:
             allow_holds = library.allow_holds
+
+        # If the WorkList will turn search results directly into
+        # WorkSearchViews, we need to retrieve the data they use.
+        source_fields = None
+        if worklist.HYDRATE_FROM_SEARCH_INDEX:
+            source_fields = WorkSearchView.SOURCE_FIELDS
         return cls(
             collections, media, languages, fiction, audiences,
             target_age, genre_id_restrictions, customlist_id_restrictions,
             facets,
             excluded_audiobook_data_sources=excluded_audiobook_data_sources,
-            allow_holds=allow_holds, license_datasource=license_datasource_id
+            allow_holds=allow_holds, license_datasource=license_datasource_id,
+            source_fields=source_fields
         )
 
     def __init__(self, collections=None, media=None, languages=None,
@@ -2250,6 +2786,9 @@ class Filter(SearchBase):
         :param match_nothing: If this is set to True, the search will
         not even be performed -- we know for some other reason that an
         empty set of search results should be returned.
+
+        :param source_fields: A list of fields to retrieve from each
+        matching search document, in addition to the work ID.
         """
 
         if isinstance(collections, Library):
@@ -2313,6 +2852,8 @@ class Filter(SearchBase):
         identifiers = kwargs.pop('identifiers', [])
         self.identifiers = list(self._scrub_identifiers(identifiers))
 
+        self.source_fields = list(kwargs.pop('source_fields', None) or [])
+
         # At this point there should be no keyword arguments -- you can't pass
         # whatever you want into this method.
         if kwargs:
@@ -2382,6 +2923,19 @@ class Filter(SearchBase):
             return as_is
         return with_all_ages
 
+    @property
+    def _state(self):
+        """Everything that can affect the output of build().
+
+        This is used to tell whether a Filter that came out of the
+        worklist cache has been modified since. Scoring functions are
+        used by the query, not by build(), so they're left out.
+        """
+        return dict(
+            (k, v) for k, v in self.__dict__.items()
+            if k not in ('_prebuilt', 'scoring_functions')
+        )
+
     def build(self, _chain_filters=None):
         """Convert this object to an Elasticsearch Filter object.
 
@@ -2395,6 +2949,16 @@ class Filter(SearchBase):
         :param _chain_filters: Mock function to use instead of
             Filter._chain_filters
         """
+        prebuilt = getattr(self, '_prebuilt', None)
+        if (_chain_filters is None and prebuilt is not None
+            and prebuilt[0] == self._state):
+            # This Filter came out of the worklist cache and hasn't
+            # been modified since. Callers may add to the nested
+            # filters, so hand out copies of the lists.
+            f, nested_filters = prebuilt[1]
+            return f, defaultdict(
+                list, [(k, list(v)) for k, v in nested_filters.items()]
+            )
 
         # Since a Filter object can be modified after it's created, we
         # need to scrub all the inputs, whether or not they were
@@ -3126,6 +3690,117 @@ class WorkSearchResult(object):
         return getattr(self._work, k)
 
 
+class WorkSearchView(object):
+    """A lightweight stand-in for a Work, created directly from an
+    Elasticsearch search result.
+
+    Fields stored in the search document (title, author, and so on)
+    are available without touching the database. Accessing anything
+    else loads the real Work -- along with the Works for every other
+    WorkSearchView in the same batch, so that a feed full of
+    WorkSearchViews costs one database query rather than one per
+    entry, and no query at all if nothing needs the Works.
+
+    Like a WorkSearchResult, the raw Elasticsearch Hit is available as
+    ._hit.
+    """
+
+    # These fields are retrieved from the search document.
+    SOURCE_FIELDS = [
+        'title', 'sort_title', 'subtitle', 'series', 'series_position',
+        'author', 'sort_author', 'language', 'publisher', 'imprint',
+        'audience', 'summary', 'quality', 'rating', 'popularity',
+        'presentation_ready',
+    ]
+
+    # The Work attributes that can be read from the search document,
+    # mapped to the fields that hold them. Work.fiction isn't here,
+    # because the search document stores None as "Nonfiction".
+    WORK_ATTRIBUTES = dict((x, x) for x in SOURCE_FIELDS if x != 'summary')
+    WORK_ATTRIBUTES['summary_text'] = 'summary'
+
+    # The search document stores audiences with the spaces removed.
+    AUDIENCES = dict((x.replace(" ", ""), x) for x in Classifier.AUDIENCES)
+
+    def __init__(self, hit, batch):
+        """Constructor.
+
+        :param hit: An Elasticsearch Hit that includes the SOURCE_FIELDS.
+        :param batch: A WorkSearchViewBatch that can load the
+            corresponding Work when necessary.
+        """
+        self._hit = hit
+        self._batch = batch
+        self.id = hit.work_id
+
+    @classmethod
+    def can_hydrate(cls, hit):
+        """Does the given Hit contain the data needed to create a
+        WorkSearchView?
+        """
+        return 'work_id' in hit and cls.SOURCE_FIELDS[0] in hit
+
+    @classmethod
+    def for_resultsets(cls, resultsets, load_works):
+        """Convert a list of lists of Hits into a list of lists of
+        WorkSearchViews.
+
+        :param load_works: A function that takes a list of work IDs
+            and returns the corresponding Works. It will be called at
+            most once, the first time any of the WorkSearchViews needs
+            its Work.
+        """
+        work_ids = []
+        for resultset in resultsets:
+            work_ids.extend(hit.work_id for hit in resultset)
+        batch = WorkSearchViewBatch(work_ids, load_works)
+        return [[cls(hit, batch) for hit in resultset]
+                for resultset in resultsets]
+
+    @property
+    def _work(self):
+        """The real Work, loaded from the database if necessary."""
+        return self._batch.work(self.id)
+
+    def __getattr__(self, k):
+        if k in self.WORK_ATTRIBUTES:
+            value = getattr(self._hit, self.WORK_ATTRIBUTES[k], None)
+            if k == 'audience':
+                value = self.AUDIENCES.get(value, value)
+            return value
+        if k.startswith('__'):
+            raise AttributeError(k)
+        work = self._work
+        if work is None:
+            raise AttributeError(
+                "Work %s is no longer in the database, so %s is not available." % (
+                    self.id, k
+                )
+            )
+        return getattr(work, k)
+
+    def __repr__(self):
+        return "<WorkSearchView %s %r>" % (self.id, self.title)
+
+
+class WorkSearchViewBatch(object):
+    """Loads the Works behind a batch of WorkSearchViews, all at once,
+    the first time any of them is needed.
+    """
+
+    def __init__(self, work_ids, load_works):
+        self.work_ids = work_ids
+        self.load_works = load_works
+        self.works_by_id = None
+
+    def work(self, work_id):
+        if self.works_by_id is None:
+            self.works_by_id = dict(
+                (work.id, work) for work in self.load_works(self.work_ids)
+            )
+        return self.works_by_id.get(work_id)
+
+
 class MockExternalSearchIndex(ExternalSearchIndex):
 
     work_document_type = 'work-type'
@@ -3211,10 +3886,31 @@ class MockExternalSearchIndex(ExternalSearchIndex):
     def count_works(self, filter):
         return len(self.docs)
 
+    def count_works_multi(self, filters, query_string=None):
+        return [self.count_works(filter) for filter in filters]
+
+    def query_works_with_facet_counts(self, query_string, filter,
+                                      pagination, facet_filters, debug=False):
+        return (
+            self.query_works(query_string, filter, pagination, debug),
+            self.count_works_multi(facet_filters, query_string)
+        )
+
     def bulk(self, docs, **kwargs):
+        errors = []
         for doc in docs:
+            if doc.get('_op_type') == 'update':
+                key = self._key(doc['_index'], doc['_type'], doc['_id'])
+                if key not in self.docs:
+                    errors.append(
+                        dict(update=dict(_id=doc['_id'], status=404,
+                                         error="document missing"))
+                    )
+                    continue
+                self.docs[key].update(doc['doc'])
+                continue
             self.index(doc['_index'], doc['_type'], doc['_id'], doc)
-        return len(docs), []
+        return len(docs) - len(errors), errors
 
 class MockMeta(dict):
     """Mock the .meta object associated with an Elasticsearch search
@@ -3247,6 +3943,153 @@ class MockSearchResult(object):
         }
 
 
+class UploadJob(Job):
+    """Upload one batch of search documents, as part of a
+    SearchIndexPipeline.
+    """
+
+    def __init__(self, pipeline, works, docs, unchanged, fingerprints):
+        self.pipeline = pipeline
+        self.works = works
+        self.docs = docs
+        self.unchanged = unchanged
+        self.fingerprints = fingerprints
+
+    def do_run(self):
+        start = time.time()
+        try:
+            outcome = self.pipeline.search_index.upload_documents(self.docs)
+        except Exception, e:
+            outcome = e
+        self.pipeline.count(
+            self.pipeline.UPLOAD, len(self.docs), time.time() - start
+        )
+        self.pipeline.finished.put((self, outcome))
+
+
+class SearchIndexPipeline(object):
+    """Update the search documents for a large number of works,
+    creating the documents for one batch while earlier batches are
+    being uploaded.
+
+    Creating documents needs the database, so it happens in the
+    calling thread. Uploading only needs the search index, so it's
+    done by a pool of threads. When the uploads fall behind, the
+    calling thread waits rather than piling up documents in memory.
+    """
+
+    # The stages of the pipeline.
+    CREATE = 'create'
+    UPLOAD = 'upload'
+    RECORD = 'record'
+
+    DEFAULT_UPLOADERS = 2
+
+    def __init__(self, search_index, uploaders=None, max_pending=None):
+        """Constructor.
+
+        :param search_index: An ExternalSearchIndex.
+        :param uploaders: The number of batches to upload at once.
+        :param max_pending: The number of batches that may wait for
+            an uploader before the calling thread stops creating new
+            ones. By default, this is the number of uploaders.
+        """
+        self.search_index = search_index
+        self.uploaders = uploaders or self.DEFAULT_UPLOADERS
+        self.max_pending = max_pending or self.uploaders
+        self.finished = Queue()
+        self.log = logging.getLogger("Search index pipeline")
+        self._lock = Lock()
+        self.stats = dict(
+            (stage, dict(batches=0, items=0, seconds=0.0))
+            for stage in (self.CREATE, self.UPLOAD, self.RECORD)
+        )
+        self.elapsed = 0
+
+    def count(self, stage, items, seconds):
+        """Note that a stage of the pipeline processed a batch."""
+        with self._lock:
+            stats = self.stats[stage]
+            stats['batches'] += 1
+            stats['items'] += items
+            stats['seconds'] += seconds
+
+    def run(self, batches, handle_results):
+        """Update the search documents for every work in `batches`.
+
+        :param batches: An iterable of lists of Works. This will be
+            consumed in the calling thread, so it may run database
+            queries.
+        :param handle_results: A function to be called, in the
+            calling thread, with the outcome of each batch: a list of
+            Works, a list of Works that were indexed, and a list of
+            (Work, error message) 2-tuples for Works that weren't.
+        """
+        start = time.time()
+        pool = Pool(self.uploaders, max_queue_size=self.max_pending)
+        for works in batches:
+            created = time.time()
+            docs = self.search_index.search_documents(works)
+            docs, unchanged, fingerprints = (
+                self.search_index.skip_unchanged_documents(works, docs)
+            )
+            self.count(
+                self.CREATE, len(docs) + len(unchanged), time.time() - created
+            )
+
+            # If the uploaders are busy, this waits until one of them
+            # is free.
+            pool.put(UploadJob(self, works, docs, unchanged, fingerprints))
+            self.handle_finished(handle_results)
+
+        pool.join()
+        self.handle_finished(handle_results)
+        self.elapsed = time.time() - start
+        self.log_stats()
+
+    def handle_finished(self, handle_results):
+        """Pass along the outcome of every batch that has been uploaded
+        since the last time this was called.
+        """
+        while True:
+            try:
+                job, outcome = self.finished.get(block=False)
+            except Empty:
+                return
+            start = time.time()
+            works = job.works
+            if isinstance(outcome, Exception):
+                # The unchanged documents didn't need uploading, so
+                # their works are still fine.
+                unchanged = set(doc['_id'] for doc in job.unchanged)
+                successes = [work for work in works if work.id in unchanged]
+                failures = [
+                    (work, repr(outcome)) for work in works
+                    if work.id not in unchanged
+                ]
+            else:
+                docs, success_count, errors = outcome
+                successes, failures = self.search_index.bulk_update_results(
+                    works, docs + job.unchanged,
+                    success_count + len(job.unchanged), errors,
+                    job.fingerprints
+                )
+            handle_results(works, successes, failures)
+            self.count(self.RECORD, len(works), time.time() - start)
+
+    def log_stats(self):
+        """Log how quickly each stage of the pipeline did its work."""
+        for stage in (self.CREATE, self.UPLOAD, self.RECORD):
+            stats = self.stats[stage]
+            seconds = stats['seconds']
+            rate = stats['items'] / seconds if seconds else 0
+            self.log.info(
+                "%s: %d batches, %d items in %.2f sec (%.1f/sec)",
+                stage, stats['batches'], stats['items'], seconds, rate
+            )
+        self.log.info("Total time: %.2f sec", self.elapsed)
+
+
 class SearchIndexCoverageProvider(WorkPresentationProvider):
     """Make sure all Works have up-to-date representation in the
     search index.
@@ -3258,19 +4101,184 @@ class SearchIndexCoverageProvider(WorkPresentationProvider):
 
     OPERATION = WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
 
+    # When search documents are streamed, about this many batches are
+    # read through one server-side cursor before the work done so far
+    # is committed.
+    BATCHES_PER_STREAM = 20
+
     def __init__(self, *args, **kwargs):
+        """Constructor.
+
+        :param search_index_client: An ExternalSearchIndex.
+        :param uploaders: If this is set, works are covered by a
+            SearchIndexPipeline with this many uploaders, rather than
+            one batch at a time.
+        :param streamed: If this is True, works are covered by
+            run_streamed(), without being loaded.
+        """
         search_index_client = kwargs.pop('search_index_client', None)
+        self.uploaders = kwargs.pop('uploaders', None)
+        self.streamed = kwargs.pop('streamed', False)
         super(SearchIndexCoverageProvider, self).__init__(*args, **kwargs)
         self.search_index_client = (
             search_index_client or ExternalSearchIndex(self._db)
         )
 
+    def run_once_and_update_timestamp(self):
+        if self.uploaders:
+            return self.run_pipelined()
+        if self.streamed:
+            return self.run_streamed()
+        return super(
+            SearchIndexCoverageProvider, self
+        ).run_once_and_update_timestamp()
+
+    def run_streamed(self):
+        """Cover every Work that needs coverage, without loading the
+        Works.
+
+        Search documents are created by the database and read through
+        a server-side cursor, a batch at a time, and the coverage
+        records are written by ID. This keeps memory use flat during a
+        full rebuild of the search index, however many Works there are.
+
+        Works that don't get a search document (most likely because
+        they have no presentation edition) are left uncovered, so the
+        next normal run will look at them again. Unlike process_batch,
+        this doesn't record search document fingerprints, so the next
+        normal run can't skip unchanged documents; that's why
+        RebuildSearchIndexScript only streams when asked to.
+
+        :return: A CoverageProviderProgress.
+        """
+        progress = CoverageProviderProgress(
+            start=datetime.datetime.utcnow()
+        )
+        client = self.search_index_client
+        needs_coverage = self.items_that_need_coverage()
+        shards = 1 + (
+            needs_coverage.count() / (self.batch_size * self.BATCHES_PER_STREAM)
+        )
+        try:
+            for min_id, max_id in self.id_ranges(shards):
+                work_ids = self.restrict_to_id_range(
+                    needs_coverage, min_id, max_id
+                ).with_entities(Work.id).statement
+                for docs in client.stream_search_documents(
+                    self._db, work_ids=work_ids, chunk_size=self.batch_size
+                ):
+                    docs, success_count, errors = client.upload_documents(docs)
+                    self.record_streamed_results(docs, errors, progress)
+                self.finalize_batch()
+        except Exception, e:
+            self.log.error(
+                "CoverageProvider %s raised uncaught exception.",
+                self.service_name, exc_info=e
+            )
+            progress.exception = traceback.format_exc()
+        progress.finish = datetime.datetime.utcnow()
+        return progress
+
+    def record_streamed_results(self, docs, errors, progress):
+        """Record the outcome of uploading a batch of streamed search
+        documents.
+
+        :param docs: The documents that were uploaded.
+        :param errors: The errors returned by upload_documents().
+        :param progress: A CoverageProviderProgress to be updated.
+        """
+        failures = defaultdict(list)
+        for error in errors:
+            work_id, message = ExternalSearchIndex.upload_error(error)
+            if work_id is not None:
+                failures[message].append(int(work_id))
+        failed = set(work_id for ids in failures.values() for work_id in ids)
+        successes = [doc['_id'] for doc in docs if doc['_id'] not in failed]
+
+        WorkCoverageRecord.bulk_add_ids(
+            self._db, successes, self.operation
+        )
+        for message, work_ids in failures.items():
+            if not isinstance(message, basestring):
+                message = repr(message)
+            WorkCoverageRecord.bulk_add_ids(
+                self._db, work_ids, self.operation,
+                status=WorkCoverageRecord.TRANSIENT_FAILURE,
+                exception=message
+            )
+        progress.successes += len(successes)
+        progress.transient_failures += len(failed)
+
+    def run_pipelined(self):
+        """Cover every Work that needs coverage, using a
+        SearchIndexPipeline.
+
+        :return: A CoverageProviderProgress.
+        """
+        progress = CoverageProviderProgress(
+            start=datetime.datetime.utcnow()
+        )
+
+        def handle_results(works, successes, failures):
+            (successes, transient_failures, persistent_failures), records = (
+                self.handle_batch_results(
+                    works, self.coverage_results(successes, failures)
+                )
+            )
+            progress.successes += successes
+            progress.transient_failures += transient_failures
+            progress.persistent_failures += persistent_failures
+
+        pipeline = SearchIndexPipeline(
+            self.search_index_client, self.uploaders
+        )
+
+        # Works from a batch are still needed after the session has
+        # been committed for an earlier batch. Reloading them would
+        # mean a query per work.
+        expire_on_commit = self._db.expire_on_commit
+        self._db.expire_on_commit = False
+        try:
+            pipeline.run(self.batches(), handle_results)
+        except Exception, e:
+            self.log.error(
+                "CoverageProvider %s raised uncaught exception.",
+                self.service_name, exc_info=e
+            )
+            progress.exception = traceback.format_exc()
+        finally:
+            self._db.expire_on_commit = expire_on_commit
+        progress.finish = datetime.datetime.utcnow()
+        return progress
+
+    def batches(self):
+        """Find the Works that need coverage, one batch at a time.
+
+        Works are found in order of ID, so a batch that's still being
+        uploaded won't show up again.
+        """
+        last_id = None
+        while True:
+            qu = self.items_that_need_coverage()
+            if last_id is not None:
+                qu = qu.filter(Work.id > last_id)
+            works = qu.order_by(Work.id).limit(self.batch_size).all()
+            if not works:
+                return
+            last_id = works[-1].id
+            yield works
+
     def process_batch(self, works):
         """
         :return: a mixed list of Works and CoverageFailure objects.
         """
         successes, failures = self.search_index_client.bulk_update(works)
+        return self.coverage_results(successes, failures)
 
+    def coverage_results(self, successes, failures):
+        """Turn the outcome of a bulk update into a mixed list of Works
+        and CoverageFailure objects.
+        """
         records = list(successes)
         for (work, error) in failures:
             if not isinstance(error, basestring):
@@ -3278,3 +4286,38 @@ class SearchIndexCoverageProvider(WorkPresentationProvider):
             records.append(CoverageFailure(work, error))
 
         return records
+
+
+class SearchIndexLicensePoolsCoverageProvider(SearchIndexCoverageProvider):
+    """Make sure the parts of Works' search documents that describe
+    their LicensePools are up to date.
+
+    This is much cheaper than reindexing the whole document, and it
+    runs separately from SearchIndexCoverageProvider, so availability
+    changes don't have to wait behind full reindexing.
+    """
+
+    SERVICE_NAME = 'Search index license pool coverage provider'
+
+    OPERATION = WorkCoverageRecord.UPDATE_SEARCH_INDEX_LICENSEPOOLS_OPERATION
+
+    FIELDS = Work.LICENSEPOOLS_SEARCH_FIELDS
+
+    def __init__(self, *args, **kwargs):
+        # Only Works that have been registered as needing this update
+        # get it. Everything else is handled by the full reindex.
+        kwargs.setdefault('registered_only', True)
+        super(SearchIndexLicensePoolsCoverageProvider, self).__init__(
+            *args, **kwargs
+        )
+        # SearchIndexPipeline only does full updates.
+        self.uploaders = None
+
+    def process_batch(self, works):
+        """
+        :return: a mixed list of Works and CoverageFailure objects.
+        """
+        successes, failures = self.search_index_client.bulk_update_fields(
+            works, self.FIELDS
+        )
+        return self.coverage_results(successes, failures)
@@ -1,7 +1,11 @@
 # encoding: utf-8
-from collections import defaultdict
+from collections import (
+    defaultdict,
+    namedtuple,
+)
 from nose.tools import set_trace
 import datetime
+import json
 import logging
 import time
 import urllib
@@ -45,6 +49,8 @@ from sqlalchemy.orm import (
     lazyload,
     relationship,
 )
+from sqlalchemy.orm.attributes import instance_state
+from sqlalchemy.sql import operators
 from sqlalchemy.sql.expression import literal
 
 from entrypoint import (
@@ -56,6 +62,7 @@ from model import (
     get_one_or_create,
     numericrange_to_tuple,
     site_configuration_has_changed,
+    site_configuration_is_settled,
     tuple_to_numericrange,
     Base,
     CachedFeed,
@@ -81,6 +88,7 @@ from util import (
     fast_query_count,
     LanguageCodes,
 )
+from util.cache import LRUCache
 from util.problem_detail import ProblemDetail
 from util.accept_language import parse_accept_language
 from util.opds_writer import OPDSFeed
@@ -116,6 +124,11 @@ class BaseFacets(FacetConstants):
     # generated using them should be cached.
     max_cache_age = None
 
+    # If the number of works under each facet was counted while a page
+    # of works was loaded, the counts are kept here, in a dictionary
+    # keyed by (facet group, facet value).
+    facet_counts = None
+
     def items(self):
         """Yields a 2-tuple for every active facet setting.
 
@@ -143,6 +156,21 @@ class BaseFacets(FacetConstants):
         """
         return "&".join("=".join(x) for x in sorted(self.items()))
 
+    @property
+    def filter_cache_key(self):
+        """A hashable value that captures everything this faceting
+        object does to a search Filter.
+
+        Two faceting objects with the same key must modify a Filter in
+        exactly the same way. That's what lets
+        external_search.Filter.from_worklist reuse a Filter built for
+        one of them when it sees the other.
+
+        :return: A tuple, or None if Filters built with this faceting
+            object should never be cached.
+        """
+        return None
+
     @property
     def facet_groups(self):
         """Yield a list of 4-tuples
@@ -159,6 +187,15 @@ class BaseFacets(FacetConstants):
         """Ignore all entry points, even if the WorkList supports them."""
         return []
 
+    def countable_facets(self, worklist):
+        """Yield a 3-tuple (facet group, facet value, new faceting object)
+        for every facet whose works can be counted.
+
+        Only facets that change which works are in a feed can be
+        counted, so sort orders are never included.
+        """
+        return []
+
     def modify_search_filter(self, filter):
         """Modify an external_search.Filter object to filter out works
         excluded by the business logic of this faceting class.
@@ -221,6 +258,17 @@ class FacetsWithEntryPoint(BaseFacets):
             return []
         return worklist.entrypoints
 
+    def countable_facets(self, worklist):
+        """Count the works under each selectable EntryPoint."""
+        entrypoints = self.selectable_entrypoints(worklist)
+        if len(entrypoints) < 2:
+            return
+        for entrypoint in entrypoints:
+            yield (
+                self.ENTRY_POINT_FACET_GROUP_NAME, entrypoint.INTERNAL_NAME,
+                self.navigate(entrypoint=entrypoint)
+            )
+
     def navigate(self, entrypoint):
         """Create a very similar FacetsWithEntryPoint that points to
         a different EntryPoint.
@@ -372,6 +420,13 @@ class FacetsWithEntryPoint(BaseFacets):
                 value = self.max_cache_age
             yield (self.MAX_CACHE_AGE_NAME, unicode(value))
 
+    @property
+    def filter_cache_key(self):
+        """Everything that affects a Filter shows up in the query
+        string, except for the facet class itself.
+        """
+        return (self.__class__.__name__, self.query_string)
+
     def modify_search_filter(self, filter):
         """Modify the given external_search.Filter object
         so that it reflects this set of facets.
@@ -635,6 +690,28 @@ class Facets(FacetsWithEntryPoint):
             for facet in collection_facets:
                 yield dy(facet)
 
+    def countable_facets(self, worklist):
+        """Count the works under each selectable EntryPoint and each
+        availability and collection facet.
+        """
+        for facet in super(Facets, self).countable_facets(worklist):
+            yield facet
+        for group, value, facets, selected in self.facet_groups:
+            if group != self.ORDER_FACET_GROUP_NAME:
+                yield group, value, facets
+
+    @property
+    def filter_cache_key(self):
+        """The sort direction and the library's featured quality
+        affect the Filter but aren't in the query string.
+        """
+        library_id = None
+        if self.library:
+            library_id = self.library.id
+        return super(Facets, self).filter_cache_key + (
+            self.order_ascending, library_id
+        )
+
     def modify_search_filter(self, filter):
         """Modify the given external_search.Filter object
         so that it reflects the settings of this Facets object.
@@ -882,6 +959,12 @@ class FeaturedFacets(FacetsWithEntryPoint):
         entrypoint = entrypoint or self.entrypoint
         return self.__class__(minimum_featured_quality, entrypoint, max_cache_age=self.max_cache_age)
 
+    @property
+    def filter_cache_key(self):
+        return super(FeaturedFacets, self).filter_cache_key + (
+            self.minimum_featured_quality, self.random_seed
+        )
+
     def modify_search_filter(self, filter):
         super(FeaturedFacets, self).modify_search_filter(filter)
         filter.minimum_featured_quality = self.minimum_featured_quality
@@ -1031,6 +1114,13 @@ class SearchFacets(Facets):
             entrypoints.insert(0, EverythingEntryPoint)
         return entrypoints
 
+    @property
+    def filter_cache_key(self):
+        """Search filters depend on the patron's languages and media,
+        so they're never cached.
+        """
+        return None
+
     def modify_search_filter(self, filter):
         """Modify the given external_search.Filter object
         so that it reflects this SearchFacets object.
@@ -1236,6 +1326,236 @@ class Pagination(object):
         self.page_has_loaded = True
 
 
+class DatabaseSortKeyPagination(Pagination):
+    """A database-specific implementation of Pagination that pages
+    through a sorted query by tracking the sort values of the last
+    item on the previous page, rather than using OFFSET.
+
+    With OFFSET, the database has to find and then throw away every
+    item on every earlier page, so deep pages get slower and slower.
+    Seeking past the last item means a deep page costs about the same
+    as the first one.
+
+    This works with any query ordered by fields of the `works` and
+    `editions` tables, such as the queries generated by
+    DatabaseBackedWorkList.works_from_database and
+    DatabaseBackedFacets. The last field in the sort order must be
+    unique (e.g. Work.id), or some items will be skipped.
+    """
+
+    # To find the sort values for a Work on a page, we need to know
+    # where to look for each table that might be in the ORDER BY
+    # clause.
+    SORT_VALUE_SOURCES = {
+        Work.__tablename__ : lambda work: work,
+        Edition.__tablename__ : lambda work: work.presentation_edition,
+    }
+
+    def __init__(self, last_item_on_previous_page=None,
+                 size=Pagination.DEFAULT_SIZE):
+        self.size = size
+        self.last_item_on_previous_page = last_item_on_previous_page
+        self.max_size = self.MAX_SIZE
+
+        # This is set by modify_database_query(), once we know how
+        # the query is sorted.
+        self.sort_fields = None
+
+        # These variables are set by page_loaded(), after the query
+        # is run.
+        self.page_has_loaded = False
+        self.last_item_on_this_page = None
+        self.this_page_size = None
+
+    @classmethod
+    def default(cls):
+        return cls(None, cls.DEFAULT_SIZE)
+
+    @classmethod
+    def from_request(cls, get_arg, default_size=None):
+        """Instantiate a DatabaseSortKeyPagination object from a Flask
+        request.
+        """
+        size = cls.size_from_request(get_arg, default_size)
+        if isinstance(size, ProblemDetail):
+            return size
+        pagination_key = get_arg('key', None)
+        if pagination_key:
+            try:
+                pagination_key = json.loads(pagination_key)
+            except ValueError, e:
+                pagination_key = None
+            if not isinstance(pagination_key, list):
+                return INVALID_INPUT.detailed(
+                    _("Invalid page key: %(key)s", key=get_arg('key', None))
+                )
+        return cls(pagination_key, size)
+
+    def items(self):
+        """Yield the URL arguments necessary to convey the current page
+        state.
+        """
+        pagination_key = self.pagination_key
+        if pagination_key:
+            yield("key", pagination_key)
+        yield("size", self.size)
+
+    @property
+    def pagination_key(self):
+        """Create the pagination key for this page."""
+        if not self.last_item_on_previous_page:
+            return None
+        return json.dumps(self.last_item_on_previous_page)
+
+    @property
+    def offset(self):
+        # This object never uses the traditional offset system; offset
+        # is determined relative to the last item on the previous
+        # page.
+        return 0
+
+    @property
+    def total_size(self):
+        # We never count the whole result set.
+        return None
+
+    @property
+    def first_page(self):
+        return DatabaseSortKeyPagination(None, self.size)
+
+    @property
+    def previous_page(self):
+        # Like SortKeyPagination, we can only move forward.
+        return None
+
+    @property
+    def next_page(self):
+        """If possible, create a new DatabaseSortKeyPagination
+        representing the next page of results.
+        """
+        if self.this_page_size == 0:
+            # This page is empty; there is no next page.
+            return None
+        if not self.last_item_on_this_page:
+            # This probably means page_loaded wasn't called. At any
+            # rate, we can't say anything about the next page.
+            return None
+        return DatabaseSortKeyPagination(self.last_item_on_this_page, self.size)
+
+    @classmethod
+    def _sort_fields(cls, qu):
+        """Find the fields a query is ordered by.
+
+        :return: A list of (column, ascending) 2-tuples.
+        """
+        sort_fields = []
+        for clause in (qu._order_by or []):
+            ascending = True
+            if getattr(clause, 'modifier', None) in (
+                operators.asc_op, operators.desc_op
+            ):
+                ascending = (clause.modifier is operators.asc_op)
+                clause = clause.element
+            table = getattr(clause, 'table', None)
+            if getattr(table, 'name', None) not in cls.SORT_VALUE_SOURCES:
+                raise ValueError(
+                    "DatabaseSortKeyPagination can't paginate a query ordered by %r" % clause
+                )
+            sort_fields.append((clause, ascending))
+        return sort_fields
+
+    @classmethod
+    def _after(cls, sort_fields, values):
+        """Build a clause matching rows that sort after the given values.
+
+        This is a row comparison that respects the direction of each
+        field. PostgreSQL puts NULLs last in an ascending sort and
+        first in a descending sort, so they need special handling.
+        """
+        (field, ascending), value = sort_fields[0], values[0]
+        if value is None:
+            equal = field == None
+            if ascending:
+                after = None
+            else:
+                after = field != None
+        else:
+            equal = field == value
+            if ascending:
+                after = or_(field > value, field == None)
+            else:
+                after = field < value
+
+        if len(sort_fields) > 1:
+            equal_and_after = and_(
+                equal, cls._after(sort_fields[1:], values[1:])
+            )
+            if after is None:
+                return equal_and_after
+            return or_(after, equal_and_after)
+        if after is None:
+            return literal(False)
+        return after
+
+    def modify_database_query(self, _db, qu):
+        """Modify the given database query so that it starts picking up
+        items immediately after the previous page, and returns no more
+        than one page of results.
+        """
+        if not qu._order_by:
+            # Keyset pagination only makes sense for a sorted query.
+            # Work ID is unique and compatible with the DISTINCT ON
+            # clause put on the query by works_from_database.
+            qu = qu.order_by(Work.id)
+        self.sort_fields = self._sort_fields(qu)
+
+        if self.last_item_on_previous_page:
+            if len(self.last_item_on_previous_page) != len(self.sort_fields):
+                raise ValueError(
+                    "Page key %r doesn't match a query sorted by %d fields." % (
+                        self.last_item_on_previous_page, len(self.sort_fields)
+                    )
+                )
+            qu = qu.filter(
+                self._after(self.sort_fields, self.last_item_on_previous_page)
+            )
+        return qu.limit(self.size)
+
+    def modify_search_query(self, search):
+        raise NotImplementedError(
+            "DatabaseSortKeyPagination does not work with search queries."
+        )
+
+    def page_loaded(self, page):
+        """An actual page of results has been fetched. Keep any internal state
+        that would be useful to know when reasoning about earlier or
+        later pages.
+
+        Specifically, keep track of the sort values of the last item
+        on this page, so that self.next_page will create a
+        DatabaseSortKeyPagination object capable of generating the
+        subsequent page.
+
+        :param page: A list of Works.
+        """
+        super(DatabaseSortKeyPagination, self).page_loaded(page)
+        if page and self.sort_fields:
+            last_item = page[-1]
+            values = []
+            for field, ascending in self.sort_fields:
+                source = self.SORT_VALUE_SOURCES[field.table.name](last_item)
+                value = getattr(source, field.key, None)
+                if isinstance(value, datetime.datetime):
+                    value = value.isoformat()
+                values.append(value)
+        else:
+            # There's nothing on this page, so there's no next page
+            # either -- or we never saw the query, so we don't know
+            # what the sort values are.
+            values = None
+        self.last_item_on_this_page = values
+
+
 class WorkList(object):
     """An object that can obtain a list of Work objects for use
     in generating an OPDS feed.
@@ -1258,6 +1578,18 @@ class WorkList(object):
     # By default, a WorkList does not draw from CustomLists
     uses_customlists = False
 
+    # If this is True, search results are turned into WorkSearchView
+    # objects built from the search documents themselves, rather than
+    # into Works loaded from the database. The Works are only loaded
+    # if something needs data that's not in the search document.
+    HYDRATE_FROM_SEARCH_INDEX = False
+
+    # If this is True, then whenever works() or search() loads a page
+    # of works from the search index, the works under each of the
+    # feed's facets are counted in the same request. The counts end
+    # up in the feed, and are cached along with it.
+    INCLUDE_FACET_COUNTS = False
+
     def max_cache_age(self, type):
         """Determine how long a feed for this WorkList should be cached
         internally.
@@ -1747,12 +2079,39 @@ class WorkList(object):
         )
         search_engine = search_engine or ExternalSearchIndex.load(_db)
         filter = self.filter(_db, facets)
-        hits = search_engine.query_works(
-            query_string=None, filter=filter, pagination=pagination,
-            debug=debug
-        )
+        if self.INCLUDE_FACET_COUNTS and facets is not None:
+            hits = self.query_works_with_facet_counts(
+                _db, search_engine, None, filter, pagination, facets, debug
+            )
+        else:
+            hits = search_engine.query_works(
+                query_string=None, filter=filter, pagination=pagination,
+                debug=debug
+            )
         return self.works_for_hits(_db, hits, facets=facets)
 
+    def query_works_with_facet_counts(self, _db, search_engine, query_string,
+                                      filter, pagination, facets, debug=False):
+        """Run a search query, and count the works under each of the
+        faceting object's countable facets in the same request.
+
+        The counts are stored in `facets.facet_counts`.
+
+        :return: The search results, as returned by
+            ExternalSearchIndex.query_works.
+        """
+        countable = list(facets.countable_facets(self))
+        keys = [(group, value) for group, value, new_facets in countable]
+        facet_filters = [
+            self.filter(_db, new_facets)
+            for group, value, new_facets in countable
+        ]
+        hits, counts = search_engine.query_works_with_facet_counts(
+            query_string, filter, pagination, facet_filters, debug
+        )
+        facets.facet_counts = dict(zip(keys, counts))
+        return hits
+
     def filter(self, _db, facets):
         """Helper method to instantiate a Filter object for this WorkList.
 
@@ -1798,8 +2157,19 @@ class WorkList(object):
         from external_search import (
             Filter,
             WorkSearchResult,
+            WorkSearchView,
         )
 
+        if self.HYDRATE_FROM_SEARCH_INDEX and all(
+            WorkSearchView.can_hydrate(hit)
+            for resultset in resultsets for hit in resultset
+        ):
+            # There's no need to go to the database. The search
+            # index already applied the availability filters and the
+            # facets.
+            load_works = lambda work_ids: self.works_by_id(_db, work_ids)
+            return WorkSearchView.for_resultsets(resultsets, load_works)
+
         has_script_fields = None
         work_ids = set()
         for resultset in resultsets:
@@ -1861,6 +2231,26 @@ class WorkList(object):
         )
         return work_lists
 
+    @classmethod
+    def works_by_id(cls, _db, work_ids):
+        """Load specific Works from the database, along with everything
+        needed to generate OPDS entries for them.
+
+        Unlike works_for_resultsets, this applies no availability
+        filters -- it's used to fill in WorkSearchViews for works that
+        the search index has already approved.
+        """
+        if not work_ids:
+            return []
+        qu = _db.query(Work).join(
+            Work.presentation_edition
+        ).outerjoin(
+            Work.license_pools
+        ).filter(
+            Work.id.in_(work_ids)
+        )
+        return DatabaseBackedWorkList._modify_loading(qu).all()
+
     @property
     def search_target(self):
         """By default, a WorkList is searchable."""
@@ -1891,9 +2281,15 @@ class WorkList(object):
 
         filter = self.filter(_db, facets)
         try:
-            hits = search_client.query_works(
-                query, filter, pagination, debug
-            )
+            if self.INCLUDE_FACET_COUNTS and facets is not None:
+                hits = self.query_works_with_facet_counts(
+                    _db, search_client, query, filter, pagination, facets,
+                    debug
+                )
+            else:
+                hits = search_client.query_works(
+                    query, filter, pagination, debug
+                )
         except elasticsearch.exceptions.ElasticsearchException, e:
             logging.error(
                 "Problem communicating with ElasticSearch. Returning empty list of search results.",
@@ -1951,12 +2347,32 @@ class WorkList(object):
             parent_lane = None
 
         queryable_lane_set = set(queryable_lanes)
-        works_and_lanes = list(
-            self._featured_works_with_lanes(
-                _db, queryable_lanes, pagination=pagination,
-                facets=facets, search_engine=search_engine, debug=debug
-            )
-        )
+
+        # A lane that can't be queried along with its siblings needs a
+        # search of its own, but in most cases that search can still
+        # be sent in the same request as the main query.
+        separate_queries = []
+        for lane in relevant_lanes:
+            if lane in queryable_lane_set or not isinstance(lane, WorkList):
+                continue
+            query = lane._featured_works_query(_db, pagination, facets)
+            if query is not None:
+                separate_queries.append((lane, query))
+        separate_lane_set = set(lane for lane, query in separate_queries)
+
+        works_and_lanes = []
+        separate_works = defaultdict(list)
+        for work, lane in self._featured_works_with_lanes(
+            _db, queryable_lanes, pagination=pagination,
+            facets=facets, search_engine=search_engine, debug=debug,
+            separate_queries=separate_queries
+        ):
+            if lane in separate_lane_set:
+                # These works aren't deduplicated against the works
+                # in other lanes.
+                separate_works[lane].append(work)
+            else:
+                works_and_lanes.append((work, lane))
 
         def _done_with_lane(lane):
             """Called when we're done with a Lane, either because
@@ -2007,21 +2423,54 @@ class WorkList(object):
                 # Yield those results.
                 for work in by_lane.get(lane, []):
                     yield (work, lane)
+            elif lane in separate_lane_set:
+                # We found results for this lane through its own
+                # query, which ran alongside the main query.
+                for work in separate_works[lane]:
+                    yield (work, lane)
             else:
                 # We didn't try to use the main query to find results
                 # for this lane because we knew the results, if there
-                # were any, wouldn't be representative. This is most
-                # likely because this 'lane' is a WorkList and not a
-                # Lane at all. Do a whole separate query and plug it
-                # in at this point.
+                # were any, wouldn't be representative. And the lane
+                # finds its works in some special way, so we couldn't
+                # run its query alongside the main query. Let it do
+                # its own thing and plug the results in at this point.
                 for x in lane.groups(
                     _db, include_sublanes=False,
                         pagination=pagination, facets=facets,
                 ):
                     yield x
 
+    def _featured_works_query(self, _db, pagination, facets):
+        """Describe the search that finds this WorkList's contribution to
+        its parent's grouped feed, so the parent can run it alongside
+        its other searches.
+
+        :return: A (query string, Filter, Pagination) 3-tuple, or None
+            if the parent needs to call groups() on this WorkList
+            instead.
+        """
+        if not self._uses_implementation(
+            WorkList, 'groups', 'works', 'works_for_resultsets'
+        ):
+            # This WorkList finds its works in some special way.
+            return None
+        overview_facets = self.overview_facets(_db, facets)
+        return (None, self.filter(_db, overview_facets), pagination)
+
+    def _uses_implementation(self, cls, *method_names):
+        """Does this object use the given class's implementation of
+        all of the named methods, rather than overriding them?
+        """
+        return all(
+            getattr(type(self), name).__func__
+            is getattr(cls, name).__func__
+            for name in method_names
+        )
+
     def _featured_works_with_lanes(
-        self, _db, lanes, pagination, facets, search_engine, debug=False
+        self, _db, lanes, pagination, facets, search_engine, debug=False,
+        separate_queries=None
     ):
         """Find a sequence of works that can be used to
         populate this lane's grouped acquisition feed.
@@ -2038,10 +2487,16 @@ class WorkList(object):
            asking for the featured works in a given WorkList.
         :param debug: A debug argument passed into `search_engine` when
            running the search.
+        :param separate_queries: A list of (WorkList, query) 2-tuples,
+           as returned by _featured_works_query. Each query is run in
+           the same request as the queries for `lanes`, and the
+           results are classified as belonging to the corresponding
+           WorkList.
 
         :yield: A sequence of (Work, Lane) 2-tuples.
         """
-        if not lanes:
+        separate_queries = separate_queries or []
+        if not lanes and not separate_queries:
             # We can't run this query at all.
             return
 
@@ -2062,6 +2517,10 @@ class WorkList(object):
             from external_search import Filter
             filter = Filter.from_worklist(_db, lane, overview_facets)
             queries.append((None, filter, pagination))
+        lanes = list(lanes)
+        for lane, query in separate_queries:
+            lanes.append(lane)
+            queries.append(query)
         resultsets = list(search_engine.query_works_multi(queries))
         works = self.works_for_resultsets(_db, resultsets, facets=facets)
 
@@ -2631,8 +3090,45 @@ class Lane(Base, DatabaseBackedWorkList, HierarchyWorkList):
     def children(self):
         return self.sublanes
 
+    @property
+    def snapshot(self):
+        """Find this Lane's entry in a snapshot of its library's lane tree.
+
+        :return: A LaneSnapshot, or None if lane tree snapshots are
+            disabled or this Lane has changes that haven't been
+            written to the database.
+        """
+        if LaneTreeSnapshot.cache is None or self.id is None:
+            return None
+        _db = Session.object_session(self)
+        if _db is None or instance_state(self).modified:
+            return None
+        tree = LaneTreeSnapshot.for_library(_db, self.library_id)
+        return tree.get(self.id)
+
+    def _lanes_by_id(self, lane_ids):
+        """Find the Lanes with the given IDs, in the given order.
+
+        Lanes already loaded into this Lane's database session are
+        used as is; the rest are loaded with a single query.
+        """
+        _db = Session.object_session(self)
+        lanes = {}
+        for lane_id in lane_ids:
+            lane = _db.identity_map.get(_db.identity_key(Lane, lane_id))
+            if lane is not None:
+                lanes[lane_id] = lane
+        missing = [x for x in lane_ids if x not in lanes]
+        if missing:
+            for lane in _db.query(Lane).filter(Lane.id.in_(missing)):
+                lanes[lane.id] = lane
+        return [lanes[x] for x in lane_ids if x in lanes]
+
     @property
     def visible_children(self):
+        snapshot = self.snapshot
+        if snapshot is not None:
+            return self._lanes_by_id(snapshot.visible_children_ids)
         children = [lane for lane in self.sublanes if lane.visible]
         return sorted(children, key=lambda x: (x.priority, x.display_name or ""))
 
@@ -2643,6 +3139,11 @@ class Lane(Base, DatabaseBackedWorkList, HierarchyWorkList):
         The Lane may be inside one or more non-Lane WorkLists, but those
         WorkLists are not counted in the parentage.
         """
+        snapshot = self.snapshot
+        if snapshot is not None:
+            for parent in self._lanes_by_id(snapshot.parentage_ids):
+                yield parent
+            return
         if not self.parent:
             return
         parent = self.parent
@@ -2825,20 +3326,55 @@ class Lane(Base, DatabaseBackedWorkList, HierarchyWorkList):
 
     def update_size(self, _db, search_engine=None):
         """Update the stored estimate of the number of Works in this Lane."""
-        library = self.get_library(_db)
         from external_search import ExternalSearchIndex
         search_engine = search_engine or ExternalSearchIndex.load(_db)
 
         # Do the estimate for every known entry point.
         by_entrypoint = dict()
+        for uri, filter in self._size_filters(_db):
+            by_entrypoint[uri] = search_engine.count_works(filter)
+        self._set_size(by_entrypoint)
+
+    @classmethod
+    def update_sizes(cls, _db, lanes, search_engine=None):
+        """Update the stored size estimates for a number of Lanes at once.
+
+        This has the same effect as calling update_size() on each
+        Lane, but all the counts are obtained through a single call
+        to ExternalSearchIndex.count_works_multi().
+        """
+        from external_search import ExternalSearchIndex
+        search_engine = search_engine or ExternalSearchIndex.load(_db)
+
+        keys = []
+        filters = []
+        for lane in lanes:
+            for uri, filter in lane._size_filters(_db):
+                keys.append((lane, uri))
+                filters.append(filter)
+        counts = search_engine.count_works_multi(filters)
+
+        by_lane = defaultdict(dict)
+        for (lane, uri), count in zip(keys, counts):
+            by_lane[lane][uri] = count
+        for lane in lanes:
+            lane._set_size(by_lane[lane])
+
+    def _size_filters(self, _db):
+        """Yield a (entry point URI, Filter) 2-tuple for every known
+        entry point, such that the Filter finds all the Works in this
+        Lane that belong to that entry point.
+        """
+        library = self.get_library(_db)
         for entrypoint in EntryPoint.ENTRY_POINTS:
             facets = DatabaseBackedFacets(
                 library, FacetConstants.COLLECTION_FULL,
                 FacetConstants.AVAILABLE_ALL,
                 order=FacetConstants.ORDER_WORK_ID, entrypoint=entrypoint
             )
-            filter = self.filter(_db, facets)
-            by_entrypoint[entrypoint.URI] = search_engine.count_works(filter)
+            yield entrypoint.URI, self.filter(_db, facets)
+
+    def _set_size(self, by_entrypoint):
         self.size_by_entrypoint = by_entrypoint
         self.size = by_entrypoint[EverythingEntryPoint.URI]
 
@@ -2850,6 +3386,11 @@ class Lane(Base, DatabaseBackedWorkList, HierarchyWorkList):
         :return: A list of genre IDs, or None if this Lane does not
             consider genres at all.
         """
+        snapshot = self.snapshot
+        if snapshot is not None:
+            if snapshot.genre_ids is None:
+                return None
+            return set(snapshot.genre_ids)
         if not hasattr(self, '_genre_ids'):
             self._genre_ids = self._gather_genre_ids()
         return self._genre_ids
@@ -2896,6 +3437,11 @@ class Lane(Base, DatabaseBackedWorkList, HierarchyWorkList):
 
         :return: A list of CustomList IDs, possibly empty.
         """
+        snapshot = self.snapshot
+        if snapshot is not None and not snapshot.lists_from_datasource:
+            if snapshot.customlist_ids is None:
+                return None
+            return list(snapshot.customlist_ids)
         if not hasattr(self, '_customlist_ids'):
             self._customlist_ids = self._gather_customlist_ids()
         return self._customlist_ids
@@ -2925,6 +3471,31 @@ class Lane(Base, DatabaseBackedWorkList, HierarchyWorkList):
                 return None
         return ids
 
+    def inherited_value(self, k):
+        """Find this Lane's value for the given key, possibly inherited
+        from its parent. See WorkList.inherited_value.
+        """
+        snapshot = self.snapshot
+        if snapshot is not None and k in snapshot.inherited_value:
+            value = snapshot.inherited_value[k]
+            if isinstance(value, tuple):
+                value = list(value)
+            return value
+        return super(Lane, self).inherited_value(k)
+
+    def inherited_values(self, k):
+        """Find the values for the given key imposed by this Lane and
+        its parentage. See WorkList.inherited_values.
+        """
+        snapshot = self.snapshot
+        if snapshot is not None and k in snapshot.inherited_values:
+            if k == 'genre_ids':
+                thaw = set
+            else:
+                thaw = list
+            return [thaw(x) for x in snapshot.inherited_values[k]]
+        return super(Lane, self).inherited_values(k)
+
     @classmethod
     def affected_by_customlist(self, customlist):
         """Find all Lanes whose membership is partially derived
@@ -3054,6 +3625,23 @@ class Lane(Base, DatabaseBackedWorkList, HierarchyWorkList):
             facets=facets, search_engine=search_engine, debug=debug
         )
 
+    def _featured_works_query(self, _db, pagination, facets):
+        """Describe the search that finds this Lane's contribution to its
+        parent's grouped feed.
+
+        A Lane that isn't included in its own grouped feed contributes
+        nothing, so there's no search to run. The parent will call
+        groups(), which will return nothing without running a search.
+        """
+        if not self.include_self_in_grouped_feed:
+            return None
+        if not self._uses_implementation(
+            Lane, 'groups', 'works', 'works_for_resultsets'
+        ):
+            return None
+        overview_facets = self.overview_facets(_db, facets)
+        return (None, self.filter(_db, overview_facets), pagination)
+
     def search(self, _db, query_string, search_client, pagination=None,
                facets=None):
         """Find works in this lane that also match a search query.
@@ -3106,6 +3694,221 @@ lanes_customlists = Table(
     UniqueConstraint('lane_id', 'customlist_id'),
 )
 
+# One Lane's entry in a LaneTreeSnapshot.
+LaneSnapshot = namedtuple(
+    'LaneSnapshot', [
+        'id', 'parent_id', 'parentage_ids', 'visible_children_ids',
+        'genre_ids', 'customlist_ids', 'lists_from_datasource',
+        'inherited_value', 'inherited_values',
+    ]
+)
+
+
+class LaneTreeSnapshot(object):
+    """An in-memory picture of one library's lane hierarchy.
+
+    Walking the Lane hierarchy means following a lot of relationships,
+    and calculating a Lane's genre IDs means looking at every one of
+    its genres' subgenres. A LaneTreeSnapshot does all of that once,
+    and Lanes consult it instead for their parentage, visible children,
+    genre and CustomList IDs, and inherited restrictions.
+
+    A snapshot is only valid until the site configuration changes --
+    which happens whenever a Lane is changed. Snapshots are not used
+    unless enable_cache() has been called.
+
+    A Lane that takes every CustomList from a DataSource can gain a
+    list without any change to the site configuration, so its
+    CustomList IDs aren't part of the snapshot.
+
+    A snapshot contains only IDs and simple values, so it can be
+    pickled.
+    """
+
+    # Snapshots are kept here, keyed by library ID. This is disabled
+    # by default; call enable_cache() to turn it on.
+    cache = None
+    DEFAULT_CACHE_SIZE = 100
+
+    # These are the keys for which the snapshot records the result of
+    # Lane.inherited_value().
+    INHERITED_VALUE_KEYS = [
+        'media', 'languages', 'fiction', 'audiences', 'target_age',
+        'collection_ids', 'license_datasource_id', 'list_datasource_id',
+        'list_seen_in_previous_days',
+    ]
+
+    # These are the keys for which the snapshot records the result of
+    # Lane.inherited_values().
+    INHERITED_VALUES_KEYS = ['genre_ids', 'customlist_ids']
+
+    @classmethod
+    def enable_cache(cls, max_size=None):
+        """Start keeping snapshots of lane trees in memory.
+
+        :param max_size: The maximum number of libraries whose lane
+            trees will be kept in memory.
+        :return: The LRUCache, whose .stats can be used to monitor it.
+        """
+        cls.cache = LRUCache(max_size or cls.DEFAULT_CACHE_SIZE)
+        return cls.cache
+
+    @classmethod
+    def disable_cache(cls):
+        """Stop keeping snapshots of lane trees in memory."""
+        cls.cache = None
+
+    @classmethod
+    def for_library(cls, _db, library_id):
+        """Find an up-to-date snapshot of the given library's lane tree,
+        creating one if necessary.
+
+        :return: A LaneTreeSnapshot, or None if the cache is disabled.
+        """
+        cache = cls.cache
+        if cache is None:
+            return None
+        stamp = Configuration._site_configuration_last_update()
+        is_current = lambda snapshot: snapshot.stamp == stamp
+        snapshot = cache.get(library_id, is_valid=is_current)
+        if snapshot is None:
+            snapshot = cls.from_database(_db, library_id, stamp)
+            # Right after a change, another change might not update
+            # the timestamp, so the snapshot can't be trusted for long.
+            if site_configuration_is_settled(stamp):
+                cache.set(library_id, snapshot)
+        return snapshot
+
+    @classmethod
+    def from_database(cls, _db, library_id, stamp=None):
+        """Take a snapshot of a library's lane tree.
+
+        :param stamp: The site configuration timestamp at the time
+            the snapshot was taken.
+        """
+        lanes = _db.query(Lane).filter(
+            Lane.library_id==library_id
+        ).options(
+            joinedload(Lane.lane_genres), joinedload(Lane.customlists)
+        ).all()
+        by_id = dict((lane.id, lane) for lane in lanes)
+
+        children = defaultdict(list)
+        for lane in lanes:
+            children[lane.parent_id].append(lane)
+
+        snapshots = {}
+        for lane in lanes:
+            snapshots[lane.id] = cls._snapshot_lane(lane, by_id, children)
+        return cls(library_id, snapshots, stamp)
+
+    @classmethod
+    def _snapshot_lane(cls, lane, by_id, children):
+        """Create a LaneSnapshot for one Lane.
+
+        :param by_id: A dictionary mapping the ID of every Lane in the
+            library to the Lane.
+        :param children: A dictionary mapping the ID of every Lane in
+            the library to a list of its child Lanes.
+        """
+        parentage = []
+        parent_id = lane.parent_id
+        while parent_id is not None:
+            if parent_id == lane.id or parent_id in parentage:
+                raise ValueError("Lane parentage loop detected")
+            parentage.append(parent_id)
+            parent_id = by_id[parent_id].parent_id
+        # A Lane is only visible if all of its ancestors are visible.
+        if not all(by_id[x]._visible for x in [lane.id] + parentage):
+            visible_children = []
+        else:
+            visible_children = sorted(
+                [x for x in children[lane.id] if x._visible],
+                key=lambda x: (x.priority, x.display_name or "")
+            )
+
+        def freeze(value):
+            if isinstance(value, (list, set)):
+                return tuple(value)
+            return value
+
+        inherited_value = {}
+        for key in cls.INHERITED_VALUE_KEYS:
+            inherited_value[key] = freeze(
+                cls._inherited_value(lane, key, by_id)
+            )
+
+        if lane.inherit_parent_restrictions:
+            hierarchy = [by_id[x] for x in reversed(parentage)] + [lane]
+        else:
+            hierarchy = [lane]
+        lists_from_datasource = lane.list_datasource_id is not None
+        inherited_values = {}
+        for key in cls.INHERITED_VALUES_KEYS:
+            if key == 'customlist_ids' and any(
+                wl.list_datasource_id is not None for wl in hierarchy
+            ):
+                # These must be looked up every time.
+                continue
+            values = []
+            for wl in hierarchy:
+                value = cls._value(wl, key)
+                if value not in (None, []):
+                    values.append(freeze(value))
+            inherited_values[key] = tuple(values)
+
+        return LaneSnapshot(
+            id=lane.id, parent_id=lane.parent_id,
+            parentage_ids=tuple(parentage),
+            visible_children_ids=tuple(x.id for x in visible_children),
+            genre_ids=freeze(cls._value(lane, 'genre_ids')),
+            customlist_ids=(
+                None if lists_from_datasource
+                else freeze(cls._value(lane, 'customlist_ids'))
+            ),
+            lists_from_datasource=lists_from_datasource,
+            inherited_value=inherited_value,
+            inherited_values=inherited_values,
+        )
+
+    @classmethod
+    def _value(cls, lane, key):
+        """Find a Lane's own value for `key`, without consulting any
+        snapshot.
+        """
+        if key == 'genre_ids':
+            return lane._gather_genre_ids()
+        if key == 'customlist_ids':
+            return lane._gather_customlist_ids()
+        return getattr(lane, key)
+
+    @classmethod
+    def _inherited_value(cls, lane, key, by_id):
+        """Do the work of WorkList.inherited_value without consulting
+        any snapshot.
+        """
+        while True:
+            value = cls._value(lane, key)
+            if value not in (None, []):
+                return value
+            if lane.parent_id is None or not lane.inherit_parent_restrictions:
+                return None
+            lane = by_id[lane.parent_id]
+
+    def __init__(self, library_id, lanes, stamp=None):
+        """Constructor.
+
+        :param lanes: A dictionary mapping Lane IDs to LaneSnapshots.
+        """
+        self.library_id = library_id
+        self.lanes = lanes
+        self.stamp = stamp
+
+    def get(self, lane_id):
+        """Find the LaneSnapshot for the Lane with the given ID."""
+        return self.lanes.get(lane_id)
+
+
 @event.listens_for(Lane, 'after_insert')
 @event.listens_for(Lane, 'after_delete')
 @event.listens_for(LaneGenre, 'after_insert')
@@ -3114,6 +3917,15 @@ def configuration_relevant_lifecycle_event(mapper, connection, target):
     site_configuration_has_changed(target)
 
 
+@event.listens_for(Lane.customlists, 'append')
+@event.listens_for(Lane.customlists, 'remove')
+def configuration_relevant_customlist_change(target, value, initiator):
+    # A Lane that's not in a database session yet will trigger
+    # 'after_insert' when it's added to one.
+    if Session.object_session(target) is not None:
+        site_configuration_has_changed(target)
+
+
 @event.listens_for(Lane, 'after_update')
 @event.listens_for(LaneGenre, 'after_update')
 def configuration_relevant_update(mapper, connection, target):
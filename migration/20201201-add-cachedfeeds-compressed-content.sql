@@ -0,0 +1,10 @@
+DO $$ 
+ BEGIN
+  -- Add the 'compressed_content' column
+  BEGIN
+   ALTER TABLE cachedfeeds ADD COLUMN compressed_content BYTEA;
+  EXCEPTION
+   WHEN duplicate_column THEN RAISE NOTICE 'column cachedfeeds.compressed_content already exists, not creating it.';
+  END;
+ END;
+$$;
@@ -0,0 +1,16 @@
+DO $$
+    BEGIN
+        BEGIN
+            CREATE TABLE cachedfeeds_works (
+                cachedfeed_id INTEGER NOT NULL REFERENCES cachedfeeds(id) ON DELETE CASCADE,
+                work_id INTEGER NOT NULL REFERENCES works(id) ON DELETE CASCADE,
+                UNIQUE (cachedfeed_id, work_id)
+            );
+
+            CREATE INDEX ix_cachedfeeds_works_cachedfeed_id ON cachedfeeds_works USING btree (cachedfeed_id);
+            CREATE INDEX ix_cachedfeeds_works_work_id ON cachedfeeds_works USING btree (work_id);
+        EXCEPTION
+            WHEN duplicate_table THEN RAISE NOTICE 'Warning: cachedfeeds_works already exists.';
+        END;
+    END;
+$$;
@@ -0,0 +1,19 @@
+DO $$ 
+ BEGIN
+  -- Add the 'hits' column
+  BEGIN
+   ALTER TABLE cachedfeeds ADD COLUMN hits INTEGER NOT NULL DEFAULT 0;
+  EXCEPTION
+   WHEN duplicate_column THEN RAISE NOTICE 'column cachedfeeds.hits already exists, not creating it.';
+  END;
+
+  -- Add the 'expires' column
+  BEGIN
+   ALTER TABLE cachedfeeds ADD COLUMN expires TIMESTAMP WITHOUT TIME ZONE;
+  EXCEPTION
+   WHEN duplicate_column THEN RAISE NOTICE 'column cachedfeeds.expires already exists, not creating it.';
+  END;
+ END;
+$$;
+
+CREATE INDEX IF NOT EXISTS ix_cachedfeeds_expires ON cachedfeeds USING btree (expires);
@@ -0,0 +1,10 @@
+DO $$ 
+ BEGIN
+  -- Add the 'search_document_fingerprint' column
+  BEGIN
+   ALTER TABLE works ADD COLUMN search_document_fingerprint VARCHAR;
+  EXCEPTION
+   WHEN duplicate_column THEN RAISE NOTICE 'column works.search_document_fingerprint already exists, not creating it.';
+  END;
+ END;
+$$;
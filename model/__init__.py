@@ -10,6 +10,7 @@ from sqlalchemy import (
     Column,
     create_engine,
     ForeignKey,
+    inspect,
     Integer,
     Table,
     text,
@@ -21,6 +22,7 @@ from sqlalchemy.exc import (
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import (
     relationship,
+    selectinload,
     sessionmaker,
 )
 from sqlalchemy.orm.exc import (
@@ -126,6 +128,69 @@ def get_one_or_create(db, model, create_method='',
             __transaction.rollback()
             return db.query(model).filter_by(**kwargs).one(), False
 
+def preload(db, instances, *paths):
+    """Load related objects for a number of model objects at once.
+
+    Looking at a relationship that hasn't been loaded yet sends a
+    query to the database. When the same relationship is needed for
+    each of a list of objects, that's one query per object. This
+    function loads each relationship for all the objects with a
+    couple of queries instead, no matter how many objects there are.
+
+    Relationships that are already loaded are left alone and cost
+    nothing.
+
+    :param instances: A list of model objects of the same class.
+    :param paths: Each path is a tuple of relationship names, starting
+        from `instances`: ('license_pools', 'delivery_mechanisms')
+        loads LicensePools, then their LicensePoolDeliveryMechanisms.
+    """
+    tree = {}
+    for path in paths:
+        node = tree
+        for name in path:
+            node = node.setdefault(name, {})
+    _preload_tree(db, instances, tree)
+
+def _preload_tree(db, instances, tree):
+    """Load every relationship in `tree` for every object in
+    `instances`, then do the same for the related objects.
+
+    :param tree: A dictionary mapping relationship names to trees.
+    """
+    instances = [x for x in instances if x is not None]
+    if not instances or not tree:
+        return
+    mapper = inspect(instances[0]).mapper
+    cls = mapper.class_
+    [primary_key] = mapper.primary_key
+    for name, subtree in tree.items():
+        missing = set(
+            getattr(x, primary_key.key) for x in instances
+            if name in inspect(x).unloaded
+        )
+        missing.discard(None)
+        if missing:
+            # Loading the objects again puts the relationship in place
+            # on the objects already in the session.
+            db.query(cls).filter(primary_key.in_(missing)).options(
+                selectinload(name)
+            ).all()
+
+        related = []
+        seen = set()
+        for instance in instances:
+            value = getattr(instance, name)
+            if value is None:
+                continue
+            if not isinstance(value, list):
+                value = [value]
+            for obj in value:
+                if id(obj) not in seen:
+                    seen.add(id(obj))
+                    related.append(obj)
+        _preload_tree(db, related, subtree)
+
 def numericrange_to_string(r):
     """Helper method to convert a NumericRange to a human-readable string."""
     if not r:
@@ -9,21 +9,56 @@ from . import (
     get_one_or_create,
 )
 
-from collections import namedtuple
+from collections import (
+    Iterator,
+    defaultdict,
+    namedtuple,
+)
 import datetime
+import hashlib
 import logging
+import struct
+from threading import Lock
+import time
 from sqlalchemy import (
+    Binary,
     Column,
     DateTime,
     ForeignKey,
     Index,
     Integer,
+    Table,
     Unicode,
+    UniqueConstraint,
 )
+from sqlalchemy.orm.session import Session
+from sqlalchemy.orm.util import identity_key
 from sqlalchemy.sql.expression import (
     and_,
+    or_,
+)
+from sqlalchemy.sql import (
+    bindparam,
+    literal,
+    select,
+    text,
+)
+from werkzeug.http import (
+    http_date,
+    quote_etag,
+    unquote_etag,
+)
+from ..util.cache import (
+    LRUCache,
+    SingleFlight,
+)
+from ..util.flask_util import (
+    OPDSFeedResponse,
+    client_has_current_version,
+    gzip_compress,
+    gzip_decompress,
+    is_conditional_request,
 )
-from ..util.flask_util import OPDSFeedResponse
 
 class CachedFeed(Base):
 
@@ -57,6 +92,10 @@ class CachedFeed(Base):
     # The content of the feed.
     content = Column(Unicode, nullable=True)
 
+    # The content of the feed, gzipped, ready to be sent to a client
+    # that accepts gzip.
+    compressed_content = Column(Binary, nullable=True)
+
     # Every feed is associated with a Library.
     library_id = Column(
         Integer, ForeignKey('libraries.id'), index=True
@@ -66,6 +105,14 @@ class CachedFeed(Base):
     work_id = Column(Integer, ForeignKey('works.id'),
         nullable=True, index=True)
 
+    # Roughly how often this feed has been requested lately. This is
+    # used to decide which feeds are worth regenerating before they
+    # expire.
+    hits = Column(Integer, nullable=False, default=0)
+
+    # When this feed will become stale, if it ever will.
+    expires = Column(DateTime, nullable=True, index=True)
+
     # Distinct types of feeds that might be cached.
     GROUPS_TYPE = u'groups'
     PAGE_TYPE = u'page'
@@ -80,11 +127,100 @@ class CachedFeed(Base):
     CACHE_FOREVER = object()
     IGNORE_CACHE = object()
 
+    # Ways of storing the content of a feed.
+    #
+    # Store the text only; it will be compressed on every request.
+    STORE_TEXT = u'text'
+    # Store the text and a gzipped version of it.
+    STORE_TEXT_AND_GZIP = u'text+gzip'
+    # Store only the gzipped version. This keeps the table small, but
+    # the feed must be decompressed for clients that don't accept
+    # gzip.
+    STORE_GZIP = u'gzip'
+    storage_format = STORE_TEXT
+
     log = logging.getLogger("CachedFeed")
 
+    # An optional in-process cache that sits in front of the
+    # cachedfeeds table, so that a hot feed can be served without
+    # loading its content from the database. A copy in memory is only
+    # served if its timestamp still matches the database's, so a feed
+    # that another process has regenerated or invalidated isn't
+    # served stale. It's disabled by default; call
+    # enable_memory_cache() to turn it on.
+    memory_cache = None
+    DEFAULT_MEMORY_CACHE_SIZE = 500
+
+    # This named tuple is what actually goes into the memory cache.
+    # It has a .timestamp so it can be passed into _should_refresh
+    # just like a CachedFeed.
+    MemoryCachedFeed = namedtuple(
+        'MemoryCachedFeed', ['content', 'compressed_content', 'timestamp']
+    )
+
+    # What to do when several requests notice at once that the same
+    # feed needs to be regenerated.
+    #
+    # Every request regenerates the feed independently.
+    REGENERATE_INDEPENDENTLY = u'independent'
+    # One request regenerates the feed, and the others wait for it to
+    # finish and use its result.
+    WAIT_FOR_REGENERATION = u'wait'
+    # One request regenerates the feed. The others are served the
+    # stale feed if there is one, and wait otherwise.
+    SERVE_STALE = u'stale'
+    regeneration_policy = REGENERATE_INDEPENDENTLY
+
+    # If this is True, the request that regenerates a feed also takes
+    # a Postgres advisory lock on it, so that requests in other
+    # processes can coordinate with it.
+    use_advisory_lock = False
+
+    # A request will wait this many seconds for another thread (or,
+    # with use_advisory_lock, another process) to regenerate a feed,
+    # then give up and generate it itself.
+    REGENERATION_TIMEOUT = 120
+
+    # While waiting for another process to release its advisory lock
+    # on a feed, check this often (in seconds) at first, backing off
+    # to once a second.
+    ADVISORY_LOCK_POLL_INTERVAL = 0.05
+
+    # Keeps track of the feeds currently being regenerated in this
+    # process.
+    _regenerations = SingleFlight()
+
+    # Requests for feeds are counted in memory, and the counts are
+    # added to CachedFeed.hits at most this often (in seconds), so
+    # that serving a feed doesn't mean writing to the database.
+    HIT_FLUSH_INTERVAL = 60
+
+    # Only requests for these types of feeds are counted, since
+    # they're the only ones CachedFeedPrewarmMonitor regenerates.
+    HIT_COUNTED_TYPES = [GROUPS_TYPE]
+
+    _hit_counts = defaultdict(int)
+    _hit_counts_lock = Lock()
+    _hits_flushed_at = None
+
+    @classmethod
+    def enable_memory_cache(cls, max_size=None):
+        """Put a bounded in-process LRU cache in front of the database.
+
+        :param max_size: The maximum number of feeds to keep in memory.
+        :return: The LRUCache, whose .stats can be used to monitor it.
+        """
+        cls.memory_cache = LRUCache(max_size or cls.DEFAULT_MEMORY_CACHE_SIZE)
+        return cls.memory_cache
+
+    @classmethod
+    def disable_memory_cache(cls):
+        """Stop using the in-process cache."""
+        cls.memory_cache = None
+
     @classmethod
     def fetch(cls, _db, worklist, facets, pagination, refresher_method,
-              max_age=None, raw=False, **response_kwargs
+              max_age=None, raw=False, stream=False, **response_kwargs
     ):
         """Retrieve a cached feed from the database if possible.
 
@@ -103,6 +239,8 @@ class CachedFeed(Base):
             the contents of the feed need to be regenerated. This
             function must take no arguments and return an object that
             implements __unicode__. (A Unicode string or an OPDSFeed is fine.)
+            It may also return a generator of Unicode strings which,
+            put together, make up the feed.
         :param max_age: If a cached feed is older than this, it will
             be considered stale and regenerated. This may be either a
             number of seconds or a timedelta. If no value is
@@ -113,6 +251,12 @@ class CachedFeed(Base):
             converted into a Flask Response object will be returned. If this
             is True, the CachedFeed object itself will be returned. In most
             non-test situations the default is better.
+        :param stream: If this is True, and the feed has to be
+            generated, the Response will send the feed to the client
+            as refresher_method generates it. The feed will be cached
+            once it has been sent. This only happens if feeds are
+            regenerated independently; otherwise the feed is
+            generated in full before it's sent.
 
         :return: A Response or CachedFeed containing up-to-date content.
         """
@@ -132,7 +276,10 @@ class CachedFeed(Base):
         # TODO: this constraint_clause might not be necessary anymore.
         # ISTR it was an attempt to avoid race conditions, and we do a
         # better job of that now.
-        constraint_clause = and_(cls.content!=None, cls.timestamp!=None)
+        constraint_clause = and_(
+            or_(cls.content!=None, cls.compressed_content!=None),
+            cls.timestamp!=None
+        )
         kwargs = dict(
             on_multiple='interchangeable',
             constraint=constraint_clause,
@@ -145,7 +292,69 @@ class CachedFeed(Base):
             pagination=keys.pagination_key
         )
         feed_data = None
-        if (max_age is cls.IGNORE_CACHE or isinstance(max_age, int) and max_age <= 0):
+        compressed_data = None
+        skip_lookup = (
+            max_age is cls.IGNORE_CACHE
+            or isinstance(max_age, int) and max_age <= 0
+        )
+
+        # A forced refresh isn't a request from a patron, but the
+        # feed it generates should last as long as usual.
+        lifetime = max_age
+        if skip_lookup:
+            if max_age is not cls.IGNORE_CACHE:
+                lifetime = cls.max_cache_age(worklist, keys.feed_type, facets)
+        else:
+            cls.record_hit(_db, keys)
+
+        memory_key = None
+        if cls.memory_cache is not None and not skip_lookup:
+            memory_key = cls._memory_cache_key(keys)
+
+        # If the client sent If-None-Match or If-Modified-Since, it
+        # may already have the current version of the feed.
+        conditional = (
+            not raw and not skip_lookup and is_conditional_request()
+        )
+
+        # The in-process cache can only serve a feed when the caller
+        # doesn't need the CachedFeed object itself.
+        if memory_key is not None and not raw:
+            cached = cls.memory_cache.get(
+                memory_key,
+                is_valid=lambda x: not cls._should_refresh(x, max_age)
+            )
+            if (cached is not None
+                and cls._timestamp(_db, kwargs) != cached.timestamp):
+                # Some other process has regenerated or invalidated
+                # this feed since it was put in memory.
+                cls.memory_cache.remove(memory_key)
+                cached = None
+            if cached is not None:
+                validators = cls.validators(keys, cached.timestamp)
+                if conditional and cls._client_has(validators, cached.timestamp):
+                    return cls._not_modified_response(
+                        max_age, response_kwargs, validators
+                    )
+                return cls._response(
+                    cached.content, max_age, response_kwargs,
+                    cached.compressed_content, validators
+                )
+
+        if conditional:
+            # Find out when the feed was generated, without loading
+            # its content.
+            timestamp = cls._timestamp(_db, kwargs)
+            if timestamp is not None and not cls._should_refresh(
+                cls.MemoryCachedFeed(None, None, timestamp), max_age
+            ):
+                validators = cls.validators(keys, timestamp)
+                if cls._client_has(validators, timestamp):
+                    return cls._not_modified_response(
+                        max_age, response_kwargs, validators
+                    )
+
+        if skip_lookup:
             # Don't even bother checking for a CachedFeed: we're
             # just going to replace it.
             feed_obj = None
@@ -153,13 +362,38 @@ class CachedFeed(Base):
             feed_obj = get_one(_db, cls, **kwargs)
 
         should_refresh = cls._should_refresh(feed_obj, max_age)
+        if (should_refresh and stream and not raw
+            and cls.regeneration_policy == cls.REGENERATE_INDEPENDENTLY):
+            feed = refresher_method()
+            chunks = cls._as_chunks(feed)
+            if max_age is not cls.IGNORE_CACHE:
+                chunks = cls._tee(
+                    _db, kwargs, memory_key, chunks, feed, lifetime
+                )
+            return cls._response(chunks, max_age, response_kwargs)
+
+        refreshed = None
+        timestamp = None
         if should_refresh:
             # This is a cache miss. Either feed_obj is None or
-            # it's no good. We need to generate a new feed.
-            feed_data = unicode(refresher_method())
-            generation_time = datetime.datetime.utcnow()
+            # it's no good. We need to generate a new feed -- or
+            # find out that someone else is generating it.
+            refreshed = cls._refresh(
+                _db, keys, kwargs, feed_obj, max_age, refresher_method
+            )
 
-            if max_age is not cls.IGNORE_CACHE:
+        if refreshed:
+            feed_data, generation_time, work_ids, generated = refreshed
+
+            if not generated:
+                # Another thread or process generated this feed, and
+                # it's the one that stores it. feed_obj is out of
+                # date, so it mustn't be used.
+                timestamp = generation_time
+                feed_obj = None
+                if raw:
+                    feed_obj = get_one(_db, cls, **kwargs)
+            elif max_age is not cls.IGNORE_CACHE:
                 # Having gone through all the trouble of generating
                 # the feed, we want to cache it in the database.
 
@@ -171,22 +405,396 @@ class CachedFeed(Base):
                 # To avoid a database error, fetch the feed _again_ from the
                 # database rather than assuming we have the up-to-date
                 # object.
-                feed_obj, is_new = get_one_or_create(_db, cls, **kwargs)
-                if feed_obj.timestamp is None or feed_obj.timestamp < generation_time:
-                    # Either there was no contention for this object, or there
-                    # was contention but our feed is more up-to-date than
-                    # the other thread(s). Our feed takes priority.
-                    feed_obj.content = feed_data
-                    feed_obj.timestamp = generation_time
+                feed_obj, stored = cls._store(
+                    _db, kwargs, feed_data, generation_time, work_ids,
+                    lifetime
+                )
+                if stored:
+                    compressed_data = feed_obj.compressed_content
+                    timestamp = generation_time
         elif feed_obj:
             feed_data = feed_obj.content
+            compressed_data = feed_obj.compressed_content
+            timestamp = feed_obj.timestamp
+
+        cls._remember(memory_key, feed_obj)
 
         if raw and feed_obj:
             return feed_obj
 
-        # We have the information necessary to create a useful
-        # response-type object.
-        #
+        # Validators are only useful if they describe a feed that's
+        # actually in the cache.
+        validators = None
+        if timestamp is not None:
+            validators = cls.validators(keys, timestamp)
+        return cls._response(
+            feed_data, max_age, response_kwargs, compressed_data, validators
+        )
+
+    @classmethod
+    def _store(cls, _db, lookup_kwargs, content, generation_time,
+               work_ids=None, lifetime=None):
+        """Store newly generated content for a feed, unless someone
+        else has stored a more recent version in the meantime.
+
+        :param lookup_kwargs: The arguments used to look up the
+            CachedFeed in the database.
+        :param work_ids: The IDs of the works in the feed, or None if
+            this isn't known.
+        :param lifetime: The number of seconds the feed will stay
+            fresh, or one of the constants CACHE_FOREVER or IGNORE_CACHE.
+        :return: A 2-tuple (CachedFeed, stored). `stored` is True if
+            `content` was stored.
+        """
+        feed_obj, is_new = get_one_or_create(_db, cls, **lookup_kwargs)
+        if feed_obj.timestamp is None or feed_obj.timestamp < generation_time:
+            # Either there was no contention for this object, or there
+            # was contention but our feed is more up-to-date than
+            # the other thread(s). Our feed takes priority.
+            feed_obj.set_content(content)
+            feed_obj.timestamp = generation_time
+            feed_obj.expires = cls._expires(generation_time, lifetime)
+            if work_ids is not None:
+                feed_obj.set_work_ids(_db, work_ids)
+            return feed_obj, True
+        return feed_obj, False
+
+    @classmethod
+    def _expires(cls, generation_time, lifetime):
+        """When will a feed generated at `generation_time` become stale?
+
+        :return: A datetime, or None if the feed will never become
+            stale in the usual way.
+        """
+        if not isinstance(lifetime, (int, long, float)) or lifetime <= 0:
+            return None
+        return generation_time + datetime.timedelta(seconds=lifetime)
+
+    @classmethod
+    def record_hit(cls, _db, keys):
+        """Count a request for a feed.
+
+        :param keys: A CachedFeedKeys identifying the feed.
+        """
+        if keys.feed_type not in cls.HIT_COUNTED_TYPES:
+            return
+        now = time.time()
+        with cls._hit_counts_lock:
+            cls._hit_counts[cls._memory_cache_key(keys)] += 1
+            if cls._hits_flushed_at is None:
+                cls._hits_flushed_at = now
+            due = now - cls._hits_flushed_at >= cls.HIT_FLUSH_INTERVAL
+        if due:
+            cls.flush_hits(_db)
+
+    @classmethod
+    def flush_hits(cls, _db):
+        """Add the requests counted in memory to CachedFeed.hits.
+
+        A request for a feed that hasn't been stored yet isn't counted.
+
+        This usually happens during a request for a feed, so all the
+        counts are written with one UPDATE statement, passed to the
+        database driver with a set of parameters for each feed.
+
+        :return: The number of distinct feeds whose counts were updated.
+        """
+        with cls._hit_counts_lock:
+            counts = cls._hit_counts
+            cls._hit_counts = defaultdict(int)
+            cls._hits_flushed_at = time.time()
+        if not counts:
+            return 0
+
+        table = cls.__table__
+        columns = [
+            table.c.type, table.c.library_id, table.c.work_id,
+            table.c.lane_id, table.c.unique_key, table.c.facets,
+            table.c.pagination
+        ]
+        clauses = []
+        for column in columns:
+            # Any part of the key may be NULL. The values are sent as
+            # literals, so Postgres reduces this to whichever half of
+            # the clause applies, and can still use an index.
+            value = bindparam('key_' + column.name)
+            clauses.append(
+                or_(column==value, and_(column==None, value==None))
+            )
+        update = table.update().where(and_(*clauses)).values(
+            hits=table.c.hits + bindparam('new_hits')
+        )
+        params = []
+        for key, hits in counts.items():
+            row = dict(
+                ('key_' + column.name, value)
+                for column, value in zip(columns, key)
+            )
+            row['new_hits'] = hits
+            params.append(row)
+        _db.execute(update, params)
+        return len(counts)
+
+    @classmethod
+    def _remember(cls, memory_key, feed_obj):
+        """Keep a copy of what's in the database in the in-process
+        cache, so the next request can skip the database entirely.
+        """
+        if memory_key is None or not feed_obj or not feed_obj.has_content:
+            return
+        cls.memory_cache.set(
+            memory_key,
+            cls.MemoryCachedFeed(
+                feed_obj.content, feed_obj.compressed_content,
+                feed_obj.timestamp
+            )
+        )
+
+    @classmethod
+    def _as_chunks(cls, feed):
+        """Turn whatever a refresher method returned into a generator
+        of Unicode strings.
+        """
+        if isinstance(feed, Iterator):
+            for chunk in feed:
+                yield chunk
+        else:
+            yield unicode(feed)
+
+    @classmethod
+    def _work_ids(cls, feed):
+        """Find the IDs of the works in whatever a refresher method
+        returned.
+
+        :return: A collection of work IDs, or None if they're not known.
+        """
+        return getattr(feed, 'work_ids', None)
+
+    @classmethod
+    def _tee(cls, _db, lookup_kwargs, memory_key, chunks, feed=None,
+             lifetime=None):
+        """Pass along the pieces of a feed as they're generated, and
+        cache the whole feed once they've all gone by.
+
+        :param lookup_kwargs: The arguments used to look up the
+            CachedFeed in the database.
+        :param chunks: A generator of Unicode strings.
+        :param feed: Whatever the refresher method returned. Once the
+            feed has been generated, this may know which works are in it.
+        :param lifetime: The number of seconds the feed will stay fresh.
+        """
+        generation_time = datetime.datetime.utcnow()
+        pieces = []
+        for chunk in chunks:
+            pieces.append(chunk)
+            yield chunk
+
+        feed_obj, stored = cls._store(
+            _db, lookup_kwargs, u"".join(pieces), generation_time,
+            cls._work_ids(feed), lifetime
+        )
+        cls._remember(memory_key, feed_obj)
+
+        # The response has been sent, so nothing else is going to
+        # commit this on our behalf.
+        _db.commit()
+
+    @classmethod
+    def _refresh(cls, _db, keys, lookup_kwargs, feed_obj, max_age,
+                 refresher_method):
+        """Get new content for a feed that needs to be refreshed,
+        subject to the regeneration policy.
+
+        :param keys: A CachedFeedKeys.
+        :param lookup_kwargs: The arguments used to look up the
+            CachedFeed in the database.
+        :param feed_obj: The stale CachedFeed, if there is one.
+
+        :return: A 4-tuple (content, generation time, work IDs,
+            generated), or None if the stale content of `feed_obj`
+            should be used instead. The work IDs are None if they're
+            not known. `generated` is False if the content came from
+            another thread or process, which will take care of storing
+            it.
+        """
+        generated = []
+        def generate():
+            generated.append(True)
+            feed = refresher_method()
+            content = u"".join(cls._as_chunks(feed))
+            return content, datetime.datetime.utcnow(), cls._work_ids(feed)
+
+        policy = cls.regeneration_policy
+        if (policy == cls.REGENERATE_INDEPENDENTLY
+            or max_age is cls.IGNORE_CACHE):
+            # Nothing is to be gained by coordinating with anyone
+            # else.
+            return generate() + (True,)
+
+        has_stale = feed_obj is not None and feed_obj.has_content
+        key = cls._memory_cache_key(keys)
+        if (policy == cls.SERVE_STALE and has_stale
+            and cls._regenerations.in_progress(key)):
+            # Someone else is working on it; the stale feed will do
+            # for now.
+            return None
+
+        def coordinated_generate():
+            if cls.use_advisory_lock:
+                return cls._generate_with_advisory_lock(
+                    _db, key, lookup_kwargs, feed_obj, max_age,
+                    has_stale and policy == cls.SERVE_STALE, generate
+                )
+            return generate()
+
+        result = cls._regenerations.run(
+            key, coordinated_generate, timeout=cls.REGENERATION_TIMEOUT
+        )
+        if result is None and not has_stale:
+            # Another thread decided to serve its stale feed, but we
+            # don't have one.
+            result = generate()
+        if result is None:
+            return None
+        return result + (bool(generated),)
+
+    @classmethod
+    def _generate_with_advisory_lock(cls, _db, key, lookup_kwargs, feed_obj,
+                                     max_age, can_serve_stale, generate):
+        """Generate a feed while holding a Postgres advisory lock on it,
+        so that only one process at a time does the work.
+
+        The lock is a transaction-level lock, so it's released when
+        the new feed is committed to the database. If another process
+        holds the lock, this waits for it up to REGENERATION_TIMEOUT
+        seconds, then generates the feed without the lock.
+
+        :return: A 3-tuple (content, generation time, work IDs), or
+            None if the stale feed should be served instead.
+        """
+        lock_id = cls.advisory_lock_id(key)
+        def try_lock():
+            return _db.execute(
+                text("SELECT pg_try_advisory_xact_lock(:lock_id)"),
+                dict(lock_id=lock_id)
+            ).scalar()
+
+        if try_lock():
+            return generate()
+
+        # Another process is generating this feed right now.
+        if can_serve_stale:
+            return None
+
+        # Wait for the other process to finish and commit its work,
+        # then see whether its feed is good enough for us.
+        deadline = time.time() + cls.REGENERATION_TIMEOUT
+        delay = cls.ADVISORY_LOCK_POLL_INTERVAL
+        while not try_lock():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                cls.log.warn(
+                    "Gave up waiting for another process to regenerate %r.",
+                    key
+                )
+                return generate()
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 1)
+
+        if feed_obj is not None:
+            _db.expire(feed_obj)
+        fresh = get_one(_db, cls, **lookup_kwargs)
+        if fresh and not cls._should_refresh(fresh, max_age):
+            # The other process recorded which works are in the feed.
+            return fresh.text_content, fresh.timestamp, None
+        return generate()
+
+    @classmethod
+    def advisory_lock_id(cls, key):
+        """Convert an in-process cache key into a number suitable for
+        use as a Postgres advisory lock ID.
+        """
+        digest = hashlib.md5(repr(key)).digest()
+        return struct.unpack(">q", digest[:8])[0]
+
+    @classmethod
+    def _timestamp(cls, _db, lookup_kwargs):
+        """Find the timestamp of the CachedFeed that would be found by
+        get_one(), without loading the CachedFeed's content.
+
+        :param lookup_kwargs: The arguments that would be passed into
+            get_one.
+        :return: A datetime, or None if there is no such CachedFeed.
+        """
+        lookup_kwargs = dict(lookup_kwargs)
+        lookup_kwargs.pop('on_multiple', None)
+        constraint = lookup_kwargs.pop('constraint', None)
+        qu = _db.query(cls.timestamp).filter_by(**lookup_kwargs)
+        if constraint is not None:
+            qu = qu.filter(constraint)
+        row = qu.first()
+        if row is None:
+            return None
+        return row[0]
+
+    @classmethod
+    def etag(cls, keys, timestamp):
+        """Calculate a validator for one version of a feed.
+
+        The same version of a feed may be sent with or without gzip
+        compression, so this is sent as a weak validator.
+
+        :param keys: A CachedFeedKeys identifying the feed.
+        :param timestamp: The time this version of the feed was generated.
+        :return: A string, without the W/ prefix and quotes that go
+            around it in the ETag header.
+        """
+        key = cls._memory_cache_key(keys)
+        return hashlib.md5(repr(key) + timestamp.isoformat()).hexdigest()
+
+    @classmethod
+    def validators(cls, keys, timestamp):
+        """Create the ETag and Last-Modified headers for one version of
+        a feed.
+
+        :return: A dictionary of HTTP headers.
+        """
+        return {
+            'ETag': quote_etag(cls.etag(keys, timestamp), weak=True),
+            'Last-Modified': http_date(timestamp),
+        }
+
+    @classmethod
+    def _client_has(cls, validators, timestamp):
+        """Does the client already have the version of the feed
+        described by `validators`?
+        """
+        return client_has_current_version(
+            unquote_etag(validators['ETag'])[0], timestamp
+        )
+
+    @classmethod
+    def _not_modified_response(cls, max_age, response_kwargs, validators):
+        """Create a 304 response telling the client its copy of a feed
+        is still good.
+        """
+        response_kwargs['status'] = 304
+        return cls._response(u"", max_age, response_kwargs, None, validators)
+
+    @classmethod
+    def _response(cls, feed_data, max_age, response_kwargs,
+                  compressed_data=None, validators=None):
+        """Create a response-type object for a feed.
+
+        :param feed_data: The content of the feed.
+        :param max_age: The maximum cache age calculated by max_cache_age.
+        :param response_kwargs: Extra arguments to the OPDSFeedResponse
+            constructor.
+        :param compressed_data: The gzipped content of the feed, if
+            available.
+        :param validators: A dictionary containing ETag and
+            Last-Modified headers, if available.
+        """
         # Set some defaults in case the caller didn't pass them in.
         if isinstance(max_age, int):
             response_kwargs.setdefault('max_age', max_age)
@@ -197,6 +805,14 @@ class CachedFeed(Base):
             # internal cache.
             response_kwargs['max_age'] = 0
 
+        if compressed_data is not None:
+            response_kwargs['compressed_response'] = compressed_data
+
+        if validators:
+            headers = dict(response_kwargs.get('headers') or {})
+            headers.update(validators)
+            response_kwargs['headers'] = headers
+
         return OPDSFeedResponse(
             response=feed_data,
             **response_kwargs
@@ -342,14 +958,165 @@ class CachedFeed(Base):
             pagination_key=pagination_key
         )
 
+    @classmethod
+    def _memory_cache_key(cls, keys):
+        """Turn a CachedFeedKeys into a key for the in-process cache.
+
+        Database objects are replaced with their IDs so that the key
+        doesn't keep a reference to any particular database session.
+        """
+        library_id = keys.library.id if keys.library else None
+        work_id = keys.work.id if keys.work else None
+        return (
+            keys.feed_type, library_id, work_id, keys.lane_id,
+            keys.unique_key, keys.facets_key, keys.pagination_key
+        )
+
+    @property
+    def memory_cache_key(self):
+        """The key under which this feed is stored in the in-process cache."""
+        return (
+            self.type, self.library_id, self.work_id, self.lane_id,
+            self.unique_key, self.facets, self.pagination
+        )
+
+    @property
+    def has_content(self):
+        """Is the content of this feed stored in any form?"""
+        return self.content is not None or self.compressed_content is not None
+
+    @property
+    def text_content(self):
+        """The content of this feed as Unicode, decompressing it if
+        necessary.
+        """
+        if self.content is not None:
+            return self.content
+        if self.compressed_content is not None:
+            return gzip_decompress(self.compressed_content).decode("utf8")
+        return None
+
+    def set_content(self, content):
+        """Store the content of this feed in the configured format(s).
+
+        :param content: A Unicode string.
+        """
+        format = self.storage_format
+        if format in (self.STORE_TEXT_AND_GZIP, self.STORE_GZIP):
+            self.compressed_content = gzip_compress(content)
+        else:
+            self.compressed_content = None
+        if format == self.STORE_GZIP:
+            self.content = None
+        else:
+            self.content = content
+
+    def set_work_ids(self, _db, work_ids):
+        """Record which works are in this feed, replacing whatever was
+        recorded before.
+
+        This is what lets `invalidate` find the feeds that need to go
+        when a work changes.
+
+        :param work_ids: A collection of Work IDs.
+        """
+        if self.id is None:
+            flush(_db)
+        table = cachedfeeds_works
+        _db.execute(table.delete().where(table.c.cachedfeed_id==self.id))
+        work_ids = set(work_ids)
+        if not work_ids:
+            return
+        # A work may have been deleted since the feed was generated,
+        # so only insert rows for works that still exist.
+        works = Base.metadata.tables['works']
+        _db.execute(
+            table.insert().from_select(
+                [table.c.cachedfeed_id, table.c.work_id],
+                select([literal(self.id), works.c.id]).where(
+                    works.c.id.in_(work_ids)
+                )
+            )
+        )
+
+    # The key under which a Session keeps track of the works that have
+    # changed since it was last flushed.
+    CHANGED_WORKS = 'cachedfeed_changed_works'
+
+    @classmethod
+    def work_changed(cls, work):
+        """Note that something about `work` has changed, so every feed
+        that contains it should be invalidated the next time its
+        Session is flushed.
+        """
+        if work is None or work.id is None:
+            # A work that hasn't been flushed can't be in any feeds.
+            return
+        _db = Session.object_session(work)
+        if _db is None:
+            return
+        _db.info.setdefault(cls.CHANGED_WORKS, set()).add(work.id)
+
+    @classmethod
+    def invalidate_changed_works(cls, _db):
+        """Invalidate every feed that contains a work which has changed
+        since this Session was last flushed.
+        """
+        work_ids = _db.info.pop(cls.CHANGED_WORKS, None)
+        if not work_ids:
+            return 0
+        return cls.invalidate(_db, work_ids)
+
+    @classmethod
+    def invalidate(cls, _db, work_ids):
+        """Delete every cached feed that contains any of the given works,
+        and remove them from this process's in-memory cache. Other
+        processes will notice the feeds are gone the next time they
+        look for them in their in-memory caches.
+
+        Feeds whose contents were never recorded are left alone; they
+        will expire normally.
+
+        :param work_ids: A collection of Work IDs.
+        :return: The number of feeds deleted.
+        """
+        work_ids = list(work_ids)
+        if not work_ids:
+            return 0
+        table = cls.__table__
+        containing = select([cachedfeeds_works.c.cachedfeed_id]).where(
+            cachedfeeds_works.c.work_id.in_(work_ids)
+        )
+        deleted = _db.execute(
+            table.delete().where(table.c.id.in_(containing)).returning(
+                table.c.id, table.c.type, table.c.library_id,
+                table.c.work_id, table.c.lane_id, table.c.unique_key,
+                table.c.facets, table.c.pagination
+            )
+        ).fetchall()
+        for row in deleted:
+            if cls.memory_cache is not None:
+                cls.memory_cache.remove(tuple(row[1:]))
+            # The row is gone, so any copy of it in the Session is
+            # out of date.
+            feed = _db.identity_map.get(identity_key(cls, row[0]))
+            if feed is not None:
+                _db.expunge(feed)
+        return len(deleted)
+
     def update(self, _db, content):
-        self.content = content
+        self.set_content(content)
         self.timestamp = datetime.datetime.utcnow()
+        if self.memory_cache is not None:
+            # Whatever is in memory is now out of date.
+            self.memory_cache.remove(self.memory_cache_key)
         flush(_db)
 
     def __repr__(self):
         if self.content:
             length = len(self.content)
+        elif self.compressed_content:
+            length = "%d compressed" % len(self.compressed_content)
         else:
             length = "No content"
         return "<CachedFeed #%s %s %s %s %s %s %s >" % (
@@ -365,6 +1132,22 @@ Index(
     CachedFeed.facets, CachedFeed.pagination
 )
 
+# Which works are in which cached feeds? This makes it possible to
+# invalidate only the feeds that contain a work when it changes.
+cachedfeeds_works = Table(
+    'cachedfeeds_works', Base.metadata,
+    Column(
+        'cachedfeed_id', Integer,
+        ForeignKey('cachedfeeds.id', ondelete='CASCADE'),
+        index=True, nullable=False
+    ),
+    Column(
+        'work_id', Integer, ForeignKey('works.id', ondelete='CASCADE'),
+        index=True, nullable=False
+    ),
+    UniqueConstraint('cachedfeed_id', 'work_id'),
+)
+
 
 class WillNotGenerateExpensiveFeed(Exception):
     """This exception is raised when a feed is not cached, but it's too
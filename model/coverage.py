@@ -525,6 +525,7 @@ class WorkCoverageRecord(Base, BaseCoverageRecord):
     GENERATE_OPDS_OPERATION = u'generate-opds'
     GENERATE_MARC_OPERATION = u'generate-marc'
     UPDATE_SEARCH_INDEX_OPERATION = u'update-search-index'
+    UPDATE_SEARCH_INDEX_LICENSEPOOLS_OPERATION = u'update-search-index-licensepools'
 
     id = Column(Integer, primary_key=True)
     work_id = Column(Integer, ForeignKey('works.id'), index=True)
@@ -582,14 +583,29 @@ class WorkCoverageRecord(Base, BaseCoverageRecord):
         """Create and update WorkCoverageRecords so that every Work in
         `works` has an identical record.
         """
-        from work import Work
-
         if not works:
             # Nothing to do.
             return
         _db = Session.object_session(works[0])
+        return self.bulk_add_ids(
+            _db, [w.id for w in works], operation, timestamp=timestamp,
+            status=status, exception=exception
+        )
+
+    @classmethod
+    def bulk_add_ids(self, _db, work_ids, operation, timestamp=None,
+                     status=CoverageRecord.SUCCESS, exception=None):
+        """Create and update WorkCoverageRecords so that every Work
+        whose ID is in `work_ids` has an identical record.
+
+        This is bulk_add() for Works that haven't been loaded.
+        """
+        from work import Work
+
+        if not work_ids:
+            # Nothing to do.
+            return
         timestamp = timestamp or datetime.datetime.utcnow()
-        work_ids = [w.id for w in works]
 
         # Make sure that works that previously had a
         # WorkCoverageRecord for this operation have their timestamp
@@ -617,7 +633,8 @@ class WorkCoverageRecord(Base, BaseCoverageRecord):
             Work.id.label('work_id'),
             literal(operation, type_=String(255)).label('operation'),
             literal(timestamp, type_=DateTime).label('timestamp'),
-            literal(status, type_=BaseCoverageRecord.status_enum).label('status')
+            literal(status, type_=BaseCoverageRecord.status_enum).label('status'),
+            literal(exception, type_=Unicode).label('exception'),
         ).select_from(
             Work
         )
@@ -634,6 +651,7 @@ class WorkCoverageRecord(Base, BaseCoverageRecord):
                 literal_column('operation'),
                 literal_column('timestamp'),
                 literal_column('status'),
+                literal_column('exception'),
             ],
             new_records
         )
@@ -14,6 +14,7 @@ from admin import (
     Admin,
     AdminRole,
 )
+from cachedfeed import CachedFeed
 from datasource import DataSource
 from classification import Genre
 from collection import Collection
@@ -90,6 +91,25 @@ def _site_configuration_has_changed(_db, cooldown=1):
             _db, known_value=now
         )
 
+def site_configuration_is_settled(last_update, settling_time=5):
+    """Has it been long enough since the site configuration last changed
+    that any later change would have updated the timestamp?
+
+    site_configuration_has_changed ignores changes made within its
+    cooldown of the previous one, so data derived from the site
+    configuration right after a change may already be out of date
+    without the timestamp showing it. Such data shouldn't be cached.
+    `settling_time` is longer than the cooldown, to give those
+    changes time to be committed.
+
+    :param last_update: The site configuration timestamp, as returned
+        by Configuration._site_configuration_last_update().
+    """
+    if last_update is None:
+        return True
+    age = datetime.datetime.utcnow() - last_update
+    return age.total_seconds() > settling_time
+
 def directly_modified(obj):
     """Return True only if `obj` has itself been modified, as opposed to
     having an object added or removed to one of its associated
@@ -254,6 +274,7 @@ def licensepool_removed_from_work(target, value, initiator):
     """
     if target:
         target.external_index_needs_updating()
+        CachedFeed.work_changed(target)
 
 @event.listens_for(LicensePool, 'after_delete')
 def licensepool_deleted(mapper, connection, target):
@@ -290,6 +311,7 @@ def licensepool_storage_status_change(target, value, oldvalue, initiator):
     if value == oldvalue:
         return
     work.external_index_needs_updating()
+    CachedFeed.work_changed(work)
 
 @event.listens_for(Work.last_update_time, 'set')
 def last_update_time_change(target, value, oldvalue, initator):
@@ -297,6 +319,17 @@ def last_update_time_change(target, value, oldvalue, initator):
     last_update_time changes.
 
     Among other things, this happens whenever the LicensePool's availability
-    information changes.
+    information changes. Only the parts of the document that describe
+    the LicensePools can have changed. (When a Work's presentation
+    changes, calculate_presentation() asks for the whole document to
+    be reindexed.)
+    """
+    target.search_index_licensepools_need_updating()
+    CachedFeed.work_changed(target)
+
+@event.listens_for(Session, 'before_flush')
+def invalidate_feeds_for_changed_works(session, flush_context, instances):
+    """Once the changes to a Work are about to be written to the
+    database, any cached feeds that contain the Work are out of date.
     """
-    target.external_index_needs_updating()
+    CachedFeed.invalidate_changed_works(session)
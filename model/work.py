@@ -222,6 +222,11 @@ class Work(Base):
     # catalog.
     marc_record = Column(String, default=None)
 
+    # A hash of the search document most recently uploaded to the
+    # search index for this work. If a newly generated document has
+    # the same hash, there's no need to upload it again.
+    search_document_fingerprint = Column(String, default=None)
+
     # These fields are potentially large and can be deferred if you
     # don't need all the data in a Work.
     LARGE_FIELDS = [
@@ -1005,6 +1010,11 @@ class Work(Base):
             float(quality) != float(self.quality)
         )
 
+        # Register the full reindex before changing last_update_time,
+        # so that the change doesn't also register a partial reindex.
+        if (changed or policy.update_search_index) and not exclude_search:
+            self.external_index_needs_updating()
+
         if changed:
             # last_update_time tracks the last time the data actually
             # changed, not the last time we checked whether or not to
@@ -1017,9 +1027,6 @@ class Work(Base):
         if changed or policy.regenerate_marc_record:
             self.calculate_marc_record()
 
-        if (changed or policy.update_search_index) and not exclude_search:
-            self.external_index_needs_updating()
-
         # Now that everything's calculated, print it out.
         if policy.verbose:
             if changed:
@@ -1221,6 +1228,24 @@ class Work(Base):
             WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
         )
 
+    def search_index_licensepools_need_updating(self):
+        """Mark this work as needing to have the parts of its search
+        document that describe its LicensePools reindexed.
+
+        This is much cheaper than reindexing the whole document, and
+        it's all that's needed when a LicensePool's availability
+        changes.
+        """
+        full = WorkCoverageRecord.lookup(
+            self, WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
+        )
+        if full and full.status == CoverageRecord.REGISTERED:
+            # The whole document is going to be reindexed anyway.
+            return full
+        return self._reset_coverage(
+            WorkCoverageRecord.UPDATE_SEARCH_INDEX_LICENSEPOOLS_OPERATION
+        )
+
     def update_external_index(self, client, add_coverage_record=True):
         """Create a WorkCoverageRecord so that this work's
         entry in the search index can be modified or deleted.
@@ -1424,8 +1449,12 @@ class Work(Base):
     # that Elasticsearch can parse as a date.
     ELASTICSEARCH_TIME_FORMAT = 'YYYY-MM-DD"T"HH24:MI:SS"."MS'
 
+    # These are the fields of a search document that change when a
+    # LicensePool's availability changes.
+    LICENSEPOOLS_SEARCH_FIELDS = ['licensepools', 'last_update_time']
+
     @classmethod
-    def to_search_documents(cls, works, policy=None):
+    def to_search_documents(cls, works, policy=None, fields=None):
         """Generate search documents for these Works.
         This is done by constructing an extremely complicated
         SQL query. The code is ugly, but it's about 100 times
@@ -1436,6 +1465,8 @@ class Work(Base):
         :param policy: A PresentationCalculationPolicy to use when
            deciding how deep to go to find Identifiers equivalent to
            these works.
+        :param fields: If this is set, the documents will contain
+           only these fields (plus '_id'), for use in a partial update.
         """
 
         if not works:
@@ -1448,6 +1479,71 @@ class Work(Base):
         if len(works) > 50:
             _db.execute("set work_mem='200MB'")
 
+        search_json = cls.search_documents_query(
+            Work.id.in_((w.id for w in works)), policy, fields
+        )
+        result = _db.execute(search_json)
+        if result:
+            return [r[0] for r in result]
+
+    @classmethod
+    def stream_search_documents(cls, _db, work_ids=None, min_id=None,
+                                max_id=None, chunk_size=500, policy=None):
+        """Generate search documents for a large number of Works, a
+        chunk at a time.
+
+        Unlike to_search_documents, this doesn't need the Works to be
+        loaded, and the documents are read through a server-side
+        cursor, so memory use doesn't depend on how many Works there
+        are.
+
+        Since the cursor belongs to the current transaction, `_db`
+        must not be committed or rolled back until the generator is
+        exhausted.
+
+        :param work_ids: A list of Work IDs, or a SELECT statement
+            that finds Work IDs.
+        :param min_id: Only find Works with this ID or higher.
+        :param max_id: Only find Works with this ID or lower.
+        :param chunk_size: The number of search documents to yield at
+            once.
+        :yield: A series of lists of search documents.
+        """
+        clauses = []
+        if work_ids is not None:
+            clauses.append(Work.id.in_(work_ids))
+        if min_id is not None:
+            clauses.append(Work.id >= min_id)
+        if max_id is not None:
+            clauses.append(Work.id <= max_id)
+        search_json = cls.search_documents_query(and_(*clauses), policy)
+
+        _db.execute("set work_mem='200MB'")
+        result = _db.connection().execution_options(
+            stream_results=True
+        ).execute(search_json)
+        try:
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [r[0] for r in rows]
+        finally:
+            result.close()
+
+    @classmethod
+    def search_documents_query(cls, work_clause, policy=None, fields=None):
+        """Build the query that generates search documents for the
+        Works that match `work_clause`.
+
+        :param work_clause: A SQL clause restricting the Works.
+        :param policy: A PresentationCalculationPolicy, as with
+            to_search_documents.
+        :param fields: If this is set, only these fields (plus '_id')
+            will be included in the documents.
+        :return: A SELECT statement whose rows each contain one JSON
+            search document.
+        """
         # This query gets relevant columns from Work and Edition for the Works we're
         # interested in. The work_id, edition_id, and identifier_id columns are used
         # by other subqueries to filter, and the remaining columns are used directly
@@ -1481,7 +1577,7 @@ class Work(Base):
                  Work.last_update_time,
              ).label('last_update_time')
             ],
-            Work.id.in_((w.id for w in works))
+            work_clause
         ).select_from(
             join(
                 Work, Edition,
@@ -1719,57 +1815,59 @@ class Work(Base):
 
         # Now, create a query that brings together everything we need for the final
         # search document.
-        search_data = select(
-            [works_alias.c.work_id.label("_id"),
-             works_alias.c.work_id.label("work_id"),
-             works_alias.c.title,
-             works_alias.c.sort_title,
-             works_alias.c.subtitle,
-             works_alias.c.series,
-             works_alias.c.series_position,
-             works_alias.c.language,
-             works_alias.c.author,
-             works_alias.c.sort_author,
-             works_alias.c.medium,
-             works_alias.c.publisher,
-             works_alias.c.imprint,
-             works_alias.c.permanent_work_id,
-             works_alias.c.presentation_ready,
-             works_alias.c.last_update_time,
-
-             # Convert true/false to "Fiction"/"Nonfiction".
-             case(
-                    [(works_alias.c.fiction==True, literal_column("'Fiction'"))],
-                    else_=literal_column("'Nonfiction'")
-                    ).label("fiction"),
-
-             # Replace "Young Adult" with "YoungAdult" and "Adults Only" with "AdultsOnly".
-             func.replace(works_alias.c.audience, " ", "").label('audience'),
-
-             works_alias.c.summary_text.label('summary'),
-             works_alias.c.quality,
-             works_alias.c.rating,
-             works_alias.c.popularity,
-
-             # Here are all the subqueries.
-             licensepools_json.label("licensepools"),
-             customlists_json.label("customlists"),
-             contributors_json.label("contributors"),
-             identifiers_json.label("identifiers"),
-             subjects_json.label("classifications"),
-             genres_json.label('genres'),
-             target_age_json.label('target_age'),
+        columns = [
+            works_alias.c.work_id.label("_id"),
+            works_alias.c.work_id.label("work_id"),
+            works_alias.c.title,
+            works_alias.c.sort_title,
+            works_alias.c.subtitle,
+            works_alias.c.series,
+            works_alias.c.series_position,
+            works_alias.c.language,
+            works_alias.c.author,
+            works_alias.c.sort_author,
+            works_alias.c.medium,
+            works_alias.c.publisher,
+            works_alias.c.imprint,
+            works_alias.c.permanent_work_id,
+            works_alias.c.presentation_ready,
+            works_alias.c.last_update_time,
+
+            # Convert true/false to "Fiction"/"Nonfiction".
+            case(
+                   [(works_alias.c.fiction==True, literal_column("'Fiction'"))],
+                   else_=literal_column("'Nonfiction'")
+                   ).label("fiction"),
+
+            # Replace "Young Adult" with "YoungAdult" and "Adults Only" with "AdultsOnly".
+            func.replace(works_alias.c.audience, " ", "").label('audience'),
+
+            works_alias.c.summary_text.label('summary'),
+            works_alias.c.quality,
+            works_alias.c.rating,
+            works_alias.c.popularity,
+
+            # Here are all the subqueries.
+            licensepools_json.label("licensepools"),
+            customlists_json.label("customlists"),
+            contributors_json.label("contributors"),
+            identifiers_json.label("identifiers"),
+            subjects_json.label("classifications"),
+            genres_json.label('genres'),
+            target_age_json.label('target_age'),
+        ]
+        if fields is not None:
+            # Postgres won't bother running the subqueries for
+            # fields we don't include.
+            columns = [
+                c for c in columns if c.name == '_id' or c.name in fields
             ]
-        ).select_from(
+        search_data = select(columns).select_from(
             works_alias
         ).alias("search_data_subquery")
 
         # Finally, convert everything to json.
-        search_json = query_to_json(search_data)
-
-        result = _db.execute(search_json)
-        if result:
-            return [r[0] for r in result]
+        return query_to_json(search_data)
 
     @classmethod
     def target_age_query(self, foreign_work_id_field):
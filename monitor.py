@@ -1,11 +1,18 @@
 import datetime
 import logging
+import time
 import traceback
 
-from sqlalchemy.orm import defer
+from sqlalchemy.orm import (
+    class_mapper,
+    defer,
+)
+from sqlalchemy.orm.interfaces import ONETOMANY
 from sqlalchemy.sql.expression import (
     and_,
     or_,
+    select,
+    tuple_,
 )
 
 import log # This sets the appropriate log format and level.
@@ -734,6 +741,117 @@ class CustomListEntryWorkUpdateMonitor(CustomListEntrySweepMonitor):
         item.set_work()
 
 
+class CachedFeedPrewarmMonitor(Monitor):
+    """Regenerate the most popular cached feeds shortly before they
+    expire, so that patrons don't have to wait while they're
+    regenerated.
+
+    Popularity is measured by CachedFeed.hits, which the app server
+    keeps up to date. Every run halves the hit counts, so they reflect
+    recent demand.
+
+    Knowing how to generate a feed (which annotator to use, what its
+    URL is, and so on) is the app server's business, so a subclass
+    MUST implement regenerate().
+    """
+    SERVICE_NAME = "Cached feed pre-warmer"
+
+    # Only feeds of these types are regenerated ahead of time. Requests
+    # for other types of feeds aren't even counted.
+    FEED_TYPES = CachedFeed.HIT_COUNTED_TYPES
+
+    # Regenerate at most this many feeds per run.
+    DEFAULT_LIMIT = 20
+
+    # A feed is regenerated if it will expire within this long.
+    LEAD_TIME = datetime.timedelta(minutes=10)
+
+    # A feed must have been requested at least this many times (after
+    # decay) to be worth regenerating.
+    MINIMUM_HITS = 1
+
+    # To avoid putting too much load on the database and the search
+    # index at once, regenerate no more than this many feeds a minute.
+    MAX_REGENERATIONS_PER_MINUTE = 6
+
+    def __init__(self, _db, limit=None, sleep=time.sleep):
+        super(CachedFeedPrewarmMonitor, self).__init__(_db)
+        self.limit = limit or self.DEFAULT_LIMIT
+        self.sleep = sleep
+
+    def query(self):
+        """Find the feeds that should be regenerated, most popular first."""
+        cutoff = datetime.datetime.utcnow() + self.LEAD_TIME
+        return self._db.query(CachedFeed).filter(
+            CachedFeed.type.in_(self.FEED_TYPES)
+        ).filter(
+            CachedFeed.expires != None
+        ).filter(
+            CachedFeed.expires <= cutoff
+        ).filter(
+            CachedFeed.hits >= self.MINIMUM_HITS
+        ).options(
+            defer(CachedFeed.content), defer(CachedFeed.compressed_content)
+        ).order_by(
+            CachedFeed.hits.desc()
+        ).limit(self.limit)
+
+    def run_once(self, *args, **kwargs):
+        interval = 60.0 / self.MAX_REGENERATIONS_PER_MINUTE
+        regenerated = 0
+        failed = 0
+        feeds = self.query().all()
+        for i, feed in enumerate(feeds):
+            if i > 0:
+                # Rate-limit ourselves.
+                delay = interval - elapsed
+                if delay > 0:
+                    self.sleep(delay)
+            start = time.time()
+            self.log.info(
+                "Regenerating cached feed %d (%d hits)", feed.id, feed.hits
+            )
+            try:
+                self.regenerate(feed)
+                self._db.commit()
+                regenerated += 1
+            except Exception, e:
+                # Don't let one feed stop the others from being
+                # regenerated.
+                self.log.error(
+                    "Could not regenerate cached feed %d", feed.id,
+                    exc_info=e
+                )
+                failed += 1
+            elapsed = time.time() - start
+
+        self.decay()
+        achievements = "Feeds regenerated: %d" % regenerated
+        if failed:
+            achievements += ". Failures: %d" % failed
+        return TimestampData(achievements=achievements)
+
+    def decay(self):
+        """Halve every hit count, so that a feed that was popular a
+        long time ago doesn't stay popular forever.
+        """
+        self._db.query(CachedFeed).filter(CachedFeed.hits > 0).update(
+            {CachedFeed.hits: CachedFeed.hits / 2},
+            synchronize_session=False
+        )
+
+    def regenerate(self, feed):
+        """Regenerate a cached feed.
+
+        This will probably mean calling (e.g.) AcquisitionFeed.groups()
+        with max_age=0, which forces the feed to be regenerated and
+        stored.
+
+        :param feed: A CachedFeed. Its content is not loaded.
+        """
+        raise NotImplementedError()
+
+
 class ReaperMonitor(Monitor):
     """A Monitor that deletes database rows that have expired but
     have no other process to delete them.
@@ -749,18 +867,30 @@ class ReaperMonitor(Monitor):
     the time that must pass before an item can be safely deleted.
 
     A subclass of ReaperMonitor MAY define values for the following constants:
-    * BATCH_SIZE - The number of rows to fetch for deletion in a single
+    * BATCH_SIZE - The number of rows to delete in a single
     batch. The default is 1000.
+    * USE_ORM - By default, rows are deleted in batches with DELETE
+    statements, without being loaded into the session. Rows that the ORM
+    would delete along with them (through a 'delete' cascade) are
+    deleted the same way, and rows that refer to them have their foreign
+    keys set to NULL, just as the ORM would do. ORM delete listeners
+    don't run, so a reaper whose rows cascade into a class with a
+    before_delete or after_delete listener (e.g. LicensePool) must use
+    the ORM. If deleting a row takes more than that, override delete()
+    and set USE_ORM to True; rows will then be loaded and passed into
+    delete() one at a time.
 
     If your model class has fields that might contain a lot of data
     and aren't important to the reaping process, put their field names
     into a list called LARGE_FIELDS and the Reaper will avoid fetching
-    that information, improving performance.
+    that information, improving performance. This only matters if
+    USE_ORM is True.
     """
     MODEL_CLASS = None
     TIMESTAMP_FIELD = None
     MAX_AGE = None
     BATCH_SIZE = 1000
+    USE_ORM = False
 
     REGISTRY = []
 
@@ -792,7 +922,158 @@ class ReaperMonitor(Monitor):
         return self.timestamp_field < self.cutoff
 
     def run_once(self, *args, **kwargs):
+        if self.USE_ORM:
+            rows_deleted = self.reap_with_orm()
+        else:
+            rows_deleted = self.reap()
+        return TimestampData(achievements="Items deleted: %d" % rows_deleted)
+
+    def reap(self):
+        """Delete every row that needs reaping, a batch at a time,
+        without loading any of them into the session.
+
+        :return: The number of rows deleted.
+        """
+        pk = class_mapper(self.MODEL_CLASS).primary_key[0]
+        batch = self.query().with_entities(pk).limit(self.BATCH_SIZE)
+        rows_deleted = 0
+        start = time.time()
+        while True:
+            ids = [row[0] for row in batch]
+            if not ids:
+                break
+            self.delete_rows(self.MODEL_CLASS, ids)
+            self._db.commit()
+            rows_deleted += len(ids)
+            self.log_progress("Deleted", rows_deleted, start)
+        return rows_deleted
+
+    def delete_rows(self, model_class, ids):
+        """Delete database rows, along with any rows the ORM would
+        delete when deleting them.
+
+        Rows are deleted with DELETE statements, so the ORM's
+        before_delete and after_delete listeners never run. If the
+        model class, or any class its rows cascade into, has such a
+        listener, a ValueError is raised before anything is deleted;
+        reapers for such classes must set USE_ORM.
+
+        :param model_class: The model class whose rows are being deleted.
+        :param ids: A list of primary keys, or a query that finds them.
+        """
+        mapper = class_mapper(model_class)
+        self.check_bulk_delete(mapper)
+        self._delete_rows(mapper, ids)
+
+    @classmethod
+    def check_bulk_delete(cls, mapper, _path=()):
+        """Make sure rows of the given mapper's class, and the rows
+        they cascade into, can be deleted without going through the ORM.
+
+        :raise ValueError: If a class along the way has a delete
+            listener, or if the delete cascade loops back on itself,
+            which would require deleting rows one at a time.
+        """
+        table = mapper.local_table
+        if table in _path:
+            raise ValueError(
+                "Delete cascade from %s loops back through %s." % (
+                    _path[0].name, table.name
+                )
+            )
+        if mapper.dispatch.before_delete or mapper.dispatch.after_delete:
+            raise ValueError(
+                "%s has a delete listener and can't be deleted in bulk." %
+                mapper.class_.__name__
+            )
+        path = _path + (table,)
+        for relationship in cls._cascades(mapper):
+            cls.check_bulk_delete(relationship.mapper, path)
+
+    @classmethod
+    def _cascades(cls, mapper):
+        """The relationships along which the ORM would delete rows
+        when a row of the given mapper's class is deleted.
+        """
+        for relationship in mapper.relationships:
+            if (relationship.viewonly or relationship.passive_deletes
+                or relationship.secondary is not None):
+                continue
+            if (relationship.direction is ONETOMANY
+                and relationship.cascade.delete):
+                yield relationship
+
+    @classmethod
+    def _primary_key(cls, mapper):
+        """An expression for the primary key of the given mapper's
+        table, suitable for an IN clause.
+        """
+        if len(mapper.primary_key) == 1:
+            return mapper.primary_key[0]
+        return tuple_(*mapper.primary_key)
+
+    @classmethod
+    def _referring(cls, pairs, mapper, ids):
+        """A clause that finds rows referring to the rows being deleted.
+
+        :param pairs: A relationship's synchronize_pairs: a list of
+            (local column, remote column) 2-tuples.
+        :param mapper: The mapper for the class being deleted.
+        :param ids: Primary keys of the rows being deleted.
+        """
+        local = [l for l, r in pairs]
+        remote = [r for l, r in pairs]
+        if len(local) == 1 and local[0] is cls._primary_key(mapper):
+            return remote[0].in_(ids)
+        parents = select(local).where(cls._primary_key(mapper).in_(ids))
+        if len(remote) == 1:
+            return remote[0].in_(parents)
+        return tuple_(*remote).in_(parents)
+
+    def _delete_rows(self, mapper, ids):
+        for relationship in mapper.relationships:
+            if relationship.viewonly or relationship.passive_deletes:
+                # The ORM would leave these rows alone.
+                continue
+            referring = self._referring(
+                relationship.synchronize_pairs, mapper, ids
+            )
+            if relationship.secondary is not None:
+                # Rows in an association table go away along with
+                # the rows they associate.
+                table = relationship.secondary
+                self._db.execute(table.delete().where(referring))
+            elif relationship.direction is not ONETOMANY:
+                continue
+            elif relationship.cascade.delete:
+                child = relationship.mapper
+                self._delete_rows(
+                    child,
+                    select(child.primary_key).where(referring)
+                )
+            else:
+                # The ORM would disassociate these rows rather than
+                # delete them.
+                table = relationship.synchronize_pairs[0][1].table
+                self._db.execute(
+                    table.update().where(referring).values(
+                        dict((r.name, None)
+                             for l, r in relationship.synchronize_pairs)
+                    )
+                )
+        table = mapper.local_table
+        self._db.execute(
+            table.delete().where(self._primary_key(mapper).in_(ids))
+        )
+
+    def reap_with_orm(self):
+        """Delete every row that needs reaping by loading it and passing
+        it into delete().
+
+        :return: The number of rows deleted.
+        """
         rows_deleted = 0
+        start = time.time()
         qu = self.query()
         to_defer = getattr(self.MODEL_CLASS, 'LARGE_FIELDS', [])
         for x in to_defer:
@@ -805,12 +1086,23 @@ class ReaperMonitor(Monitor):
                 self.delete(i)
                 rows_deleted += 1
             self._db.commit()
+            self.log_progress("Deleted", rows_deleted, start)
             count = qu.count()
-        return TimestampData(achievements="Items deleted: %d" % rows_deleted)
+        return rows_deleted
+
+    def log_progress(self, verb, count, start):
+        """Log how many rows have been handled so far, and how quickly."""
+        elapsed = time.time() - start
+        rate = count / elapsed if elapsed > 0 else 0
+        self.log.info(
+            "%s %d row(s) in %.2f sec (%.1f/sec)", verb, count, elapsed, rate
+        )
 
     def delete(self, row):
         """Delete a row from the database.
 
+        This is only called if USE_ORM is True.
+
         CAUTION: If you override this method such that it doesn't
         actually delete the database row, then run_once() may enter an
         infinite loop.
@@ -853,6 +1145,9 @@ class WorkReaper(ReaperMonitor):
     """
     MODEL_CLASS = Work
 
+    # Works need to be removed from the search index as well.
+    USE_ORM = True
+
     def __init__(self, *args, **kwargs):
         from external_search import ExternalSearchIndex
         search_index_client = kwargs.pop('search_index_client', None)
@@ -877,6 +1172,9 @@ class CollectionReaper(ReaperMonitor):
     """Remove collections that have been marked for deletion."""
     MODEL_CLASS = Collection
 
+    # Deleting a Collection is a complicated process of its own.
+    USE_ORM = True
+
     @property
     def where_clause(self):
         """A SQLAlchemy clause that identifies the database rows to be reaped.
@@ -910,11 +1208,6 @@ class MeasurementReaper(ReaperMonitor):
     def where_clause(self):
         return Measurement.is_most_recent == False
 
-    def run_once(self, *args, **kwargs):
-        rows_deleted = self.query().delete()
-        self._db.commit()
-        return TimestampData(achievements=u"Items deleted: %d" % rows_deleted)
-
 ReaperMonitor.REGISTRY.append(MeasurementReaper)
 
 
@@ -942,17 +1235,28 @@ class ScrubberMonitor(ReaperMonitor):
         )
 
     def run_once(self, *args, **kwargs):
-        """Find all rows that need to be scrubbed, and scrub them."""
+        """Find all rows that need to be scrubbed, and scrub them, a
+        batch at a time.
+        """
         rows_scrubbed = 0
-        cls = self.MODEL_CLASS
-        update = cls.__table__.update().where(
+        start = time.time()
+        table = self.MODEL_CLASS.__table__
+        batch = select([table.c.id]).where(
             self.where_clause
+        ).limit(self.BATCH_SIZE)
+        update = table.update().where(
+            table.c.id.in_(batch)
         ).values(
             {self.SCRUB_FIELD : None}
-        ).returning(cls.id)
-        scrubbed = self._db.execute(update).fetchall()
-        self._db.commit()
-        return TimestampData(achievements="Items scrubbed: %d" % len(scrubbed))
+        )
+        while True:
+            scrubbed = self._db.execute(update).rowcount
+            self._db.commit()
+            if not scrubbed:
+                break
+            rows_scrubbed += scrubbed
+            self.log_progress("Scrubbed", rows_scrubbed, start)
+        return TimestampData(achievements="Items scrubbed: %d" % rows_scrubbed)
 
     @property
     def where_clause(self):
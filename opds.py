@@ -1,5 +1,7 @@
 import datetime
+import inspect
 import logging
+import re
 import urllib
 from collections import (
     defaultdict,
@@ -33,7 +35,8 @@ from model import (
     Measurement,
     Subject,
     Work,
-    ExternalIntegration
+    ExternalIntegration,
+    preload,
 )
 from util.flask_util import (
     OPDSEntryResponse,
@@ -56,6 +59,25 @@ class UnfulfillableWork(Exception):
     none of the delivery mechanisms could be mirrored.
     """
 
+
+class StreamingFeed(object):
+    """The pieces of a feed that's being generated a piece at a time,
+    along with the IDs of the works that have gone into it so far.
+
+    Once all the pieces have been consumed, `work_ids` is complete.
+    """
+
+    def __init__(self, chunks, work_ids):
+        self.chunks = chunks
+        self.work_ids = work_ids
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self.chunks)
+
+
 class Annotator(object):
     """The Annotator knows how to present an OPDS feed in a specific
     application context.
@@ -63,6 +85,42 @@ class Annotator(object):
 
     opds_cache_field = Work.simple_opds_entry.name
 
+    # Set this to True if annotate_work_entry() only ever appends new
+    # tags to the <entry> it's given, without looking at or changing
+    # the tags already there. That makes it possible to annotate a
+    # cached entry without parsing it.
+    #
+    # A subclass that overrides annotate_work_entry() doesn't inherit
+    # this promise; it must set append_only itself. See
+    # is_append_only().
+    append_only = True
+
+    # The relationships, starting from Work, that annotate_work_entry()
+    # and the methods it calls will look at for every work in a feed.
+    # AcquisitionFeed loads them for all of a feed's works at once
+    # rather than one work at a time. A subclass that looks at other
+    # relationships should add them here.
+    annotation_preload_paths = [
+        ('license_pools', 'presentation_edition'),
+        ('license_pools', 'identifier'),
+        ('license_pools', 'data_source'),
+        ('license_pools', 'collection'),
+        ('license_pools', 'delivery_mechanisms', 'delivery_mechanism'),
+        ('license_pools', 'delivery_mechanisms', 'rights_status'),
+        ('license_pools', 'delivery_mechanisms', 'resource',
+         'representation'),
+    ]
+
+    # The relationships, starting from Work, that are needed to build
+    # an OPDS entry from scratch. These are only loaded for works
+    # that don't have a cached entry.
+    entry_preload_paths = [
+        ('presentation_edition', 'contributions', 'contributor'),
+        ('presentation_edition', 'primary_identifier'),
+        ('work_genres', 'genre'),
+        ('summary',),
+    ]
+
     def is_work_entry_solo(self, work):
         """Return a boolean value indicating whether the work's OPDS catalog entry is served by itself,
             rather than as a part of the feed.
@@ -76,6 +134,25 @@ class Annotator(object):
         """
         return False
 
+    @classmethod
+    def is_append_only(cls, annotator):
+        """Has the given annotator promised that its annotate_work_entry()
+        only appends tags to the entry?
+
+        The promise only counts if it was made by the class that
+        defines annotate_work_entry(), or by one of its subclasses.
+
+        :param annotator: An Annotator class or instance.
+        """
+        if not inspect.isclass(annotator):
+            annotator = annotator.__class__
+        for klass in inspect.getmro(annotator):
+            if 'append_only' in klass.__dict__:
+                return klass.__dict__['append_only']
+            if 'annotate_work_entry' in klass.__dict__:
+                return False
+        return False
+
     def annotate_work_entry(self, work, active_license_pool, edition,
                             identifier, feed, entry, updated=None):
         """Make any custom modifications necessary to integrate this
@@ -475,6 +552,10 @@ class VerboseAnnotator(Annotator):
 
     opds_cache_field = Work.verbose_opds_entry.name
 
+    # annotate_work_entry() only appends ratings to what the
+    # superclass appends.
+    append_only = True
+
     def annotate_work_entry(self, work, active_license_pool, edition,
                             identifier, feed, entry):
         super(VerboseAnnotator, self).annotate_work_entry(
@@ -584,7 +665,7 @@ class AcquisitionFeed(OPDSFeed):
     @classmethod
     def groups(cls, _db, title, url, worklist, annotator,
                pagination=None, facets=None, max_age=None,
-               search_engine=None, search_debug=False,
+               search_engine=None, search_debug=False, stream=False,
                **response_kwargs
     ):
         """The acquisition feed for 'featured' items from a given lane's
@@ -597,6 +678,9 @@ class AcquisitionFeed(OPDSFeed):
         :param pagination: A Pagination object. No single child of this lane
             will contain more than `pagination.size` items.
         :param facets: A GroupsFacet object.
+        :param stream: If this is True and the feed has to be
+            generated, send it to the client a piece at a time as it's
+            generated, rather than all at once.
 
         :param response_kwargs: Extra keyword arguments to pass into
             the OPDSFeedResponse constructor.
@@ -610,22 +694,26 @@ class AcquisitionFeed(OPDSFeed):
             return cls._generate_groups(
                 _db=_db, title=title, url=url, worklist=worklist,
                 annotator=annotator, pagination=pagination, facets=facets,
-                search_engine=search_engine, search_debug=search_debug
+                search_engine=search_engine, search_debug=search_debug,
+                stream=stream
             )
 
         return CachedFeed.fetch(
             _db=_db, worklist=worklist, pagination=pagination,
             facets=facets, refresher_method=refresh, max_age=max_age,
-            **response_kwargs
+            stream=stream, **response_kwargs
         )
 
     @classmethod
     def _generate_groups(
         cls, _db, title, url, worklist, annotator,
-        pagination, facets, search_engine, search_debug
+        pagination, facets, search_engine, search_debug, stream=False
     ):
         """Internal method called by groups() when a grouped feed
         must be regenerated.
+
+        :return: An AcquisitionFeed or, if `stream` is True, a generator
+            of strings that make up the feed.
         """
 
         # Try to get a set of (Work, WorkList) 2-tuples
@@ -668,7 +756,12 @@ class AcquisitionFeed(OPDSFeed):
             all_works.append(work)
 
         all_works = annotator.sort_works_for_groups_feed(all_works)
-        feed = AcquisitionFeed(_db, title, url, all_works, annotator)
+        # When streaming, the entries are created after all the
+        # feed-level annotations are in place.
+        feed = AcquisitionFeed(
+            _db, title, url, [] if stream else all_works, annotator,
+            splice_cached_entries=True
+        )
 
         # Regardless of whether or not the entries in feed can be
         # grouped together, we want to apply certain feed-level
@@ -692,16 +785,22 @@ class AcquisitionFeed(OPDSFeed):
         # Miscellaneous.
         annotator.annotate_feed(feed, worklist)
 
+        if stream:
+            return feed.stream_works(all_works)
         return feed
 
     @classmethod
     def page(cls, _db, title, url, worklist, annotator,
              facets=None, pagination=None,
              max_age=None, search_engine=None, search_debug=False,
-             **response_kwargs
+             stream=False, **response_kwargs
     ):
         """Create a feed representing one page of works from a given lane.
 
+        :param stream: If this is True and the feed has to be
+            generated, send it to the client a piece at a time as it's
+            generated, rather than all at once.
+
         :param response_kwargs: Extra keyword arguments to pass into
             the OPDSFeedResponse constructor.
 
@@ -715,22 +814,25 @@ class AcquisitionFeed(OPDSFeed):
         def refresh():
             return cls._generate_page(
                 _db, title, url, worklist, annotator, facets, pagination,
-                search_engine, search_debug
+                search_engine, search_debug, stream=stream
             )
 
         response_kwargs.setdefault('max_age', max_age)
         return CachedFeed.fetch(
             _db, worklist=worklist, pagination=pagination, facets=facets,
-            refresher_method=refresh, **response_kwargs
+            refresher_method=refresh, stream=stream, **response_kwargs
         )
 
     @classmethod
     def _generate_page(
         cls, _db, title, url, lane, annotator, facets, pagination,
-        search_engine, search_debug
+        search_engine, search_debug, stream=False
     ):
         """Internal method called by page() when a cached feed
         must be regenerated.
+
+        :return: An AcquisitionFeed or, if `stream` is True, a generator
+            of strings that make up the feed.
         """
         works = lane.works(
             _db, pagination=pagination, facets=facets,
@@ -748,7 +850,10 @@ class AcquisitionFeed(OPDSFeed):
             # Pagination.page_loaded may or may not have been called
             # yet.
             pagination.page_loaded(works)
-        feed = cls(_db, title, url, works, annotator)
+        feed = cls(
+            _db, title, url, [] if stream else works, annotator,
+            splice_cached_entries=True
+        )
 
         entrypoints = facets.selectable_entrypoints(lane)
         if entrypoints:
@@ -759,7 +864,8 @@ class AcquisitionFeed(OPDSFeed):
                     lane, facets=facets.navigate(entrypoint=ep)
                 )
             cls.add_entrypoint_links(
-                feed, make_link, entrypoints, facets.entrypoint
+                feed, make_link, entrypoints, facets.entrypoint,
+                facet_counts=getattr(facets, 'facet_counts', None)
             )
 
         # Add URLs to change faceted views of the collection.
@@ -781,6 +887,8 @@ class AcquisitionFeed(OPDSFeed):
             feed.add_breadcrumb_links(lane, facets.entrypoint)
 
         annotator.annotate_feed(feed, lane)
+        if stream:
+            return feed.stream_works(works)
         return feed
 
     @classmethod
@@ -854,9 +962,23 @@ class AcquisitionFeed(OPDSFeed):
             args['{%s}activeFacet' % AtomFeed.OPDS_NS] = "true"
         return args
 
+    @classmethod
+    def add_facet_count(cls, link, count):
+        """Record the number of works under a facet in the attributes
+        for its facet link.
+
+        :param link: A dictionary of attributes, as created by
+            facet_link().
+        :param count: The number of works, or None if unknown.
+        """
+        if count is not None:
+            link['{%s}count' % AtomFeed.THR_NS] = str(count)
+        return link
+
     @classmethod
     def add_entrypoint_links(cls, feed, url_generator, entrypoints,
-                             selected_entrypoint, group_name='Formats'):
+                             selected_entrypoint, group_name='Formats',
+                             facet_counts=None):
         """Add links to a feed forming an OPDS facet group for a set of
         EntryPoints.
 
@@ -865,6 +987,8 @@ class AcquisitionFeed(OPDSFeed):
             URL when passed an EntryPoint.
         :param entrypoints: A list of all EntryPoints in the facet group.
         :param selected_entrypoint: The current EntryPoint, if selected.
+        :param facet_counts: A dictionary of facet counts, as found in
+            BaseFacets.facet_counts.
         """
         if (len(entrypoints) == 1
             and selected_entrypoint in (None, entrypoints[0])):
@@ -881,6 +1005,11 @@ class AcquisitionFeed(OPDSFeed):
                 group_name
             )
             if link is not None:
+                if facet_counts:
+                    cls.add_facet_count(link, facet_counts.get(
+                        (FacetConstants.ENTRY_POINT_FACET_GROUP_NAME,
+                         entrypoint.INTERNAL_NAME)
+                    ))
                 cls.add_link_to_feed(feed.feed, **link)
                 is_default = False
 
@@ -999,7 +1128,8 @@ class AcquisitionFeed(OPDSFeed):
                     facets=facets.navigate(entrypoint=ep)
                 )
             cls.add_entrypoint_links(
-                opds_feed, make_link, entrypoints, facets.entrypoint
+                opds_feed, make_link, entrypoints, facets.entrypoint,
+                facet_counts=getattr(facets, 'facet_counts', None)
             )
 
         if len(results) > 0:
@@ -1104,6 +1234,7 @@ class AcquisitionFeed(OPDSFeed):
         circumstances apply. You need to decide whether to call
         add_entrypoint_links in addition to calling this method.
         """
+        facet_counts = getattr(facets, 'facet_counts', None)
         for group, value, new_facets, selected in facets.facet_groups:
             url = annotator.facet_url(new_facets)
             if not url:
@@ -1115,23 +1246,47 @@ class AcquisitionFeed(OPDSFeed):
                 # system. It may be left over from an earlier version,
                 # or just weird junk data.
                 continue
-            yield cls.facet_link(
+            link = cls.facet_link(
                 url, unicode(facet_title), unicode(group_title), selected
             )
+            if facet_counts:
+                cls.add_facet_count(link, facet_counts.get((group, value)))
+            yield link
+
+    # When a cached entry is spliced into a feed, this comment marks
+    # the spot where its content goes.
+    SPLICE_MARKER = "splice:%d"
+    SPLICE_MARKER_RE = re.compile("<!--splice:([0-9]+)-->")
 
     def __init__(self, _db, title, url, works, annotator=None,
-                 precomposed_entries=[]):
+                 precomposed_entries=[], splice_cached_entries=False):
         """Turn a list of works, messages, and precomposed <opds> entries
         into a feed.
+
+        :param splice_cached_entries: If this is True, and the
+            annotator's annotate_work_entry() is append-only, cached
+            entries will be spliced into the feed as strings rather
+            than parsed, annotated and serialized again. The feed will
+            not be pretty-printed.
         """
         if not annotator:
             annotator = Annotator
         if callable(annotator):
             annotator = annotator()
         self.annotator = annotator
+        self._db = _db
+        self.splice_cached_entries = (
+            splice_cached_entries and Annotator.is_append_only(annotator)
+        )
+        self.spliced_entries = []
+
+        # The IDs of the works in this feed, so that a cached copy of
+        # the feed can be invalidated when one of them changes.
+        self.work_ids = set()
 
         super(AcquisitionFeed, self).__init__(title, url)
 
+        self.preload(_db, works)
         for work in works:
             self.add_entry(work)
 
@@ -1141,10 +1296,109 @@ class AcquisitionFeed(OPDSFeed):
                 entry = entry.tag
             self.feed.append(entry)
 
+    def __unicode__(self):
+        if self.feed is None or not self.spliced_entries:
+            return super(AcquisitionFeed, self).__unicode__()
+
+        # Pretty-print the feed around the cached entries, then
+        # replace each marker with the content of a cached entry. The
+        # cached content itself stays on one line, since indenting it
+        # would mean parsing it, which is what we're trying to avoid;
+        # otherwise the output matches what an unspliced feed would
+        # look like.
+        return self.SPLICE_MARKER_RE.sub(
+            lambda match: self.spliced_entries[int(match.group(1))],
+            etree.tounicode(self.feed, pretty_print=True)
+        )
+
+    def stream_works(self, works, precomposed_entries=[]):
+        """Generate this feed a piece at a time: first everything
+        that's already in the feed, then an entry for each work as
+        it's created, then the precomposed entries.
+
+        Feed-level links must be added before this is called.
+
+        :return: A StreamingFeed.
+        """
+        def entries():
+            self.preload(self._db, works)
+            for work in works:
+                self._record_work(work)
+                entry = self.create_entry(work)
+                if isinstance(entry, OPDSMessage):
+                    entry = entry.tag
+                if entry is None:
+                    continue
+                yield self._fill_in_spliced_entries(
+                    self.element_to_unicode(entry)
+                )
+            for entry in precomposed_entries:
+                if isinstance(entry, OPDSMessage):
+                    entry = entry.tag
+                yield entry
+        return StreamingFeed(self.stream(entries()), self.work_ids)
+
+    def preload(self, _db, works):
+        """Load everything the annotator will need to create entries
+        for `works`, with a fixed number of queries rather than a few
+        queries per work.
+
+        :param works: The items that will be passed into create_entry().
+        """
+        if _db is None or not isinstance(works, list):
+            # A query or a generator can only be run through once,
+            # and that has to happen as the entries are created.
+            return
+        works = [self._work_for(x) for x in works]
+        works = [x for x in works if isinstance(x, Work)]
+        if not works:
+            return
+        preload(
+            _db, works,
+            *getattr(self.annotator, 'annotation_preload_paths', [])
+        )
+
+        # Only works without a cached entry need the information
+        # used to build one.
+        field = self.annotator.opds_cache_field
+        uncached = [x for x in works if not field or not getattr(x, field)]
+        preload(
+            _db, uncached,
+            *getattr(self.annotator, 'entry_preload_paths', [])
+        )
+
+    def _work_for(self, item):
+        """Find the Work, if any, behind an item that will be passed
+        into create_entry().
+        """
+        # A WorkSearchResult acts like a Work, but it isn't one.
+        return getattr(item, '_work', item)
+
+    def _record_work(self, item):
+        """Note that the Work behind `item` is in this feed."""
+        work = self._work_for(item)
+        if isinstance(work, Work) and work.id is not None:
+            self.work_ids.add(work.id)
+
+    def _fill_in_spliced_entries(self, serialized):
+        """Replace each splice marker in a serialized entry with the
+        content it stands for.
+
+        Content that has been filled in is let go, so a streaming feed
+        doesn't hold on to every entry it's ever sent.
+        """
+        def replace(match):
+            index = int(match.group(1))
+            content = self.spliced_entries[index]
+            self.spliced_entries[index] = None
+            return content
+        return self.SPLICE_MARKER_RE.sub(replace, serialized)
+
     def add_entry(self, work):
         """Attempt to create an OPDS <entry>. If successful, append it to
         the feed.
         """
+        self._record_work(work)
         entry = self.create_entry(work)
 
         if entry is not None:
@@ -1249,7 +1503,12 @@ class AcquisitionFeed(OPDSFeed):
         if field and work and not force_create and use_cache:
             xml = getattr(work, field)
 
-        if xml:
+        placeholder = None
+        if xml and self.splice_cached_entries:
+            placeholder = self._splice(xml)
+        if placeholder is not None:
+            xml = placeholder
+        elif xml:
             xml = etree.fromstring(xml)
         else:
             xml = self._make_entry_xml(work, edition)
@@ -1264,6 +1523,40 @@ class AcquisitionFeed(OPDSFeed):
 
         return xml
 
+    def _splice(self, xml):
+        """Prepare to splice a cached entry into this feed without
+        parsing it.
+
+        :param xml: A cached <entry>, as a string.
+        :return: A placeholder <entry> tag to be annotated and added to
+            the feed, or None if this entry can't be spliced -- most
+            likely because it was cached with an older set of
+            namespaces.
+        """
+        end_tag = u"</entry>"
+        if (not xml.startswith(self.ENTRY_START_TAG)
+            or not xml.endswith(end_tag)):
+            return None
+        start_tag_end = xml.index(u">") + 1
+        start_tag = xml[:start_tag_end]
+        attributes = start_tag[len(self.ENTRY_START_TAG):-1]
+        if attributes and (
+            not attributes.startswith(u" ") or u"xmlns" in attributes
+        ):
+            return None
+
+        placeholder = AtomFeed.entry()
+        if attributes:
+            # Copy the attributes of the cached tag, e.g.
+            # schema:additionalType, onto the placeholder.
+            for key, value in etree.fromstring(start_tag + end_tag).items():
+                placeholder.set(key, value)
+        placeholder.append(
+            etree.Comment(self.SPLICE_MARKER % len(self.spliced_entries))
+        )
+        self.spliced_entries.append(xml[start_tag_end:-len(end_tag)])
+        return placeholder
+
     def _make_entry_xml(self, work, edition):
         """Create a new (incomplete) OPDS entry for the given work.
 
@@ -1758,6 +2051,10 @@ class LookupAcquisitionFeed(AcquisitionFeed):
     default LicensePool.
     """
 
+    def _work_for(self, item):
+        identifier, work = item
+        return work
+
     def create_entry(self, work):
         """Turn an Identifier and a Work into an entry for an acquisition
         feed.
@@ -1,6 +1,7 @@
 import argparse
 import datetime
 import logging
+import multiprocessing
 import os
 import random
 import re
@@ -27,8 +28,10 @@ from sqlalchemy.orm.exc import (
 # from axis import Axis360BibliographicCoverageProvider
 from config import Configuration, CannotLoadConfiguration
 from coverage import (
+    CollectionCoverageProvider,
     CollectionCoverageProviderJob,
     CoverageProviderProgress,
+    CoverageProviderShardJob,
 )
 from external_search import (
     ExternalSearchIndex,
@@ -92,6 +95,7 @@ from util.personal_names import (
 )
 from util.worker_pools import (
     DatabasePool,
+    DatabaseProcessPool,
 )
 
 
@@ -446,6 +450,101 @@ class RunThreadedCollectionCoverageProviderScript(Script):
         return fast_query_count(qu), provider.batch_size
 
 
+class RunMultiprocessCoverageProviderScript(Script):
+    """Run a coverage provider in multiple processes.
+
+    The items that need coverage are split into ranges of IDs, and
+    each range is covered in one of a pool of worker processes. This
+    gets around the GIL for CPU-bound providers such as classification
+    or OPDS entry generation, where RunThreadedCollectionCoverageProviderScript
+    can't do better than one core.
+    """
+
+    # Split the work into more ranges than there are workers, so that
+    # a worker that finishes early can pick up another range.
+    SHARDS_PER_WORKER = 4
+
+    def __init__(self, provider_class, worker_size=None, _db=None,
+        **provider_kwargs
+    ):
+        """Constructor.
+
+        :param worker_size: The number of worker processes. By
+            default, there's one for each CPU.
+        :param provider_kwargs: Passed into the provider's
+            constructor in each worker process, so they must be
+            picklable.
+        """
+        super(RunMultiprocessCoverageProviderScript, self).__init__(_db)
+        self.worker_size = worker_size or multiprocessing.cpu_count()
+        self.provider_class = provider_class
+        self.provider_kwargs = provider_kwargs
+
+    def providers(self):
+        """Yield a 2-tuple (collection ID, provider) for each provider
+        that needs to be run.
+        """
+        if issubclass(self.provider_class, CollectionCoverageProvider):
+            for collection in self.provider_class.collections(self._db):
+                yield collection.id, self.provider_class(
+                    collection, **self.provider_kwargs
+                )
+        else:
+            yield None, self.provider_class(self._db, **self.provider_kwargs)
+
+    def run(self, pool=None):
+        """Run the provider over every relevant collection and update
+        its timestamps.
+
+        :param pool: A DatabaseProcessPool (or other) object for use in
+            testing environments.
+        """
+        for collection_id, provider in self.providers():
+            self.run_provider(provider, collection_id, pool)
+
+    def run_provider(self, provider, collection_id, pool=None):
+        """Cover all of one provider's items, one range of IDs at a
+        time, then record the combined progress in its Timestamp.
+
+        :return: A CoverageProviderProgress.
+        """
+        progress = CoverageProviderProgress(start=datetime.datetime.utcnow())
+        id_ranges = provider.id_ranges(
+            self.worker_size * self.SHARDS_PER_WORKER
+        )
+
+        # Don't keep a transaction open while the worker processes
+        # are forked and do their work.
+        self._db.commit()
+
+        pool = pool or DatabaseProcessPool(self.worker_size)
+        job_total = pool.job_total
+        error_count = pool.error_count
+        result_count = len(pool.results)
+        with pool as job_queue:
+            for min_id, max_id in id_ranges:
+                job = CoverageProviderShardJob(
+                    self.provider_class, min_id, max_id,
+                    collection_id=collection_id, **self.provider_kwargs
+                )
+                job_queue.put(job)
+
+        for successes, transient_failures, persistent_failures in (
+            pool.results[result_count:]
+        ):
+            progress.successes += successes
+            progress.transient_failures += transient_failures
+            progress.persistent_failures += persistent_failures
+
+        errors = pool.error_count - error_count
+        if errors:
+            progress.exception = "%d of %d ID ranges could not be covered." % (
+                errors, pool.job_total - job_total
+            )
+        provider.finalize_timestampdata(progress)
+        return progress
+
+
 class RunWorkCoverageProviderScript(RunCollectionCoverageProviderScript):
     """Run a WorkCoverageProvider on every relevant Work in the system."""
 
@@ -3167,6 +3266,21 @@ class ListCollectionMetadataIdentifiersScript(CollectionInputScript):
 
 
 class UpdateLaneSizeScript(LaneSweeperScript):
+    """Update the estimated size of every Lane in a library.
+
+    All of a library's Lanes are counted together, in as few search
+    requests as possible, and their sizes are committed together.
+    """
+
+    def process_library(self, library):
+        self.lanes = []
+        super(UpdateLaneSizeScript, self).process_library(library)
+        if not self.lanes:
+            return
+        Lane.update_sizes(self._db, self.lanes)
+        for lane in self.lanes:
+            self.log.info("%s: %d", lane.full_identifier, lane.size)
+        self._db.commit()
 
     def should_process_lane(self, lane):
         """We don't want to process generic WorkLists -- there's nowhere
@@ -3175,9 +3289,10 @@ class UpdateLaneSizeScript(LaneSweeperScript):
         return isinstance(lane, Lane)
 
     def process_lane(self, lane):
-        """Update the estimated size of a Lane."""
-        lane.update_size(self._db)
-        self.log.info("%s: %d", lane.full_identifier, lane.size)
+        """Queue up a Lane to have its size updated along with the rest
+        of its library's Lanes.
+        """
+        self.lanes.append(lane)
 
 
 class UpdateCustomListSizeScript(CustomListSweeperScript):
@@ -3192,23 +3307,60 @@ class RemovesSearchCoverage(object):
     def remove_search_coverage_records(self):
         """Delete all search coverage records from the database.
 
+        This includes the records for partial updates of the license
+        pool information. The fingerprints of the works' search
+        documents are also cleared, so that every document will be
+        uploaded again.
+
         :return: The number of records deleted.
         """
         wcr = WorkCoverageRecord
-        clause = wcr.operation==wcr.UPDATE_SEARCH_INDEX_OPERATION
+        clause = wcr.operation.in_([
+            wcr.UPDATE_SEARCH_INDEX_OPERATION,
+            wcr.UPDATE_SEARCH_INDEX_LICENSEPOOLS_OPERATION,
+        ])
         count = self._db.query(wcr).filter(clause).count()
         self._db.execute(wcr.__table__.delete().where(clause))
+        works = Work.__table__
+        self._db.execute(
+            works.update().where(
+                works.c.search_document_fingerprint != None
+            ).values(search_document_fingerprint=None)
+        )
         return count
 
 
 class RebuildSearchIndexScript(
     RunWorkCoverageProviderScript, RemovesSearchCoverage
 ):
-    """Completely delete the search index and recreate it."""
+    """Completely delete the search index and recreate it.
+
+    With --streamed, search documents are streamed out of the database
+    without loading the works (see
+    SearchIndexCoverageProvider.run_streamed). Pass in `uploaders` to
+    rebuild the index with a SearchIndexPipeline instead, which
+    creates search documents for one batch of works while earlier
+    batches are being uploaded.
+    """
+
+    @classmethod
+    def arg_parser(cls):
+        parser = argparse.ArgumentParser()
+        parser.add_argument(
+            '--streamed',
+            help='Stream search documents out of the database instead of loading the works. Faster, but search document fingerprints are not recorded.',
+            action='store_true',
+        )
+        return parser
 
     def __init__(self, *args, **kwargs):
         search = kwargs.get('search_index_client', None)
         self.search = search or ExternalSearchIndex(self._db)
+        parsed = self.parse_command_line(
+            cmd_args=kwargs.pop('cmd_args', None)
+        )
+        if parsed.streamed and not kwargs.get('uploaders'):
+            kwargs['streamed'] = True
         super(RebuildSearchIndexScript, self).__init__(
             SearchIndexCoverageProvider, *args, **kwargs
         )
@@ -15,6 +15,8 @@ from nose.tools import (
 )
 # TODO PYTHON3
 # from psycopg2.errors import UndefinedTable
+from contextlib import contextmanager
+from sqlalchemy import event
 from sqlalchemy.orm.session import Session
 from sqlalchemy.exc import ProgrammingError
 from config import Configuration
@@ -185,6 +187,37 @@ class LogCaptureHandler(logging.Handler):
         return self.__getitem__(item)
 
 
+class QueryCounter(object):
+    """A context manager that keeps track of the SQL statements sent
+    over a database connection.
+    """
+
+    def __init__(self, connection):
+        """Constructor.
+
+        :param connection: A database connection, such as
+            `DatabaseTest.connection`.
+        """
+        self.connection = connection
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __enter__(self):
+        self.statements = []
+        event.listen(self.connection, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        event.remove(self.connection, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context,
+                executemany):
+        self.statements.append(statement)
+
+
 class DatabaseTest(object):
 
     engine = None
@@ -284,6 +317,26 @@ class DatabaseTest(object):
         if self.search_mock:
             self.search_mock.stop()
 
+    @contextmanager
+    def query_budget(self, max_queries):
+        """Fail the test if the code inside this context manager sends
+        more than `max_queries` SQL statements to the database.
+
+        Useful for making sure that the number of queries doesn't
+        grow along with the amount of data being processed.
+
+        :yield: A QueryCounter.
+        """
+        self._db.flush()
+        with QueryCounter(self.connection) as counter:
+            yield counter
+        if counter.count > max_queries:
+            raise AssertionError(
+                "Expected at most %d queries, but %d were run:\n%s" % (
+                    max_queries, counter.count, "\n".join(counter.statements)
+                )
+            )
+
     def time_eq(self, a, b):
         "Assert that two times are *approximately* the same -- within 2 seconds."
         if a < b:
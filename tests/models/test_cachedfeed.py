@@ -4,7 +4,14 @@ from nose.tools import (
     eq_,
     set_trace,
 )
+from collections import defaultdict
 import datetime
+from mock import patch
+import threading
+import time
+from flask import Flask
+from sqlalchemy.sql import select
+from werkzeug.http import http_date
 from .. import DatabaseTest
 from ...classifier import Classifier
 from ...lane import (
@@ -13,10 +20,22 @@ from ...lane import (
     Lane,
     WorkList,
 )
-from ...model.cachedfeed import CachedFeed
+from ...model.cachedfeed import (
+    CachedFeed,
+    cachedfeeds_works,
+)
+from ...model import get_one_or_create
 from ...model.configuration import ConfigurationSetting
-from ...opds import AcquisitionFeed
-from ...util.flask_util import OPDSFeedResponse
+from ...opds import (
+    AcquisitionFeed,
+    Annotator,
+)
+from ...testing import QueryCounter
+from ...util.cache import SingleFlight
+from ...util.flask_util import (
+    OPDSFeedResponse,
+    gzip_decompress,
+)
 from ...util.opds_writer import OPDSFeed
 
 class MockFeedGenerator(object):
@@ -397,6 +416,622 @@ class TestCachedFeed(DatabaseTest):
         assert isinstance(r, OPDSFeedResponse)
         eq_(OPDSFeed.DEFAULT_MAX_AGE, r.max_age)
 
+    def test_memory_cache(self):
+        # Verify that an in-process cache can be put in front of the
+        # database.
+        facets = Facets.default(self._default_library)
+        pagination = Pagination.default()
+        wl = WorkList()
+        wl.initialize(self._default_library)
+        refresher = MockFeedGenerator()
+        args = (self._db, wl, facets, pagination, refresher)
+
+        cache = CachedFeed.enable_memory_cache(max_size=2)
+        try:
+            # A cache miss is generated as usual, and the result goes
+            # into both the database and the memory cache.
+            r = CachedFeed.fetch(*args, max_age=600)
+            eq_("This is feed #1", r.data)
+            eq_(1, len(cache))
+            eq_(0, cache.hits)
+
+            # The next request is served from memory. Only the
+            # feed's timestamp is looked up in the database, to make
+            # sure the copy in memory is still current.
+            [cf] = self._db.query(CachedFeed).all()
+            key = cf.memory_cache_key
+            self._db.expunge_all()
+            with QueryCounter(self.connection) as counter:
+                r = CachedFeed.fetch(*args, max_age=600)
+            eq_("This is feed #1", r.data)
+            eq_(600, r.max_age)
+            eq_(1, cache.hits)
+            eq_(1, len(refresher.calls))
+            eq_(1, len([
+                x for x in counter.statements
+                if x.startswith('SELECT cachedfeeds.timestamp AS')
+            ]))
+            assert not any(
+                'cachedfeeds.content AS' in x for x in counter.statements
+            )
+
+            # If another process deletes the CachedFeed from the
+            # database, as it would when invalidating the feed, the
+            # copy in memory is discarded and the feed regenerated.
+            self._db.execute(CachedFeed.__table__.delete())
+            self._db.expunge_all()
+            r = CachedFeed.fetch(*args, max_age=600)
+            eq_("This is feed #2", r.data)
+            eq_(2, len(refresher.calls))
+
+            # The same happens if another process regenerates the
+            # feed.
+            self._db.execute(CachedFeed.__table__.update().values(
+                content=u"Another process's feed",
+                timestamp=datetime.datetime.utcnow()
+            ))
+            self._db.expunge_all()
+            r = CachedFeed.fetch(*args, max_age=600)
+            eq_("Another process's feed", r.data)
+            eq_("Another process's feed", cache.get(key).content)
+
+            # The in-memory copy respects max_age like the database copy
+            # does: if the cache age drops below the copy's age, the
+            # copy is discarded and the feed regenerated.
+            old = cache.get(key)
+            a_minute_ago = old.timestamp - datetime.timedelta(seconds=60)
+            cache.set(key, old._replace(timestamp=a_minute_ago))
+            self._db.execute(CachedFeed.__table__.update().values(
+                timestamp=a_minute_ago
+            ))
+            self._db.expunge_all()
+            r = CachedFeed.fetch(*args, max_age=30)
+            eq_("This is feed #3", r.data)
+            eq_(1, cache.expirations)
+            eq_("This is feed #3", cache.get(key).content)
+
+            # When the caller needs the CachedFeed itself, the memory
+            # cache is not consulted.
+            feed = CachedFeed.fetch(*args, max_age=600, raw=True)
+            assert isinstance(feed, CachedFeed)
+
+            # Updating a CachedFeed removes it from the memory cache.
+            feed.update(self._db, "New content")
+            eq_(None, cache.get(key))
+
+            # A feed that's not supposed to be cached doesn't go
+            # through the memory cache at all.
+            cache.clear()
+            CachedFeed.fetch(*args, max_age=CachedFeed.IGNORE_CACHE)
+            eq_(0, len(cache))
+        finally:
+            CachedFeed.disable_memory_cache()
+        eq_(None, CachedFeed.memory_cache)
+
+    def test_storage_format(self):
+        # Verify that the content of a feed can be stored gzipped,
+        # alongside or instead of the text.
+        facets = Facets.default(self._default_library)
+        pagination = Pagination.default()
+        wl = WorkList()
+        wl.initialize(self._default_library)
+        refresher = MockFeedGenerator()
+        args = (self._db, wl, facets, pagination, refresher)
+
+        class StorageMock(CachedFeed):
+            pass
+
+        # By default, only the text is stored.
+        eq_(StorageMock.STORE_TEXT, StorageMock.storage_format)
+        feed = StorageMock.fetch(*args, max_age=0, raw=True)
+        eq_("This is feed #1", feed.content)
+        eq_(None, feed.compressed_content)
+
+        # Storing both is the fastest option.
+        StorageMock.storage_format = StorageMock.STORE_TEXT_AND_GZIP
+        feed = StorageMock.fetch(*args, max_age=0, raw=True)
+        eq_("This is feed #2", feed.content)
+        eq_("This is feed #2", gzip_decompress(feed.compressed_content))
+
+        # Storing only the compressed version saves the most space.
+        StorageMock.storage_format = StorageMock.STORE_GZIP
+        feed.update(self._db, u"New content")
+        eq_(None, feed.content)
+        eq_(True, feed.has_content)
+        eq_(u"New content", feed.text_content)
+
+        # A CachedFeed with only compressed content counts as a cache
+        # hit.
+        app = Flask(__name__)
+        with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+            response = StorageMock.fetch(*args, max_age=600)
+        eq_(feed.compressed_content, response.data)
+        eq_("gzip", response.headers['Content-Encoding'])
+        eq_(2, len(refresher.calls))
+
+        # A client that doesn't accept gzip gets the decompressed
+        # version.
+        with app.test_request_context():
+            response = StorageMock.fetch(*args, max_age=600)
+        eq_(u"New content", response.data)
+        assert 'Content-Encoding' not in response.headers
+
+    def test_conditional_get(self):
+        # Verify that fetch() sends validators along with a cached
+        # feed, and honors them when a client sends them back.
+        facets = Facets.default(self._default_library)
+        pagination = Pagination.default()
+        wl = WorkList()
+        wl.initialize(self._default_library)
+        refresher = MockFeedGenerator()
+        args = (self._db, wl, facets, pagination, refresher)
+        app = Flask(__name__)
+
+        r = CachedFeed.fetch(*args, max_age=600)
+        eq_("This is feed #1", r.data)
+        feed = self._db.query(CachedFeed).one()
+        keys = CachedFeed._prepare_keys(self._db, wl, facets, pagination)
+        etag = CachedFeed.etag(keys, feed.timestamp)
+
+        # The ETag is a weak validator, since the feed might be
+        # sent gzipped or not.
+        eq_('W/"%s"' % etag, r.headers['ETag'])
+        eq_(http_date(feed.timestamp), r.headers['Last-Modified'])
+
+        # The ETag is different for a different version of the feed.
+        assert etag != CachedFeed.etag(
+            keys, feed.timestamp + datetime.timedelta(seconds=1)
+        )
+
+        # A client that has the current version gets a 304 response.
+        def fetch(**headers):
+            with app.test_request_context(headers=headers):
+                return CachedFeed.fetch(*args, max_age=600)
+
+        for headers in (
+            {"If-None-Match": '"%s"' % etag},
+            {"If-None-Match": 'W/"%s", "other"' % etag},
+            {"If-Modified-Since": http_date(feed.timestamp)},
+        ):
+            r = fetch(**headers)
+            eq_(304, r.status_code)
+            eq_("", r.data)
+            eq_('W/"%s"' % etag, r.headers['ETag'])
+            eq_(600, r.max_age)
+
+        # The 304 response was created without loading the content of
+        # the feed, so even if the content is cleared out, we get the
+        # same result. (Normally this would be a cache miss.)
+        feed.content = None
+        feed.compressed_content = b"not actually compressed"
+        self._db.commit()
+        eq_(304, fetch(**{"If-None-Match": '"%s"' % etag}).status_code)
+        eq_(1, len(refresher.calls))
+        feed.content = u"This is feed #1"
+        feed.compressed_content = None
+        self._db.commit()
+
+        # A client with an outdated version gets the whole feed.
+        yesterday = feed.timestamp - datetime.timedelta(days=1)
+        for headers in (
+            {"If-None-Match": '"some other etag"'},
+            {"If-Modified-Since": http_date(yesterday)},
+            # If-None-Match takes precedence over If-Modified-Since.
+            {"If-None-Match": '"some other etag"',
+             "If-Modified-Since": http_date(feed.timestamp)},
+        ):
+            r = fetch(**headers)
+            eq_(200, r.status_code)
+            eq_("This is feed #1", r.data)
+
+        # If the cached feed is stale, a conditional request gets a
+        # brand new feed, even if the client has the old version.
+        with app.test_request_context(headers={"If-None-Match": '"%s"' % etag}):
+            r = CachedFeed.fetch(*args, max_age=0)
+        eq_(200, r.status_code)
+        eq_("This is feed #2", r.data)
+
+        # A feed that's not cached has no validators.
+        r = CachedFeed.fetch(*args, max_age=CachedFeed.IGNORE_CACHE)
+        assert 'ETag' not in r.headers
+
+    def test_regeneration_policy(self):
+        # Verify that the regeneration policy controls what happens
+        # when a feed needs to be regenerated while another thread is
+        # already regenerating it.
+        facets = Facets.default(self._default_library)
+        pagination = Pagination.default()
+        wl = WorkList()
+        wl.initialize(self._default_library)
+        refresher = MockFeedGenerator()
+        args = (self._db, wl, facets, pagination, refresher)
+
+        class RegenerationMock(CachedFeed):
+            _regenerations = SingleFlight()
+
+        # Create a feed that's about to go stale.
+        feed = RegenerationMock.fetch(*args, max_age=600, raw=True)
+        eq_("This is feed #1", feed.content)
+        feed.timestamp -= datetime.timedelta(seconds=60)
+
+        # Start another thread working on the same feed. It won't
+        # finish until we say so.
+        key = RegenerationMock._memory_cache_key(
+            RegenerationMock._prepare_keys(self._db, wl, facets, pagination)
+        )
+        def start_other_thread():
+            started = threading.Event()
+            release = threading.Event()
+            def regenerate():
+                started.set()
+                release.wait()
+                return (
+                    u"Feed from another thread",
+                    datetime.datetime.utcnow(), None
+                )
+            thread = threading.Thread(
+                target=RegenerationMock._regenerations.run,
+                args=(key, regenerate)
+            )
+            thread.start()
+            started.wait()
+            return thread, release
+        other_thread, release = start_other_thread()
+
+        # By default, every thread regenerates the feed on its own.
+        eq_(RegenerationMock.REGENERATE_INDEPENDENTLY, RegenerationMock.regeneration_policy)
+        r = RegenerationMock.fetch(*args, max_age=30)
+        eq_("This is feed #2", r.data)
+        feed.timestamp -= datetime.timedelta(seconds=60)
+
+        # With SERVE_STALE, a thread that finds another thread
+        # working on the feed serves the stale version.
+        RegenerationMock.regeneration_policy = RegenerationMock.SERVE_STALE
+        r = RegenerationMock.fetch(*args, max_age=30)
+        eq_("This is feed #2", r.data)
+        eq_(2, len(refresher.calls))
+
+        # With WAIT_FOR_REGENERATION, it waits for the other thread
+        # and uses its result.
+        RegenerationMock.regeneration_policy = RegenerationMock.WAIT_FOR_REGENERATION
+        threading.Timer(0.1, release.set).start()
+        r = RegenerationMock.fetch(*args, max_age=30)
+        other_thread.join()
+        eq_("Feed from another thread", r.data)
+        eq_(2, len(refresher.calls))
+        eq_(1, RegenerationMock._regenerations.followers)
+
+        # Storing the new feed is up to the thread that generated it,
+        # so this thread didn't touch the database copy.
+        self._db.flush()
+        self._db.refresh(feed)
+        eq_("This is feed #2", feed.content)
+
+        # When no one else is working on the feed, this thread
+        # becomes the leader and generates it.
+        leaders = RegenerationMock._regenerations.leaders
+        r = RegenerationMock.fetch(*args, max_age=30)
+        eq_("This is feed #3", r.data)
+        eq_(leaders + 1, RegenerationMock._regenerations.leaders)
+        self._db.flush()
+        self._db.refresh(feed)
+        eq_("This is feed #3", feed.content)
+
+        # A request that ignores the cache never waits on anyone.
+        other_thread, release = start_other_thread()
+        try:
+            r = RegenerationMock.fetch(
+                *args, max_age=RegenerationMock.IGNORE_CACHE
+            )
+            eq_("This is feed #4", r.data)
+        finally:
+            release.set()
+            other_thread.join()
+
+    def test_advisory_lock(self):
+        # With use_advisory_lock, a process coordinates with other
+        # processes regenerating the same feed.
+        facets = Facets.default(self._default_library)
+        pagination = Pagination.default()
+        wl = WorkList()
+        wl.initialize(self._default_library)
+        refresher = MockFeedGenerator()
+        args = (self._db, wl, facets, pagination, refresher)
+
+        class LockMock(CachedFeed):
+            _regenerations = SingleFlight()
+            use_advisory_lock = True
+            regeneration_policy = CachedFeed.WAIT_FOR_REGENERATION
+            REGENERATION_TIMEOUT = 0.2
+            ADVISORY_LOCK_POLL_INTERVAL = 0.01
+
+        # Create the feed without taking the lock, which would
+        # otherwise be held until the end of the test.
+        LockMock.use_advisory_lock = False
+        feed = LockMock.fetch(*args, max_age=600, raw=True)
+        feed.timestamp -= datetime.timedelta(seconds=60)
+        LockMock.use_advisory_lock = True
+        key = LockMock._memory_cache_key(
+            LockMock._prepare_keys(self._db, wl, facets, pagination)
+        )
+
+        # Another process takes the lock on this feed.
+        other_process = self.engine.connect()
+        def take_lock():
+            transaction = other_process.begin()
+            other_process.execute(
+                "SELECT pg_advisory_xact_lock(%s)",
+                LockMock.advisory_lock_id(key)
+            )
+            return transaction
+
+        try:
+            # If the other process never finishes, we only wait for it
+            # so long before generating the feed ourselves.
+            other = take_lock()
+            start = time.time()
+            r = LockMock.fetch(*args, max_age=30)
+            assert time.time() - start >= LockMock.REGENERATION_TIMEOUT
+            eq_("This is feed #2", r.data)
+            self._db.flush()
+            self._db.refresh(feed)
+            eq_("This is feed #2", feed.content)
+
+            # If we're allowed to serve the stale feed, we don't wait.
+            feed.timestamp -= datetime.timedelta(seconds=60)
+            LockMock.regeneration_policy = LockMock.SERVE_STALE
+            eq_("This is feed #2", LockMock.fetch(*args, max_age=30).data)
+            eq_(2, len(refresher.calls))
+            LockMock.regeneration_policy = LockMock.WAIT_FOR_REGENERATION
+
+            # If the other process finishes while we wait, we use the
+            # feed it stored, without regenerating or storing it again.
+            def other_process_finishes(seconds):
+                feed.content = u"Feed from another process"
+                feed.timestamp = datetime.datetime.utcnow()
+                self._db.flush()
+                other.commit()
+            with patch.object(time, 'sleep', other_process_finishes):
+                with QueryCounter(self.connection) as counter:
+                    r = LockMock.fetch(*args, max_age=30)
+            eq_("Feed from another process", r.data)
+            eq_(2, len(refresher.calls))
+            writes = [x for x in counter.statements
+                      if x.startswith(("INSERT", "UPDATE"))]
+            # The only write was the other process's.
+            eq_(1, len(writes))
+        finally:
+            other_process.close()
+
+    def test_stream(self):
+        # A feed can be streamed to the client as it's generated, and
+        # cached once it's done.
+        facets = Facets.default(self._default_library)
+        pagination = Pagination.default()
+        wl = WorkList()
+        wl.initialize(self._default_library)
+
+        def refresher():
+            yield u"A "
+            yield u"streamed feed"
+
+        class StreamMock(CachedFeed):
+            pass
+        args = (self._db, wl, facets, pagination, refresher)
+
+        r = StreamMock.fetch(*args, max_age=30, stream=True)
+        assert r.is_streamed
+        eq_([], self._db.query(CachedFeed).all())
+        eq_("A streamed feed", r.data)
+        [feed] = self._db.query(CachedFeed).all()
+        eq_(u"A streamed feed", feed.content)
+
+        # Once the feed is cached, there's nothing to stream.
+        r = StreamMock.fetch(*args, max_age=30, stream=True)
+        eq_(False, r.is_streamed)
+        eq_("A streamed feed", r.data)
+
+        # A refresher that doesn't know how to stream is fine.
+        r = StreamMock.fetch(
+            self._db, wl, facets, pagination, lambda: u"Not streamed",
+            max_age=StreamMock.IGNORE_CACHE, stream=True
+        )
+        eq_("Not streamed", r.data)
+
+        # A feed that ignores the cache isn't stored.
+        eq_(u"A streamed feed", feed.content)
+
+        # If regenerations are coordinated, the whole feed has to be
+        # generated before it can be shared with other threads, so
+        # the feed isn't streamed.
+        StreamMock.regeneration_policy = StreamMock.WAIT_FOR_REGENERATION
+        r = StreamMock.fetch(*args, max_age=0, stream=True)
+        eq_(False, r.is_streamed)
+        eq_("A streamed feed", r.data)
+
+    def test_advisory_lock_id(self):
+        m = CachedFeed.advisory_lock_id
+        key = (u"groups", 1, None, 2, None, u"facets", u"")
+
+        # The ID is a signed 64-bit integer derived from the key.
+        lock_id = m(key)
+        assert -2**63 <= lock_id < 2**63
+        eq_(lock_id, m(key))
+        assert lock_id != m(key[:-1] + (u"after=10",))
+
+    def test_hits_and_expiration(self):
+        facets = Facets.default(self._default_library)
+        pagination = Pagination.default()
+        wl = WorkList()
+        wl.initialize(self._default_library)
+        refresher = MockFeedGenerator()
+        args = (self._db, wl, facets, pagination, refresher)
+
+        class HitMock(CachedFeed):
+            _hit_counts = defaultdict(int)
+            _hits_flushed_at = None
+
+        # A stored feed knows when it will expire.
+        feed = HitMock.fetch(*args, max_age=600, raw=True)
+        eq_(datetime.timedelta(seconds=600), feed.expires - feed.timestamp)
+        eq_(0, feed.hits)
+
+        # This is a paginated feed, which will never be regenerated
+        # ahead of time, so requests for it aren't counted.
+        eq_(CachedFeed.PAGE_TYPE, feed.type)
+        HitMock.fetch(*args, max_age=600)
+        eq_({}, HitMock._hit_counts)
+
+        # Requests for the kinds of feeds that are regenerated ahead of
+        # time are counted in memory.
+        HitMock.HIT_COUNTED_TYPES = [CachedFeed.PAGE_TYPE]
+        HitMock.fetch(*args, max_age=600)
+        HitMock.fetch(*args, max_age=600)
+        eq_(2, sum(HitMock._hit_counts.values()))
+
+        # ...and written to the database every once in a while.
+        HitMock._hits_flushed_at -= HitMock.HIT_FLUSH_INTERVAL
+        HitMock.fetch(*args, max_age=600)
+        eq_({}, HitMock._hit_counts)
+        self._db.refresh(feed)
+        eq_(3, feed.hits)
+
+        # Forcing a feed to be regenerated isn't a request for the
+        # feed, and the new feed lasts as long as it normally would.
+        wl.MAX_CACHE_AGE = 300
+        feed = HitMock.fetch(*args, max_age=0, raw=True)
+        eq_({}, HitMock._hit_counts)
+        eq_(datetime.timedelta(seconds=300), feed.expires - feed.timestamp)
+
+        # A feed that's cached forever never expires.
+        feed = HitMock.fetch(
+            self._db, wl, facets, Pagination(offset=50), refresher,
+            max_age=HitMock.CACHE_FOREVER, raw=True
+        )
+        eq_(None, feed.expires)
+
+    def test_flush_hits(self):
+        class HitMock(CachedFeed):
+            _hit_counts = defaultdict(int)
+            _hits_flushed_at = None
+
+        # Two feeds whose keys have NULLs in different places.
+        groups, ignore = get_one_or_create(
+            self._db, CachedFeed, type=CachedFeed.GROUPS_TYPE,
+            library=self._default_library, lane_id=None, facets=u"",
+            pagination=u""
+        )
+        lane = self._lane()
+        lane_groups, ignore = get_one_or_create(
+            self._db, CachedFeed, type=CachedFeed.GROUPS_TYPE,
+            library=self._default_library, lane_id=lane.id, facets=None,
+            pagination=u""
+        )
+        for feed in (groups, lane_groups):
+            feed.hits = 1
+        self._db.flush()
+
+        def key(feed):
+            return (feed.type, feed.library_id, feed.work_id, feed.lane_id,
+                    feed.unique_key, feed.facets, feed.pagination)
+        HitMock._hit_counts[key(groups)] = 2
+        HitMock._hit_counts[key(lane_groups)] = 5
+        # A feed that hasn't been stored yet isn't counted.
+        HitMock._hit_counts[key(groups)[:-1] + (u"after=10",)] = 1
+
+        # All the counts are written with a single statement.
+        with QueryCounter(self.connection) as counter:
+            eq_(3, HitMock.flush_hits(self._db))
+        eq_(1, counter.count)
+        eq_({}, HitMock._hit_counts)
+
+        for feed in (groups, lane_groups):
+            self._db.refresh(feed)
+        eq_(3, groups.hits)
+        eq_(6, lane_groups.hits)
+
+        # If there's nothing to write, the database isn't touched.
+        with QueryCounter(self.connection) as counter:
+            eq_(0, HitMock.flush_hits(self._db))
+        eq_(0, counter.count)
+
+    def work_ids(self, feed):
+        """Which works does the database say are in `feed`?"""
+        table = cachedfeeds_works
+        rows = self._db.execute(
+            select([table.c.work_id]).where(table.c.cachedfeed_id==feed.id)
+        )
+        return set(row[0] for row in rows)
+
+    def test_invalidate(self):
+        # A CachedFeed knows which works are in it, so it can be
+        # invalidated when one of them changes.
+        w1 = self._work()
+        w2 = self._work()
+        w3 = self._work()
+        facets = Facets.default(self._default_library)
+        pagination = Pagination.default()
+        wl = WorkList()
+        wl.initialize(self._default_library)
+
+        def refresher():
+            return AcquisitionFeed(
+                self._db, "title", "url", [w1, w2], Annotator
+            )
+
+        cache = CachedFeed.enable_memory_cache()
+        try:
+            feed = CachedFeed.fetch(
+                self._db, wl, facets, pagination, refresher, max_age=600,
+                raw=True
+            )
+            eq_(set([w1.id, w2.id]), self.work_ids(feed))
+            eq_(1, len(cache))
+
+            # A streamed feed keeps track of its works too.
+            def streamer():
+                return AcquisitionFeed(
+                    self._db, "title", "url", [], Annotator
+                ).stream_works([w3])
+            r = CachedFeed.fetch(
+                self._db, wl, facets, Pagination(offset=50), streamer,
+                max_age=600, stream=True
+            )
+            assert r.is_streamed
+            r.data
+            [streamed] = [
+                x for x in self._db.query(CachedFeed) if x is not feed
+            ]
+            eq_(set([w3.id]), self.work_ids(streamed))
+            eq_(2, len(cache))
+
+            # Recording the works in a feed replaces whatever was there
+            # before. A work that no longer exists is ignored.
+            streamed.set_work_ids(self._db, [w2.id, w3.id, -1])
+            eq_(set([w2.id, w3.id]), self.work_ids(streamed))
+            streamed.set_work_ids(self._db, [w3.id])
+            eq_(set([w3.id]), self.work_ids(streamed))
+
+            # Invalidating a work deletes every feed that contains
+            # it, and removes it from the memory cache.
+            eq_(0, CachedFeed.invalidate(self._db, []))
+            eq_(1, CachedFeed.invalidate(self._db, [w2.id]))
+            eq_([streamed], self._db.query(CachedFeed).all())
+            eq_([streamed.memory_cache_key], cache.keys())
+
+            # Changes to a work are noted as they happen, and the
+            # affected feeds are invalidated when the changes are
+            # written to the database.
+            CachedFeed.work_changed(w3)
+            eq_(set([w3.id]), self._db.info[CachedFeed.CHANGED_WORKS])
+            w3.fiction = not w3.fiction
+            self._db.flush()
+            eq_([], self._db.query(CachedFeed).all())
+            assert CachedFeed.CHANGED_WORKS not in self._db.info
+            eq_(0, len(cache))
+        finally:
+            CachedFeed.disable_memory_cache()
+
 
     # Tests of helper methods.
 
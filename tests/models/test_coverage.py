@@ -555,3 +555,30 @@ class TestWorkCoverageRecord(DatabaseTest):
         # a different operation.
         eq_(WorkCoverageRecord.SUCCESS, irrelevant_record.status)
         assert irrelevant_record.timestamp < new_timestamp
+
+    def test_bulk_add_ids(self):
+        # Works that haven't been loaded can be given coverage records
+        # by ID.
+        operation = "relevant"
+        new_work = self._work()
+        already_covered = self._work()
+        WorkCoverageRecord.add_for(already_covered, operation)
+        self._db.commit()
+
+        WorkCoverageRecord.bulk_add_ids(
+            self._db, [new_work.id, already_covered.id], operation,
+            status=WorkCoverageRecord.TRANSIENT_FAILURE,
+            exception="Some exception"
+        )
+        self._db.commit()
+
+        # Both works now have an identical record, including the
+        # exception.
+        for work in (new_work, already_covered):
+            [record] = [x for x in work.coverage_records
+                        if x.operation == operation]
+            eq_(WorkCoverageRecord.TRANSIENT_FAILURE, record.status)
+            eq_("Some exception", record.exception)
+
+        # Passing in no IDs does nothing.
+        eq_(None, WorkCoverageRecord.bulk_add_ids(self._db, [], operation))
@@ -16,6 +16,7 @@ from ...model import (
     ConfigurationSetting,
     create,
     site_configuration_has_changed,
+    site_configuration_is_settled,
     Timestamp,
     WorkCoverageRecord,
 )
@@ -134,6 +135,22 @@ class TestSiteConfigurationHasChanged(DatabaseTest):
         eq_(newer_update,
             Configuration.site_configuration_last_update(self._db))
 
+    def test_site_configuration_is_settled(self):
+        # The site configuration is settled once enough time has
+        # passed since the last change that a change made since then
+        # couldn't have been ignored by the cooldown.
+        now = datetime.datetime.utcnow()
+        eq_(False, site_configuration_is_settled(now))
+        eq_(True, site_configuration_is_settled(
+            now - datetime.timedelta(seconds=6)
+        ))
+        eq_(False, site_configuration_is_settled(
+            now - datetime.timedelta(seconds=6), settling_time=10
+        ))
+
+        # If the site configuration has never changed, it's settled.
+        eq_(True, site_configuration_is_settled(None))
+
     # We don't test every event listener, but we do test one of each type.
     def test_configuration_relevant_lifecycle_event_updates_configuration(self):
         """When you create or modify a relevant item such as a
@@ -218,3 +235,38 @@ class TestListeners(DatabaseTest):
         eq_(work.id, work.coverage_records[0].work_id)
         eq_(WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION, work.coverage_records[0].operation)
         eq_(WorkCoverageRecord.REGISTERED, work.coverage_records[0].status)
+
+    def test_work_change_invalidates_cached_feeds(self):
+        work = self._work(with_license_pool=True)
+        other_work = self._work()
+        feed = CachedFeed(
+            type=u"page", pagination=u"", library=self._default_library
+        )
+        self._db.add(feed)
+        feed.set_work_ids(self._db, [work.id])
+        other_feed = CachedFeed(
+            type=u"page", pagination=u"", library=self._default_library
+        )
+        self._db.add(other_feed)
+        other_feed.set_work_ids(self._db, [other_work.id])
+
+        # When a work's availability or presentation changes, the
+        # feeds that contain it are deleted the next time the
+        # session is flushed. Other feeds are left alone.
+        work.last_update_time = datetime.datetime.utcnow()
+        self._db.flush()
+        eq_([other_feed], self._db.query(CachedFeed).all())
+
+        [pool] = work.license_pools
+        feed = CachedFeed(
+            type=u"page", pagination=u"", library=self._default_library
+        )
+        self._db.add(feed)
+        feed.set_work_ids(self._db, [work.id])
+        pool.open_access = not pool.open_access
+        self._db.flush()
+        eq_([other_feed], self._db.query(CachedFeed).all())
+
+        other_work.license_pools.append(pool)
+        self._db.flush()
+        eq_([], self._db.query(CachedFeed).all())
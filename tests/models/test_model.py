@@ -18,8 +18,10 @@ from ...model import (
     Edition,
     Genre,
     get_one,
+    preload,
     SessionManager,
     Timestamp,
+    Work,
     numericrange_to_tuple,
     tuple_to_numericrange,
 )
@@ -71,6 +73,61 @@ class TestDatabaseInterface(DatabaseTest):
         SessionManager.initialize_data(self._db)
         eq_(old_timestamp, timestamp.finish)
 
+    def test_preload(self):
+        for i in range(3):
+            work = self._work(
+                authors=["Author %d" % i], with_open_access_download=True
+            )
+        self._db.flush()
+
+        def fresh_works():
+            # Forget everything that was loaded while the works
+            # were being created.
+            self._db.expunge_all()
+            return self._db.query(Work).all()
+
+        def look_at_everything(works):
+            for work in works:
+                for pool in work.license_pools:
+                    for lpdm in pool.delivery_mechanisms:
+                        lpdm.delivery_mechanism.content_type
+                for contribution in work.presentation_edition.contributions:
+                    contribution.contributor.sort_name
+
+        paths = [
+            ('license_pools', 'delivery_mechanisms', 'delivery_mechanism'),
+            ('presentation_edition', 'contributions', 'contributor'),
+        ]
+
+        # There are six relationships along those paths, and each
+        # relationship takes at most two queries to load, no matter
+        # how many works there are.
+        works = fresh_works()
+        with self.query_budget(12):
+            preload(self._db, works, *paths)
+
+        # Now everything's in place.
+        with self.query_budget(0):
+            look_at_everything(works)
+
+        # Without preloading, looking at everything takes a few
+        # queries per work.
+        works = fresh_works()
+        def over_budget():
+            with self.query_budget(12):
+                look_at_everything(works)
+        assert_raises(AssertionError, over_budget)
+
+        # Relationships that are already loaded aren't loaded again.
+        works = fresh_works()
+        look_at_everything(works)
+        with self.query_budget(0):
+            preload(self._db, works, *paths)
+
+        # There's nothing to do for an empty list.
+        with self.query_budget(0):
+            preload(self._db, [], *paths)
+
 
 class TestNumericRangeConversion(object):
     """Test the helper functions that convert between tuples and NumericRange
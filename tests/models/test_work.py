@@ -10,6 +10,7 @@ from mock import MagicMock
 import os
 from psycopg2.extras import NumericRange
 import random
+from sqlalchemy import select
 from .. import DatabaseTest
 from ...classifier import (
     Classifier,
@@ -1235,6 +1236,49 @@ class TestWork(DatabaseTest):
         eq_(set([collection1.id, collection2.id]),
             set([x['collection_id'] for x in search_doc['licensepools']]))
 
+    def test_stream_search_documents(self):
+        works = [self._work() for i in range(5)]
+        ids = sorted(work.id for work in works)
+        self._db.commit()
+
+        def streamed(**kwargs):
+            chunks = list(Work.stream_search_documents(self._db, **kwargs))
+            return (
+                [len(chunk) for chunk in chunks],
+                sorted(doc['_id'] for chunk in chunks for doc in chunk)
+            )
+
+        # The documents come out in chunks of the requested size.
+        eq_(([2, 2, 1], ids), streamed(chunk_size=2))
+
+        # They're the same documents to_search_documents would create.
+        [expect] = Work.to_search_documents([works[0]])
+        [[doc]] = Work.stream_search_documents(
+            self._db, work_ids=[works[0].id]
+        )
+        eq_(expect, doc)
+
+        # Works can be chosen by a range of IDs...
+        eq_(([3], ids[1:4]), streamed(min_id=ids[1], max_id=ids[3]))
+
+        # ...or by a query that finds their IDs.
+        qu = select([Work.id]).where(Work.id.in_(ids[:2]))
+        eq_(([2], ids[:2]), streamed(work_ids=qu))
+
+    def test_to_search_documents_with_fields(self):
+        work = self._work(with_license_pool=True)
+        [full] = Work.to_search_documents([work])
+        [partial] = Work.to_search_documents(
+            [work], fields=Work.LICENSEPOOLS_SEARCH_FIELDS
+        )
+
+        # Only the requested fields are present, and they're the same
+        # as in the full document.
+        eq_(set(['_id', 'licensepools', 'last_update_time']),
+            set(partial.keys()))
+        for key, value in partial.items():
+            eq_(full[key], value)
+
     def test_age_appropriate_for_patron(self):
         work = self._work()
         work.audience = Classifier.AUDIENCE_YOUNG_ADULT
@@ -1389,9 +1433,8 @@ class TestWork(DatabaseTest):
             """
             records = [
                 x for x in work.coverage_records
-                if x.operation.startswith(
-                        WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
-                )
+                if x.operation ==
+                WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
             ]
             if records:
                 return records[0]
@@ -1424,13 +1467,21 @@ class TestWork(DatabaseTest):
         record = find_record(work)
         eq_(registered, record.status)
 
-        # If its last_update_time is changed, it needs to be
+        # If its last_update_time is changed, the parts of its search
+        # document that describe its LicensePools need to be
         # reindexed. (This happens whenever
         # LicensePool.update_availability is called, meaning that
-        # patron transactions always trigger a reindex).
+        # patron transactions always trigger a reindex). The rest of
+        # the document doesn't need to be reindexed.
         record.status = success
         work.last_update_time = datetime.datetime.utcnow()
-        eq_(registered, record.status)
+        eq_(success, record.status)
+        [licensepools_record] = [
+            x for x in work.coverage_records
+            if x.operation ==
+            WorkCoverageRecord.UPDATE_SEARCH_INDEX_LICENSEPOOLS_OPERATION
+        ]
+        eq_(registered, licensepools_record.status)
 
         # If its collection changes (which shouldn't happen), it needs
         # to be reindexed.
@@ -1491,7 +1542,9 @@ class TestWork(DatabaseTest):
             (work.needs_new_presentation_edition,
              WCR.CHOOSE_EDITION_OPERATION),
             (work.external_index_needs_updating,
-             WCR.UPDATE_SEARCH_INDEX_OPERATION)
+             WCR.UPDATE_SEARCH_INDEX_OPERATION),
+            (work.search_index_licensepools_need_updating,
+             WCR.UPDATE_SEARCH_INDEX_LICENSEPOOLS_OPERATION),
         ):
             method()
             eq_(operation, work.coverage_reset_for)
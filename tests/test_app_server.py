@@ -220,6 +220,26 @@ class TestURNLookupController(DatabaseTest):
                 assert identifier.urn in response_data
                 eq_(1, response_data.count(work.title))
 
+    def test_work_lookup_streamed(self):
+        work = self._work(with_license_pool=True)
+        identifier = work.license_pools[0].identifier
+        with self.app.test_request_context(
+            "/?urn=%s&urn=urn:unknown" % identifier.urn
+        ):
+            response = self.controller.work_lookup(
+                annotator=TestAnnotator(), stream=True
+            )
+        assert response.is_streamed
+        eq_(200, response.status_code)
+        eq_(OPDSFeed.ACQUISITION_FEED_TYPE, response.headers['Content-Type'])
+
+        # The feed includes an entry for the work and a message
+        # about the identifier that couldn't be looked up.
+        response_data = response.data.decode("utf8")
+        eq_(1, response_data.count(work.title))
+        assert "urn:unknown" in response_data
+        assert response_data.endswith("</feed>")
+
     def test_process_urns_problem_detail(self):
         # Verify the behavior of work_lookup in the case where
         # process_urns returns a problem detail.
@@ -589,3 +609,20 @@ class TestCompressibleAnnotator(object):
         response = ask_for_compression("gzip", "Accept-Transfer-Encoding")
         eq_(value, response.data)
         assert 'Content-Encoding' not in response.headers
+
+        # A streamed response is compressed as it's streamed.
+        @compressible
+        def streamer():
+            yield "Compress "
+            yield "me!"
+        with self.app.test_request_context(
+            headers={"Accept-Encoding": "gzip"}
+        ):
+            response = flask.Response(streamer())
+            self.app.process_response(response)
+        assert response.is_streamed
+        eq_("gzip", response.headers['Content-Encoding'])
+        assert 'Content-Length' not in response.headers
+        eq_("Compress me!", gzip.GzipFile(
+            mode='rb', fileobj=BytesIO(response.data)
+        ).read())
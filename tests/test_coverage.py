@@ -1,4 +1,5 @@
 import datetime
+import pickle
 from nose.tools import (
     assert_raises,
     assert_raises_regexp,
@@ -59,6 +60,7 @@ from ..coverage import (
     CollectionCoverageProvider,
     CoverageFailure,
     CoverageProviderProgress,
+    CoverageProviderShardJob,
     IdentifierCoverageProvider,
     OPDSEntryWorkCoverageProvider,
     MARCRecordWorkCoverageProvider,
@@ -674,6 +676,63 @@ class TestBaseCoverageProvider(CoverageProviderTest):
         record.status = CoverageRecord.REGISTERED
         eq_(True, provider.should_update(record))
 
+    def test_id_ranges(self):
+        provider = AlwaysSuccessfulCoverageProvider(self._db)
+
+        # When nothing needs coverage, there are no ranges.
+        eq_([], provider.id_ranges(2))
+
+        identifiers = [self._identifier() for i in range(5)]
+        [i1, i2, i3, i4, i5] = sorted(identifiers, key=lambda x: x.id)
+
+        # One of the identifiers is already covered, so it isn't
+        # counted when the ranges are balanced.
+        self._coverage_record(
+            i2, provider.data_source, status=CoverageRecord.SUCCESS
+        )
+
+        # The remaining four identifiers are split evenly. The ranges
+        # are contiguous, and open-ended on both ends.
+        eq_([(None, i4.id-1), (i4.id, None)], provider.id_ranges(2))
+
+        # There are never more ranges than items.
+        eq_([(None, i3.id-1), (i3.id, i4.id-1), (i4.id, i5.id-1),
+             (i5.id, None)],
+            provider.id_ranges(10))
+
+    def test_run_on_id_range(self):
+        provider = AlwaysSuccessfulCoverageProvider(self._db)
+        identifiers = [self._identifier() for i in range(4)]
+        [i1, i2, i3, i4] = sorted(identifiers, key=lambda x: x.id)
+
+        # One of the identifiers in the range previously had a
+        # transient failure.
+        self._coverage_record(
+            i3, provider.data_source,
+            status=CoverageRecord.TRANSIENT_FAILURE
+        )
+
+        progress = provider.run_on_id_range(i2.id, i3.id)
+
+        # Only the identifiers in the range were covered -- both
+        # the one with no coverage and the transient failure.
+        eq_(set([i2, i3]), set(provider.attempts))
+        eq_(2, progress.successes)
+        eq_(True, progress.is_complete)
+        for identifier in (i2, i3):
+            [record] = identifier.coverage_records
+            eq_(CoverageRecord.SUCCESS, record.status)
+        for identifier in (i1, i4):
+            eq_([], identifier.coverage_records)
+
+        # It's up to the caller to write the Timestamp.
+        eq_(None, provider.timestamp)
+
+        # A range can be open-ended.
+        progress = provider.run_on_id_range(None, i1.id)
+        eq_([i1], provider.attempts[2:])
+        eq_(1, progress.successes)
+
 
 class TestIdentifierCoverageProvider(CoverageProviderTest):
 
@@ -2162,6 +2221,51 @@ class TestWorkCoverageProvider(DatabaseTest):
         but not the method itself.
         """
 
+    def test_id_ranges(self):
+        # Works are split up by their own IDs.
+        provider = AlwaysSuccessfulWorkCoverageProvider(self._db)
+        eq_(Work.id, provider.item_id_column())
+        work2 = self._work()
+        [work1, work2] = sorted([self.work, work2], key=lambda x: x.id)
+        eq_([(None, work2.id-1), (work2.id, None)], provider.id_ranges(2))
+
+        provider.run_on_id_range(work2.id, None)
+        eq_([work2], provider.attempts)
+
+
+class TestCoverageProviderShardJob(DatabaseTest):
+
+    def test_run(self):
+        work = self._work()
+
+        # The job can be pickled, so it can be sent to another
+        # process.
+        job = CoverageProviderShardJob(
+            AlwaysSuccessfulWorkCoverageProvider, work.id, work.id
+        )
+        job = pickle.loads(pickle.dumps(job))
+
+        # Running the job covers the items in its range and returns
+        # counts of the outcomes.
+        eq_((1, 0, 0), job.run(self._db))
+        [record] = work.coverage_records
+        eq_(WorkCoverageRecord.SUCCESS, record.status)
+
+    def test_run_with_collection(self):
+        edition, pool = self._edition(
+            collection=self._default_collection, with_license_pool=True
+        )
+        identifier = edition.primary_identifier
+        job = CoverageProviderShardJob(
+            AlwaysSuccessfulCollectionCoverageProvider, None, None,
+            collection_id=self._default_collection.id
+        )
+
+        # A provider for the given Collection is created and run.
+        eq_((1, 0, 0), job.run(self._db))
+        record = CoverageRecord.lookup(identifier, DataSource.GUTENBERG)
+        eq_(CoverageRecord.SUCCESS, record.status)
+
 
 class TestPresentationReadyWorkCoverageProvider(DatabaseTest):
 
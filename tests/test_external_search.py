@@ -10,6 +10,8 @@ import datetime
 import json
 import logging
 import re
+from lxml import etree
+from mock import patch
 import time
 from psycopg2.extras import NumericRange
 
@@ -17,7 +19,11 @@ from . import (
     DatabaseTest,
 )
 
-from elasticsearch_dsl import Q
+from elasticsearch_dsl import (
+    Q,
+    Search,
+)
+from elasticsearch_dsl.utils import AttrDict
 from elasticsearch_dsl.function import (
     ScriptScore,
     RandomScore,
@@ -77,13 +83,21 @@ from ..external_search import (
     QueryParser,
     SearchBase,
     SearchIndexCoverageProvider,
+    SearchIndexLicensePoolsCoverageProvider,
+    SearchIndexPipeline,
     SortKeyPagination,
     WorkSearchResult,
+    WorkSearchView,
     mock_search_index,
 )
 
 from ..classifier import Classifier
 
+from ..opds import (
+    AcquisitionFeed,
+    Annotator,
+)
+
 from ..problem_details import INVALID_INPUT
 
 from ..testing import (
@@ -305,6 +319,208 @@ class TestExternalSearch(ExternalSearchTest):
         eq_(pagination.offset, default.offset)
         eq_(pagination.size, default.size)
 
+    def test_query_works_multi_result_cache(self):
+        # Recent search results can be cached and reused.
+        class Mock(ExternalSearchIndex):
+            def __init__(self):
+                self.works_alias = "works"
+                self.search = Search(index=self.works_alias)
+                self.executed = []
+
+            def _execute_searches(self, searches):
+                self.executed.append(searches)
+                return [
+                    ["result %d" % (i+len(self.executed))] * (i+1)
+                    for i, search in enumerate(searches)
+                ]
+
+        search = Mock()
+
+        def run(*queries):
+            queries = [
+                (query_string, None, Pagination(size=size))
+                for query_string, size in queries
+            ]
+            results = list(search.query_works_multi(queries))
+            return results, [x[2] for x in queries]
+
+        cache = ExternalSearchIndex.enable_result_cache(max_age=60)
+        try:
+            eq_(60, cache.max_age)
+            results, [p1, p2] = run(("dog", 10), ("cat", 10))
+            eq_([["result 1"], ["result 2", "result 2"]], results)
+            eq_(1, len(search.executed))
+            eq_(2, len(cache))
+            eq_(1, p1.this_page_size)
+            eq_(2, p2.this_page_size)
+
+            # Run the same searches again, plus a new one. Only the new
+            # search is sent to Elasticsearch.
+            results, [p1, p2, p3] = run(
+                ("cat", 10), ("dog", 10), ("dog", 20)
+            )
+            eq_([["result 2", "result 2"], ["result 1"], ["result 2"]],
+                results)
+            eq_(2, len(search.executed))
+            eq_(1, len(search.executed[-1]))
+            eq_(2, cache.hits)
+
+            # Each Pagination object is told about its own page, whether
+            # or not it came from the cache.
+            eq_([2, 1, 1],
+                [p.this_page_size for p in (p1, p2, p3)])
+            eq_(True, p1.page_has_loaded)
+        finally:
+            ExternalSearchIndex.disable_result_cache()
+        eq_(None, ExternalSearchIndex.result_cache)
+
+        # Without the cache, every search is sent to Elasticsearch.
+        run(("cat", 10), ("dog", 10))
+        eq_(3, len(search.executed))
+        eq_(2, len(search.executed[-1]))
+
+    def test_count_works_multi(self):
+        # count_works_multi counts the works matching several Filters
+        # with 'filters' aggregations, sent as a single MultiSearch.
+        class Mock(ExternalSearchIndex):
+            COUNT_BATCH_SIZE = 2
+
+            def __init__(self):
+                self.search = Search(index="works")
+                self.executed = []
+
+            def _execute_searches(self, searches):
+                self.executed.append(searches)
+                responses = []
+                for search in searches:
+                    aggs = search.to_dict()['aggs']['counts']['filters']
+                    buckets = dict(
+                        (key, dict(doc_count=int(key) * 10))
+                        for key in aggs['filters']
+                    )
+                    responses.append(AttrDict(
+                        dict(aggregations=dict(counts=dict(buckets=buckets)))
+                    ))
+                return responses
+
+        index = Mock()
+        filters = [
+            Filter(fiction=True), Filter(match_nothing=True),
+            Filter(languages=["eng"]), None,
+        ]
+        eq_([0, 0, 20, 30], index.count_works_multi(filters))
+
+        # The three Filters that might match something were split into
+        # two aggregations, which were sent in one request.
+        [searches] = index.executed
+        eq_(2, len(searches))
+        first = searches[0].to_dict()
+        eq_(0, first['size'])
+        buckets = first['aggs']['counts']['filters']['filters']
+        eq_(set(['0', '2']), set(buckets.keys()))
+
+        # Each bucket uses the same query count_works would use.
+        expect = index.create_search_doc(None, filters[2], None, False)
+        eq_(expect.to_dict()['query'], buckets['2'])
+
+        # If no Filter can match anything, no request is sent.
+        eq_([0], index.count_works_multi([Filter(match_nothing=True)]))
+        eq_([], index.count_works_multi([]))
+        eq_(1, len(index.executed))
+
+    def test_query_works_with_facet_counts(self):
+        # query_works_with_facet_counts gets a page of search results
+        # and counts the works under several other Filters, in a
+        # single request.
+        class Response(list):
+            pass
+
+        class Mock(ExternalSearchIndex):
+            works_alias = "works"
+
+            def __init__(self):
+                self.search = Search(index="works")
+                self.executed = []
+
+            def _execute_searches(self, searches):
+                self.executed.append(searches)
+                [search] = searches
+                aggs = search.to_dict()['aggs']['facet_counts']
+                buckets = dict(
+                    (key, dict(doc_count=int(key) * 10 + 1))
+                    for key in aggs['aggs']['counts']['filters']['filters']
+                )
+                response = Response(["hit1", "hit2"])
+                response.aggregations = AttrDict(
+                    dict(facet_counts=dict(counts=dict(buckets=buckets)))
+                )
+                return [response]
+
+        index = Mock()
+        filter = Filter(fiction=True)
+        pagination = Pagination(size=2)
+        facet_filters = [
+            Filter(languages=["eng"]), Filter(match_nothing=True),
+            Filter(fiction=False),
+        ]
+        results, counts = index.query_works_with_facet_counts(
+            "query", filter, pagination, facet_filters
+        )
+        eq_(["hit1", "hit2"], results)
+        eq_([1, 0, 21], counts)
+        eq_(True, pagination.page_has_loaded)
+
+        # One search was sent, for the page of results, with a
+        # 'global' aggregation whose buckets are the facet Filters.
+        [[search]] = index.executed
+        search = search.to_dict()
+        expect = index._create_search("query", filter, pagination, False)
+        eq_(expect.to_dict()['query'], search['query'])
+        eq_(2, search['size'])
+        aggs = search['aggs']['facet_counts']
+        eq_({}, aggs['global'])
+        buckets = aggs['aggs']['counts']['filters']['filters']
+        eq_(set(['0', '2']), set(buckets.keys()))
+
+        # Each bucket uses the search query as well as the Filter.
+        expect = index.create_search_doc("query", facet_filters[2], None, False)
+        eq_(expect.to_dict()['query'], buckets['2'])
+
+        # If the main Filter matches nothing, there's no page of
+        # results, but the facets are counted anyway.
+        index.count_works_multi = lambda filters, query_string: [
+            query_string, len(filters)
+        ]
+        eq_(([], ["query", 3]), index.query_works_with_facet_counts(
+            "query", Filter(match_nothing=True), pagination, facet_filters
+        ))
+        eq_(1, len(index.executed))
+
+    def test_create_search_doc_fields(self):
+        # create_search_doc restricts the fields retrieved from each
+        # search document to the ones the caller will use.
+        class Mock(ExternalSearchIndex):
+            def __init__(self):
+                self.search = Search(index="works")
+
+        index = Mock()
+        def fields(filter, debug=False):
+            search = index.create_search_doc(
+                None, filter, Pagination.default(), debug
+            )
+            return search.to_dict()['_source']
+
+        eq_(["work_id"], fields(None))
+        filter = Filter(script_fields=dict(last_update=object()))
+        eq_(["work_id", "last_update"], fields(filter))
+
+        # The Filter can ask for more fields from the search document.
+        filter.source_fields = ["title", "author"]
+        eq_(["work_id", "last_update", "title", "author"], fields(filter))
+
+        # In debug mode, everything is retrieved.
+        eq_(["*"], fields(filter, debug=True))
+
     def test__run_self_tests(self):
         index = MockExternalSearchIndex()
 
@@ -2594,6 +2810,62 @@ class TestQuery(DatabaseTest):
             ]
         )
 
+    def test_query_cache(self):
+        # The output of elasticsearch_query can be cached and reused
+        # for repeated query strings.
+        class Mock(Query):
+            built = 0
+            def _elasticsearch_query(self):
+                Mock.built += 1
+                return Query._elasticsearch_query(self)
+
+        eq_(None, Query.query_cache)
+        uncached = Mock("asteroids nonfiction").elasticsearch_query
+        eq_(1, Mock.built)
+
+        # Whitespace in the query string is normalized, so query
+        # strings that differ only in whitespace build identical
+        # queries.
+        spaced = Mock("  asteroids \t nonfiction ")
+        eq_("asteroids nonfiction", spaced.query_string)
+        eq_(uncached.to_dict(), spaced.elasticsearch_query.to_dict())
+        eq_(2, Mock.built)
+
+        cache = Query.enable_query_cache()
+        try:
+            query = Mock("asteroids nonfiction", Filter(fiction=True))
+            eq_((Mock, "asteroids nonfiction", True), query.query_cache_key)
+            first = query.elasticsearch_query
+            eq_(3, Mock.built)
+            eq_(uncached.to_dict(), first.to_dict())
+
+            # The next Query for the same string reuses the cached
+            # query, even if it has a different Filter and its query
+            # string has different whitespace.
+            second = Mock(" asteroids  nonfiction ", Filter())
+            assert second.elasticsearch_query is first
+            eq_(3, Mock.built)
+            eq_(1, cache.hits)
+
+            # Building the first query also built (and cached) a
+            # subquery for the part of the string that wasn't turned
+            # into a filter.
+            eq_(2, cache.misses)
+            eq_(1/3.0, cache.stats['hit_rate'])
+
+            # The query cache doesn't need to run the spell check.
+            eq_(None, second._fuzzy_coefficient)
+
+            # Queries built without the query parser are cached
+            # separately.
+            Mock("asteroids nonfiction", use_query_parser=False
+            ).elasticsearch_query
+            eq_(4, Mock.built)
+            eq_(3, len(cache))
+        finally:
+            Query.disable_query_cache()
+        eq_(None, Query.query_cache)
+
     def test_match_one_field_hypotheses(self):
         # Test our ability to generate hypotheses that a search string
         # is trying to match a single field of data.
@@ -3434,6 +3706,152 @@ class TestFilter(DatabaseTest):
         filter = Filter.from_worklist(self._db, for_other_library, None)
         eq_(True, filter.allow_holds)
 
+        # If the WorkList wants to turn search results directly into
+        # WorkSearchViews, the Filter asks for the fields they use.
+        eq_([], filter.source_fields)
+        for_other_library.HYDRATE_FROM_SEARCH_INDEX = True
+        filter = Filter.from_worklist(self._db, for_other_library, None)
+        eq_(WorkSearchView.SOURCE_FIELDS, filter.source_fields)
+
+    def test_from_worklist_cache(self):
+        # Filters created for Lanes can be cached and reused.
+        lane = self._lane()
+        lane.languages = ["eng"]
+        self._db.flush()
+        facets = FeaturedFacets(0.5, random_seed=1)
+        fresh_filter = Filter.from_worklist(self._db, lane, facets)
+        fresh_built = fresh_filter.build()
+
+        last_update = Configuration.SITE_CONFIGURATION_LAST_UPDATE
+        old_stamp = Configuration.instance.get(last_update)
+        Configuration.instance[last_update] = datetime.datetime(2019, 1, 1)
+        cache = Filter.enable_worklist_cache(max_size=2)
+        try:
+            eq_((lane.id, facets.filter_cache_key),
+                Filter.worklist_cache_key(lane, facets))
+
+            # A cache miss creates a Filter as usual and builds it.
+            filter1 = Filter.from_worklist(self._db, lane, facets)
+            eq_(1, len(cache))
+            eq_(0, cache.hits)
+
+            # The next time, a copy of the cached Filter is returned,
+            # and it builds the same Elasticsearch filter as a Filter
+            # created from scratch.
+            filter2 = Filter.from_worklist(
+                self._db, lane, FeaturedFacets(0.5, random_seed=1)
+            )
+            eq_(1, cache.hits)
+            assert filter2 is not filter1
+            eq_(["eng"], filter2.languages)
+            main, nested = filter2.build()
+            eq_(fresh_built[0].to_dict(), main.to_dict())
+            eq_(fresh_built[1], nested)
+            eq_(fresh_filter.scoring_functions, filter2.scoring_functions)
+
+            # Modifying the copy doesn't affect the cache, and the
+            # modified copy builds a new Elasticsearch filter.
+            filter2.languages.append("spa")
+            filter2.fiction = True
+            nested["some.path"].append("extra filter")
+            modified = filter2.build()[0].to_dict()
+            assert modified != main.to_dict()
+            assert 'fiction' in json.dumps(modified)
+            filter3 = Filter.from_worklist(self._db, lane, facets)
+            eq_(["eng"], filter3.languages)
+            eq_(None, filter3.fiction)
+            eq_(fresh_built[1], filter3.build()[1])
+
+            # Different facets get a different cache entry.
+            Filter.from_worklist(
+                self._db, lane, FeaturedFacets(0.5, random_seed=2)
+            )
+            eq_(2, len(cache))
+
+            # A change to the site configuration (which is what
+            # happens when a Lane is changed) invalidates the cache.
+            Configuration.instance[last_update] = datetime.datetime(
+                2020, 1, 1
+            )
+            lane.languages = ["fre"]
+            filter4 = Filter.from_worklist(self._db, lane, facets)
+            eq_(["fre"], filter4.languages)
+            eq_(1, cache.expirations)
+
+            # Filters for search requests, and for WorkLists that
+            # aren't Lanes, aren't cached.
+            cache.clear()
+            eq_(None, Filter.worklist_cache_key(lane, SearchFacets()))
+            wl = WorkList()
+            wl.initialize(self._default_library)
+            eq_(None, Filter.worklist_cache_key(wl, facets))
+            Filter.from_worklist(self._db, lane, SearchFacets())
+            Filter.from_worklist(self._db, wl, facets)
+            eq_(0, len(cache))
+
+            # Nor are Filters for Lanes that take every CustomList
+            # from a DataSource, since a new list from that source
+            # doesn't change the site configuration.
+            best_sellers = self._lane()
+            best_sellers.list_datasource = DataSource.lookup(
+                self._db, DataSource.NYT
+            )
+            child = self._lane(parent=best_sellers)
+            self._db.flush()
+            eq_(None, Filter.worklist_cache_key(best_sellers, facets))
+            eq_(None, Filter.worklist_cache_key(child, facets))
+
+            # Right after a change to the site configuration, Filters
+            # aren't cached, because another change might not update
+            # the timestamp.
+            Configuration.instance[last_update] = datetime.datetime.utcnow()
+            Filter.from_worklist(self._db, lane, facets)
+            eq_(0, len(cache))
+        finally:
+            Filter.disable_worklist_cache()
+            Configuration.instance[last_update] = old_stamp
+        eq_(None, Filter.worklist_cache)
+
+    def test_from_worklist_cache_random_seed(self):
+        # With no random seed, FeaturedFacets seeds the random
+        # component of its scoring functions with the current time.
+        # A cached Filter doesn't keep the seed from the first request.
+        lane = self._lane()
+        facets = FeaturedFacets(0.5)
+        eq_(None, facets.random_seed)
+
+        # Creating a Filter the first time creates some configuration
+        # settings, which changes the site configuration. Get that out
+        # of the way.
+        Filter.from_worklist(self._db, lane, facets)
+
+        def seed(filter):
+            [random] = [x for x in filter.scoring_functions
+                        if getattr(x, 'name', None) == 'random_score']
+            return random.to_dict()['random_score']['seed']
+
+        last_update = Configuration.SITE_CONFIGURATION_LAST_UPDATE
+        old_stamp = Configuration.instance.get(last_update)
+        Configuration.instance[last_update] = datetime.datetime(2019, 1, 1)
+        cache = Filter.enable_worklist_cache()
+        try:
+            with patch('time.time', return_value=1000):
+                filter1 = Filter.from_worklist(self._db, lane, facets)
+                filter2 = Filter.from_worklist(self._db, lane, facets)
+            with patch('time.time', return_value=2000):
+                filter3 = Filter.from_worklist(self._db, lane, facets)
+            eq_(2, cache.hits)
+            eq_(1000, seed(filter1))
+            eq_(1000, seed(filter2))
+            eq_(2000, seed(filter3))
+
+            # The new scoring functions don't stop the cached
+            # Elasticsearch filter from being reused.
+            eq_(filter3._prebuilt[0], filter3._state)
+        finally:
+            Filter.disable_worklist_cache()
+            Configuration.instance[last_update] = old_stamp
+
     def assert_filter_builds_to(self, expect, filter, _chain_filters=None):
         """Helper method for the most common case, where a
         Filter.build() returns a main filter and no nested filters.
@@ -4449,6 +4867,145 @@ class TestBulkUpdate(DatabaseTest):
         eq_(set([w1, w2, w3]), set(successes))
         eq_([], failures)
 
+    def test_unchanged_documents_not_uploaded(self):
+        class Mock(MockExternalSearchIndex):
+            uploaded = []
+            def bulk(self, docs, **kwargs):
+                self.uploaded.append([doc['_id'] for doc in docs])
+                return super(Mock, self).bulk(docs, **kwargs)
+
+        w1 = self._work()
+        w2 = self._work()
+        index = Mock()
+        successes, failures = index.bulk_update([w1, w2])
+        eq_([[w1.id, w2.id]], index.uploaded)
+
+        # Each work remembers the fingerprint of its search document.
+        [doc1, doc2] = index.search_documents([w1, w2])
+        eq_(index.fingerprint(doc1), w1.search_document_fingerprint)
+        eq_(index.fingerprint(doc2), w2.search_document_fingerprint)
+
+        # If a work's search document hasn't changed, it's not
+        # uploaded again, but it still counts as a success.
+        w2.fiction = not w2.fiction
+        self._db.flush()
+        successes, failures = index.bulk_update([w1, w2])
+        eq_([w2.id], index.uploaded[-1])
+        eq_(set([w1, w2]), set(successes))
+        eq_([], failures)
+        [doc1, doc2] = index.search_documents([w1, w2])
+        eq_(index.fingerprint(doc2), w2.search_document_fingerprint)
+
+        # If nothing has changed, nothing is uploaded.
+        successes, failures = index.bulk_update([w1, w2])
+        eq_(2, len(index.uploaded))
+        eq_(set([w1, w2]), set(successes))
+
+        # Once a work is removed from the index, its document will be
+        # uploaded the next time around.
+        index.remove_work(w1)
+        eq_(None, w1.search_document_fingerprint)
+        index.bulk_update([w1, w2])
+        eq_([w1.id], index.uploaded[-1])
+
+    def test_bulk_update_results(self):
+        w1 = self._work()
+        w2 = self._work()
+        w3 = self._work()
+        index = MockExternalSearchIndex()
+        docs = [dict(_id=w1.id), dict(_id=w2.id)]
+        errors = [dict(data=dict(_id=w2.id), error="Bad document")]
+        successes, failures = index.bulk_update_results(
+            [w1, w2, w3], docs, 1, errors
+        )
+
+        # w1 was indexed.
+        eq_([w1], successes)
+
+        # No document was uploaded for w3, and w2's document was
+        # rejected.
+        eq_([(w3, "Work not indexed"), (w2, "Bad document")], failures)
+
+    def test_stream_search_documents(self):
+        w1 = self._work()
+        w2 = self._work()
+        index = MockExternalSearchIndex()
+
+        # The streamed documents are the same ones search_documents
+        # would create, including the name of the index they go into.
+        expect = index.search_documents([w1, w2])
+        chunks = list(index.stream_search_documents(
+            self._db, work_ids=[w1.id, w2.id], chunk_size=1
+        ))
+        eq_([1, 1], [len(chunk) for chunk in chunks])
+        eq_(sorted(expect), sorted(doc for [doc] in chunks))
+        for [doc] in chunks:
+            eq_("works", doc['_index'])
+            eq_("work-type", doc['_type'])
+
+    def test_upload_error(self):
+        m = ExternalSearchIndex.upload_error
+        eq_((1, "Bad document"),
+            m(dict(data=dict(_id=1), error="Bad document")))
+        eq_((2, "Index error"),
+            m(dict(index=dict(_id=2, error="Index error"))))
+        eq_((3, "document missing"),
+            m(dict(update=dict(_id=3, error="document missing"))))
+
+    def test_bulk_update_fields(self):
+        w1 = self._work(with_license_pool=True)
+        w2 = self._work(with_license_pool=True)
+        index = MockExternalSearchIndex()
+        index.bulk_update([w1])
+        w1.search_document_fingerprint = "a fingerprint"
+        [doc] = index.docs.values()
+        eq_(None, doc['last_update_time'])
+        original_title = doc['title']
+
+        now = datetime.datetime.utcnow()
+        for work in (w1, w2):
+            work.last_update_time = now
+        self._db.flush()
+        w2.coverage_records = []
+
+        successes, failures = index.bulk_update_fields(
+            [w1, w2], Work.LICENSEPOOLS_SEARCH_FIELDS
+        )
+        eq_(set([w1, w2]), set(successes))
+        eq_([], failures)
+
+        # The requested fields of w1's document were updated, and the
+        # rest were left alone.
+        [doc] = index.docs.values()
+        assert doc['last_update_time'] is not None
+        eq_(original_title, doc['title'])
+
+        # Since the full document changed, its fingerprint is out of
+        # date.
+        eq_(None, w1.search_document_fingerprint)
+
+        # w2 wasn't in the index, so its document couldn't be
+        # updated. Instead, it was registered for a full reindex.
+        [record] = w2.coverage_records
+        eq_(WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION,
+            record.operation)
+        eq_(WorkCoverageRecord.REGISTERED, record.status)
+
+    def test_fingerprint(self):
+        doc = dict(_id=1, _index="works", title="A Title", fiction=True)
+        fingerprint = ExternalSearchIndex.fingerprint(doc)
+
+        # The order of the keys doesn't matter.
+        same = dict(fiction=True, title="A Title", _index="works", _id=1)
+        eq_(fingerprint, ExternalSearchIndex.fingerprint(same))
+
+        # But any change to the document does, including a change to
+        # the index it's going into.
+        for key, value in (("title", "Another Title"), ("_index", "works-v5")):
+            changed = dict(doc)
+            changed[key] = value
+            assert ExternalSearchIndex.fingerprint(changed) != fingerprint
+
 class TestSearchErrors(ExternalSearchTest):
 
     def test_search_connection_timeout(self):
@@ -4522,6 +5079,173 @@ class TestWorkSearchResult(DatabaseTest):
         eq_(work.sort_title, result.sort_title)
 
 
+class TestWorkSearchView(DatabaseTest):
+    # Test the WorkSearchView class, which creates something that
+    # looks like a Work from an ElasticSearch Hit.
+
+    def test_for_resultsets(self):
+        w1 = self._work(title="Title 1")
+        w2 = self._work(title="Title 2")
+        hit1 = AttrDict(dict(work_id=w1.id, title="Indexed title 1"))
+        hit2 = AttrDict(dict(work_id=w2.id, title="Indexed title 2"))
+        eq_(True, WorkSearchView.can_hydrate(hit1))
+        eq_(False, WorkSearchView.can_hydrate(AttrDict(dict(work_id=1))))
+
+        loads = []
+        def load_works(work_ids):
+            loads.append(work_ids)
+            return [w1, w2]
+
+        [[v1, v2], [v1_again]] = WorkSearchView.for_resultsets(
+            [[hit1, hit2], [hit1]], load_works
+        )
+
+        # Data from the search document is available without loading
+        # anything from the database.
+        eq_(w1.id, v1.id)
+        eq_("Indexed title 1", v1.title)
+        eq_("Indexed title 2", v2.title)
+        eq_(hit1, v1._hit)
+        eq_(None, v1.sort_author)
+        eq_([], loads)
+
+        # Anything else loads the Works for the whole batch, once.
+        eq_(w1.presentation_edition, v1.presentation_edition)
+        eq_(w2, v2._work)
+        eq_(w1.license_pools, v1_again.license_pools)
+        eq_([[w1.id, w2.id, w1.id]], loads)
+
+    def test_missing_work(self):
+        # If the Work is no longer in the database, only the data from
+        # the search document is available.
+        hit = AttrDict(dict(work_id=-1, title="Gone"))
+        [[view]] = WorkSearchView.for_resultsets([[hit]], lambda ids: [])
+        eq_("Gone", view.title)
+        eq_(None, view._work)
+        assert_raises_regexp(
+            AttributeError, "Work -1 is no longer in the database",
+            getattr, view, "presentation_edition"
+        )
+
+    def test_opds_entry(self):
+        # An OPDS entry created from a WorkSearchView is the same as
+        # one created from the Work, even though some fields are
+        # stored differently in the search document.
+        work = self._work(
+            with_license_pool=True, audience=Classifier.AUDIENCE_YOUNG_ADULT,
+            fiction=True
+        )
+        work.target_age = NumericRange(14, 18, '[]')
+        work.summary_text = u"A summary."
+        self._db.flush()
+        document = work.to_search_document()
+        eq_("YoungAdult", document['audience'])
+        eq_("Fiction", document['fiction'])
+
+        hit = AttrDict(
+            dict((k, v) for k, v in document.items()
+                 if k == 'work_id' or k in WorkSearchView.SOURCE_FIELDS)
+        )
+        [[view]] = WorkSearchView.for_resultsets([[hit]], lambda ids: [work])
+        eq_(Classifier.AUDIENCE_YOUNG_ADULT, view.audience)
+        eq_(u"A summary.", view.summary_text)
+        eq_(True, view.fiction)
+
+        def entry(work):
+            return etree.tostring(AcquisitionFeed.single_entry(
+                self._db, work, Annotator, raw=True, use_cache=False
+            ))
+        from_view = entry(view)
+        eq_(entry(work), from_view)
+        assert 'term="Young Adult"' in from_view
+        assert 'term="14-18"' in from_view
+        assert 'label="Fiction"' in from_view
+        assert '>A summary.</summary>' in from_view
+
+
+class TestSearchIndexPipeline(DatabaseTest):
+
+    def test_run(self):
+        works = [self._work() for i in range(5)]
+        for work in works:
+            work.set_presentation_ready()
+
+        class Doomed(MockExternalSearchIndex):
+            """Every upload that contains a document for a certain
+            work raises an exception.
+            """
+            def bulk(self, docs, **kwargs):
+                if any(doc['_id'] == works[2].id for doc in docs):
+                    raise Exception("Doomed")
+                return super(Doomed, self).bulk(docs, **kwargs)
+
+        index = Doomed()
+        pipeline = SearchIndexPipeline(index, uploaders=2, max_pending=1)
+        batches = [works[0:2], works[2:4], works[4:]]
+
+        handled = []
+        def handle_results(batch, successes, failures):
+            handled.append((batch, successes, failures))
+        pipeline.run(iter(batches), handle_results)
+
+        # Every batch was handled, though not necessarily in order.
+        eq_(3, len(handled))
+        by_first_work = dict(
+            (batch[0], (successes, failures))
+            for batch, successes, failures in handled
+        )
+        eq_((works[0:2], []), by_first_work[works[0]])
+        eq_((works[4:], []), by_first_work[works[4]])
+
+        # When an upload raises an exception, every work in the
+        # batch is a failure.
+        successes, failures = by_first_work[works[2]]
+        eq_([], successes)
+        eq_([(works[2], "Exception('Doomed',)"),
+             (works[3], "Exception('Doomed',)")], failures)
+
+        # Only the successful works made it into the search index.
+        eq_(3, len(index.docs))
+
+        # Statistics were kept for every stage of the pipeline.
+        for stage in (pipeline.CREATE, pipeline.UPLOAD, pipeline.RECORD):
+            eq_(3, pipeline.stats[stage]['batches'])
+            eq_(5, pipeline.stats[stage]['items'])
+
+
+class TestSearchIndexLicensePoolsCoverageProvider(DatabaseTest):
+
+    def test_run(self):
+        registered = self._work(with_license_pool=True)
+        registered.set_presentation_ready()
+        unregistered = self._work(with_license_pool=True)
+        unregistered.set_presentation_ready()
+        index = MockExternalSearchIndex()
+        index.bulk_update([registered, unregistered])
+        for work in (registered, unregistered):
+            WorkCoverageRecord.add_for(
+                work, WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
+            )
+
+        registered.last_update_time = datetime.datetime.utcnow()
+        provider = SearchIndexLicensePoolsCoverageProvider(
+            self._db, search_index_client=index, uploaders=2
+        )
+        eq_(WorkCoverageRecord.UPDATE_SEARCH_INDEX_LICENSEPOOLS_OPERATION,
+            provider.operation)
+
+        # Only the work that was registered as needing this update
+        # gets it.
+        eq_([registered], provider.items_that_need_coverage().all())
+        progress = provider.run_once_and_update_timestamp()
+        eq_(1, progress.successes)
+        eq_([], provider.items_that_need_coverage().all())
+        doc = index.docs[
+            (index.works_index, index.work_document_type, registered.id)
+        ]
+        assert doc['last_update_time'] is not None
+
+
 class TestSearchIndexCoverageProvider(DatabaseTest):
 
     def test_operation(self):
@@ -4571,3 +5295,99 @@ class TestSearchIndexCoverageProvider(DatabaseTest):
         eq_(work, record.obj)
         eq_(True, record.transient)
         eq_('There was an error!', record.exception)
+
+    def test_run_pipelined(self):
+        works = [self._work() for i in range(5)]
+        for work in works:
+            work.set_presentation_ready()
+        index = MockExternalSearchIndex()
+        provider = SearchIndexCoverageProvider(
+            self._db, search_index_client=index, batch_size=2, uploaders=2
+        )
+
+        # The works are found in batches, in order of ID.
+        eq_([works[0:2], works[2:4], works[4:]], list(provider.batches()))
+
+        progress = provider.run_once_and_update_timestamp()
+        eq_(5, progress.successes)
+        eq_(0, progress.transient_failures)
+        assert progress.finish is not None
+        eq_(5, len(index.docs))
+
+        # Every work now has a coverage record.
+        for work in works:
+            [record] = [
+                x for x in work.coverage_records
+                if x.operation == provider.operation
+            ]
+            eq_(WorkCoverageRecord.SUCCESS, record.status)
+        eq_([], list(provider.batches()))
+
+        # The session's expire_on_commit setting was restored.
+        eq_(True, self._db.expire_on_commit)
+
+    def test_run_streamed(self):
+        works = [self._work() for i in range(5)]
+        for work in works:
+            work.set_presentation_ready()
+        ids = [work.id for work in works]
+        failing_id = ids[1]
+
+        class Mock(MockExternalSearchIndex):
+            uploaded = []
+            def bulk(self, docs, **kwargs):
+                ids = [doc['_id'] for doc in docs]
+                self.uploaded.append(ids)
+                docs = [x for x in docs if x['_id'] != failing_id]
+                success_count, errors = super(Mock, self).bulk(docs)
+                if failing_id in ids:
+                    errors.append(dict(index=dict(
+                        _id=str(failing_id), error="Bad document"
+                    )))
+                return success_count, errors
+
+        index = Mock()
+        provider = SearchIndexCoverageProvider(
+            self._db, search_index_client=index, batch_size=2,
+            streamed=True
+        )
+        # Read the search documents through more than one cursor.
+        provider.BATCHES_PER_STREAM = 1
+        self._db.commit()
+        self._db.expunge_all()
+
+        progress = provider.run_once_and_update_timestamp()
+        eq_(4, progress.successes)
+        eq_(1, progress.transient_failures)
+        eq_(None, progress.exception)
+        assert progress.finish is not None
+
+        # The documents were uploaded a batch at a time.
+        eq_(sorted(ids), sorted(sum(index.uploaded, [])))
+        assert all(len(batch) <= 2 for batch in index.uploaded)
+        eq_(4, len(index.docs))
+
+        # None of the Works had to be loaded to do this.
+        eq_([], [x for x in self._db.identity_map.values()
+                 if isinstance(x, Work)])
+
+        # Every work has a coverage record, including the one whose
+        # document was rejected.
+        records = dict(
+            (x.work_id, x) for x in self._db.query(WorkCoverageRecord).filter(
+                WorkCoverageRecord.operation==provider.operation
+            )
+        )
+        eq_(sorted(ids), sorted(records.keys()))
+        failure = records.pop(failing_id)
+        eq_(WorkCoverageRecord.TRANSIENT_FAILURE, failure.status)
+        eq_("Bad document", failure.exception)
+        eq_(set([WorkCoverageRecord.SUCCESS]),
+            set(x.status for x in records.values()))
+
+        # Next time, only the work whose document was rejected is
+        # tried again.
+        index.uploaded = []
+        progress = provider.run_streamed()
+        eq_(0, progress.successes)
+        eq_(set([failing_id]), set(sum(index.uploaded, [])))
@@ -5,6 +5,7 @@ from mock import (
     call,
     MagicMock,
 )
+import pickle
 import random
 from nose.tools import (
     eq_,
@@ -25,6 +26,7 @@ from sqlalchemy import (
 )
 
 from elasticsearch.exceptions import ElasticsearchException
+from elasticsearch_dsl.utils import AttrDict
 
 from ..classifier import Classifier
 
@@ -41,17 +43,21 @@ from ..external_search import (
     Filter,
     MockExternalSearchIndex,
     WorkSearchResult,
+    WorkSearchView,
     mock_search_index,
 )
 
 from ..lane import (
+    BaseFacets,
     DatabaseBackedFacets,
     DatabaseBackedWorkList,
+    DatabaseSortKeyPagination,
     DefaultSortOrderFacets,
     FacetConstants,
     Facets,
     FacetsWithEntryPoint,
     FeaturedFacets,
+    LaneTreeSnapshot,
     Pagination,
     SearchFacets,
     TopLevelWorkList,
@@ -1122,6 +1128,38 @@ class TestFeaturedFacets(DatabaseTest):
         eq_(2, different_quality.minimum_featured_quality)
         eq_(entrypoint, different_quality.entrypoint)
 
+    def test_filter_cache_key(self):
+        # Faceting objects that would modify a search Filter in the
+        # same way have the same filter_cache_key.
+        f = FeaturedFacets(0.5, EbooksEntryPoint, random_seed=1)
+        eq_(("FeaturedFacets", f.query_string, 0.5, 1), f.filter_cache_key)
+        eq_(f.filter_cache_key,
+            FeaturedFacets(0.5, EbooksEntryPoint, random_seed=1).filter_cache_key)
+
+        # Anything that affects the Filter changes the key.
+        for different in (
+            FeaturedFacets(0.6, EbooksEntryPoint, random_seed=1),
+            FeaturedFacets(0.5, AudiobooksEntryPoint, random_seed=1),
+            FeaturedFacets(0.5, EbooksEntryPoint, random_seed=2),
+        ):
+            assert different.filter_cache_key != f.filter_cache_key
+
+        # Facets also takes its sort direction and library into account.
+        facets = Facets(
+            self._default_library, Facets.COLLECTION_FULL,
+            Facets.AVAILABLE_ALL, Facets.ORDER_TITLE
+        )
+        ascending = facets.filter_cache_key
+        eq_(("Facets", facets.query_string, True,
+             self._default_library.id), ascending)
+        facets.order_ascending = False
+        assert facets.filter_cache_key != ascending
+
+        # Filters built for search requests depend on the patron's
+        # settings, so they can't be cached.
+        eq_(None, SearchFacets().filter_cache_key)
+        eq_(None, BaseFacets().filter_cache_key)
+
 
 class TestSearchFacets(DatabaseTest):
 
@@ -1576,6 +1614,142 @@ class TestPagination(DatabaseTest):
         eq_(o[2:2+3], pagination.modify_search_query(o))
 
 
+class TestDatabaseSortKeyPagination(DatabaseTest):
+
+    def test_from_request(self):
+        # No arguments -> Class defaults.
+        pagination = DatabaseSortKeyPagination.from_request({}.get, None)
+        assert isinstance(pagination, DatabaseSortKeyPagination)
+        eq_(Pagination.DEFAULT_SIZE, pagination.size)
+        eq_(None, pagination.pagination_key)
+        eq_(0, pagination.offset)
+
+        # The page key is a JSON-encoded list of sort values.
+        key = ["Author", "Title", 10]
+        pagination = DatabaseSortKeyPagination.from_request(
+            dict(key=json.dumps(key), size="4").get
+        )
+        eq_(4, pagination.size)
+        eq_(key, pagination.last_item_on_previous_page)
+        eq_(
+            [("key", json.dumps(key)), ("size", 4)], list(pagination.items())
+        )
+
+        # An invalid key -> problem detail
+        for bad_key in ["not json", json.dumps(dict(a=1))]:
+            error = DatabaseSortKeyPagination.from_request(
+                dict(key=bad_key).get
+            )
+            eq_(INVALID_INPUT.uri, error.uri)
+            eq_("Invalid page key: %s" % bad_key, str(error.detail))
+
+    def test_next_page(self):
+        pagination = DatabaseSortKeyPagination(size=2)
+
+        # Until a page is loaded we don't know where the next page
+        # starts.
+        eq_(None, pagination.next_page)
+        eq_(None, pagination.previous_page)
+
+        pagination.this_page_size = 2
+        pagination.last_item_on_this_page = ["value", 1]
+        next_page = pagination.next_page
+        assert isinstance(next_page, DatabaseSortKeyPagination)
+        eq_(["value", 1], next_page.last_item_on_previous_page)
+        eq_(2, next_page.size)
+        eq_(None, next_page.first_page.last_item_on_previous_page)
+
+        # An empty page has no next page.
+        pagination.this_page_size = 0
+        eq_(None, pagination.next_page)
+
+    def test_modify_database_query(self):
+        # An unsorted query is sorted by work ID so it can be paginated.
+        pagination = DatabaseSortKeyPagination(size=2)
+        qu = pagination.modify_database_query(self._db, self._db.query(Work))
+        eq_([(Work.id.key, True)],
+            [(field.key, ascending) for field, ascending in pagination.sort_fields])
+        eq_(2, qu._limit)
+
+        # A query can't be paginated if it's sorted by a field we
+        # can't find on a Work.
+        qu = self._db.query(Work).join(Work.license_pools).order_by(
+            LicensePool.id
+        )
+        assert_raises_regexp(
+            ValueError, "can't paginate a query ordered by",
+            pagination.modify_database_query, self._db, qu
+        )
+
+        # The page key must have one value for each sort field.
+        pagination = DatabaseSortKeyPagination(["a", "b"], size=2)
+        assert_raises_regexp(
+            ValueError, "doesn't match a query sorted by 1 fields",
+            pagination.modify_database_query, self._db,
+            self._db.query(Work)
+        )
+
+    def test_works_from_database_end_to_end(self):
+        # Page through a DatabaseBackedWorkList in several sort orders,
+        # and verify that we see every work exactly once, in the same
+        # order as a single big OFFSET-based page.
+        now = datetime.datetime.utcnow()
+        works = []
+        for title, author, offset in [
+            ("A", "Zimmer", 1), ("B", "Adams", 2), ("B", "Adams", 3),
+            ("C", None, 4), ("D", "Adams", 5), ("E", None, 6),
+            ("F", "Moss", 6),
+        ]:
+            work = self._work(
+                title=title, authors=[], with_license_pool=True
+            )
+            work.presentation_edition.sort_author = author
+            work.last_update_time = now - datetime.timedelta(days=offset)
+            works.append(work)
+
+        wl = DatabaseBackedWorkList()
+        wl.initialize(self._default_library)
+
+        for order in (
+            Facets.ORDER_TITLE, Facets.ORDER_AUTHOR,
+            Facets.ORDER_LAST_UPDATE, Facets.ORDER_WORK_ID
+        ):
+            for ascending in (True, False):
+                facets = DatabaseBackedFacets(
+                    self._default_library,
+                    collection=Facets.COLLECTION_FULL,
+                    availability=Facets.AVAILABLE_ALL,
+                    order=order, order_ascending=ascending
+                )
+                expect = wl.works_from_database(
+                    self._db, facets, Pagination(0, 100)
+                ).all()
+                eq_(len(works), len(expect))
+
+                seen = []
+                pagination = DatabaseSortKeyPagination(size=2)
+                while pagination:
+                    page = wl.works_from_database(
+                        self._db, facets, pagination
+                    ).all()
+                    pagination.page_loaded(page)
+                    seen.extend(page)
+
+                    # Use the page key the way a client would.
+                    pagination = pagination.next_page
+                    if pagination:
+                        pagination = DatabaseSortKeyPagination.from_request(
+                            dict(key=pagination.pagination_key, size=2).get
+                        )
+                eq_(expect, seen)
+
+    def test_modify_search_query(self):
+        pagination = DatabaseSortKeyPagination()
+        assert_raises(
+            NotImplementedError, pagination.modify_search_query, object()
+        )
+
+
 class MockWork(object):
     """Acts enough like a Work to trick code that doesn't need to make
     database requests.
@@ -2167,6 +2341,79 @@ class TestWorkList(DatabaseTest):
         # the return value of works(), the method we're testing.
         eq_(wl.fake_work_list, result)
 
+    def test_works_with_facet_counts(self):
+        # If INCLUDE_FACET_COUNTS is set, works() counts the works
+        # under each of the faceting object's countable facets while
+        # it gets the page of works.
+        class MockSearchClient(object):
+            def query_works_with_facet_counts(
+                self, query_string, filter, pagination, facet_filters,
+                debug=False
+            ):
+                self.called_with = (
+                    query_string, filter, pagination, facet_filters, debug
+                )
+                return [], range(len(facet_filters))
+
+        class MockWorkList(WorkList):
+            INCLUDE_FACET_COUNTS = True
+
+        wl = MockWorkList()
+        wl.initialize(
+            self._default_library,
+            entrypoints=[AudiobooksEntryPoint, EbooksEntryPoint]
+        )
+        enabled = {
+            Facets.ORDER_FACET_GROUP_NAME : [
+                Facets.ORDER_TITLE, Facets.ORDER_AUTHOR
+            ],
+            Facets.AVAILABILITY_FACET_GROUP_NAME : [
+                Facets.AVAILABLE_ALL, Facets.AVAILABLE_NOW
+            ],
+            Facets.COLLECTION_FACET_GROUP_NAME : [Facets.COLLECTION_FULL],
+        }
+        facets = Facets(
+            self._default_library, Facets.COLLECTION_FULL,
+            Facets.AVAILABLE_ALL, Facets.ORDER_TITLE,
+            enabled_facets=enabled, entrypoint=EbooksEntryPoint
+        )
+        pagination = Pagination.default()
+        search_client = MockSearchClient()
+        eq_([], wl.works(self._db, facets, pagination, search_client))
+
+        # The entry points and availability facets were counted. The
+        # order facets don't change which works are in the feed, and
+        # there's only one collection facet.
+        eq_({
+            (Facets.ENTRY_POINT_FACET_GROUP_NAME,
+             AudiobooksEntryPoint.INTERNAL_NAME) : 0,
+            (Facets.ENTRY_POINT_FACET_GROUP_NAME,
+             EbooksEntryPoint.INTERNAL_NAME) : 1,
+            (Facets.AVAILABILITY_FACET_GROUP_NAME, Facets.AVAILABLE_ALL) : 2,
+            (Facets.AVAILABILITY_FACET_GROUP_NAME, Facets.AVAILABLE_NOW) : 3,
+        }, facets.facet_counts)
+
+        # Each facet was counted with the Filter for its own faceting
+        # object.
+        query_string, filter, used_pagination, facet_filters, debug = (
+            search_client.called_with
+        )
+        eq_(None, query_string)
+        eq_(pagination, used_pagination)
+        eq_(wl.filter(self._db, facets).build(), filter.build())
+        audiobooks = facets.navigate(entrypoint=AudiobooksEntryPoint)
+        eq_(wl.filter(self._db, audiobooks).build(),
+            facet_filters[0].build())
+        available_now = facets.navigate(availability=Facets.AVAILABLE_NOW)
+        eq_(wl.filter(self._db, available_now).build(),
+            facet_filters[3].build())
+
+        # search() counts facets the same way.
+        facets.facet_counts = None
+        wl.search(self._db, "a query", search_client, pagination, facets)
+        eq_("a query", search_client.called_with[0])
+        eq_(4, len(facets.facet_counts))
+
     def test_works_for_hits(self):
         # Verify that WorkList.works_for_hits() just calls
         # works_for_resultsets().
@@ -2257,6 +2504,42 @@ class TestWorkList(DatabaseTest):
             self._db.delete(lpdm)
             eq_([[]], m(self._db, [[hit2]]))
 
+    def test_works_for_resultsets_hydrated(self):
+        # If HYDRATE_FROM_SEARCH_INDEX is set, Hits that contain
+        # the data from the search document are turned directly into
+        # WorkSearchViews, without going to the database.
+        wl = WorkList()
+        wl.initialize(self._default_library)
+        wl.HYDRATE_FROM_SEARCH_INDEX = True
+
+        w1 = self._work(with_license_pool=True)
+        w2 = self._work(with_license_pool=True)
+        hit1 = AttrDict(dict(work_id=w1.id, title=w1.title))
+        hit2 = AttrDict(dict(work_id=w2.id, title=w2.title))
+
+        [[v2, v1], []] = wl.works_for_resultsets(self._db, [[hit2, hit1], []])
+        assert isinstance(v1, WorkSearchView)
+        eq_((w2.id, w2.title), (v2.id, v2.title))
+
+        # The Works are loaded when they're needed, with no
+        # availability filters applied.
+        for lpdm in w2.license_pools[0].delivery_mechanisms:
+            self._db.delete(lpdm)
+        eq_(w2, v2._work)
+        eq_(w1.license_pools, v1.license_pools)
+
+        # Hits without the data from the search document are turned
+        # into Works the usual way.
+        hit = AttrDict(dict(work_id=w1.id))
+        eq_([[w1]], wl.works_for_resultsets(self._db, [[hit]]))
+
+    def test_works_by_id(self):
+        w1 = self._work(with_license_pool=True)
+        w2 = self._work(with_license_pool=True)
+        eq_(set([w1, w2]),
+            set(WorkList.works_by_id(self._db, [w1.id, w2.id, -1])))
+        eq_([], WorkList.works_by_id(self._db, []))
+
     def test_search_target(self):
         # A WorkList can be searched - it is its own search target.
         wl = WorkList()
@@ -3290,6 +3573,38 @@ class TestLane(DatabaseTest):
         )
         eq_(102, fiction.size)
 
+    def test_update_sizes(self):
+        # Lane.update_sizes has the same effect as calling update_size
+        # on several Lanes, but it makes a single count_works_multi
+        # call.
+        class Mock(object):
+            calls = []
+            def count_works_multi(self, filters):
+                self.calls.append(filters)
+                return [
+                    (100 if filter.fiction else 200) + len(filter.media or [])
+                    for filter in filters
+                ]
+        search_engine = Mock()
+
+        fiction = self._lane(display_name="Fiction", fiction=True)
+        fiction.size = 44
+        nonfiction = self._lane(display_name="Nonfiction", fiction=False)
+        Lane.update_sizes(self._db, [fiction, nonfiction], search_engine)
+
+        # One Filter was counted for every lane and entry point.
+        [filters] = search_engine.calls
+        eq_(2 * len(EntryPoint.ENTRY_POINTS), len(filters))
+
+        eq_(100, fiction.size)
+        eq_(200, nonfiction.size)
+        eq_({AudiobooksEntryPoint.URI: 101,
+             EbooksEntryPoint.URI: 101,
+             EverythingEntryPoint.URI: 100},
+            fiction.size_by_entrypoint
+        )
+        eq_(201, nonfiction.size_by_entrypoint[AudiobooksEntryPoint.URI])
+
     def test_visibility(self):
         parent = self._lane()
         visible_child = self._lane(parent=parent)
@@ -3826,6 +4141,177 @@ class TestLane(DatabaseTest):
         Lane._groups_for_lanes = old_value
 
 
+class TestLaneTreeSnapshot(DatabaseTest):
+
+    def test_snapshot(self):
+        # Set up a small lane hierarchy.
+        fantasy, ignore = Genre.lookup(self._db, "Fantasy")
+        fiction = self._lane("Fiction", fiction=True)
+        fiction.languages = ["eng"]
+        fiction.audiences = [Classifier.AUDIENCE_ADULT]
+        customlist, ignore = self._customlist(num_entries=0)
+        fiction.customlists.append(customlist)
+        sf = self._lane("Science Fiction", parent=fiction)
+        sf.add_genre("Science Fiction")
+        fantasy_lane = self._lane("Fantasy", parent=fiction)
+        fantasy_lane.add_genre(fantasy)
+        fantasy_lane.priority = -1
+        epic = self._lane("Epic Fantasy", parent=fantasy_lane)
+        epic.add_genre("Epic Fantasy")
+        hidden = self._lane("Hidden", parent=fiction)
+        hidden._visible = False
+        under_hidden = self._lane("Under hidden", parent=hidden)
+        independent = self._lane("Independent", parent=fiction)
+        independent.inherit_parent_restrictions = False
+        lanes = [fiction, sf, fantasy_lane, epic, hidden, under_hidden,
+                 independent]
+        self._db.flush()
+
+        def describe(lane):
+            return (
+                list(lane.parentage), lane.visible_children,
+                lane.genre_ids, lane.customlist_ids,
+                [lane.inherited_value(k)
+                 for k in LaneTreeSnapshot.INHERITED_VALUE_KEYS],
+                [lane.inherited_values(k)
+                 for k in LaneTreeSnapshot.INHERITED_VALUES_KEYS],
+            )
+        expect = [describe(lane) for lane in lanes]
+
+        last_update = Configuration.SITE_CONFIGURATION_LAST_UPDATE
+        old_stamp = Configuration.instance.get(last_update)
+        Configuration.instance[last_update] = datetime.datetime(2019, 1, 1)
+        cache = LaneTreeSnapshot.enable_cache()
+        try:
+            # With snapshots enabled, Lanes give the same answers as
+            # before, but they come from a snapshot of the library's
+            # lane tree.
+            eq_(expect, [describe(lane) for lane in lanes])
+            eq_(1, len(cache))
+            eq_(1, cache.misses)
+            tree = LaneTreeSnapshot.for_library(
+                self._db, self._default_library.id
+            )
+            snapshot = fantasy_lane.snapshot
+            eq_(tree.get(fantasy_lane.id), snapshot)
+            eq_((fiction.id,), snapshot.parentage_ids)
+            eq_((epic.id,), snapshot.visible_children_ids)
+            eq_((fantasy_lane.id, sf.id, independent.id),
+                fiction.snapshot.visible_children_ids)
+            eq_((), hidden.snapshot.visible_children_ids)
+            eq_((u"eng",), snapshot.inherited_value['languages'])
+            eq_(((customlist.id,),),
+                snapshot.inherited_values['customlist_ids'])
+            eq_((), independent.snapshot.inherited_values['customlist_ids'])
+            eq_(1, cache.misses)
+
+            # A snapshot can be pickled.
+            eq_(tree.lanes, pickle.loads(pickle.dumps(tree)).lanes)
+
+            # A Lane with changes that haven't been written to the
+            # database doesn't use the snapshot.
+            epic.languages = ["spa"]
+            eq_(None, epic.snapshot)
+            eq_(["spa"], epic.inherited_value('languages'))
+
+            # A change to the site configuration (which is what
+            # happens when a Lane is changed) means the snapshot must
+            # be rebuilt.
+            self._db.flush()
+            Configuration.instance[last_update] = datetime.datetime(
+                2020, 1, 1
+            )
+            eq_(["spa"], epic.inherited_value('languages'))
+            eq_(2, cache.misses)
+            eq_(("spa",), epic.snapshot.inherited_value['languages'])
+        finally:
+            LaneTreeSnapshot.disable_cache()
+            Configuration.instance[last_update] = old_stamp
+        eq_(None, fiction.snapshot)
+
+    def test_snapshot_not_kept_right_after_change(self):
+        # Right after the site configuration changes, another change
+        # might not update the timestamp, so the snapshot isn't kept.
+        lane = self._lane()
+        self._db.flush()
+        last_update = Configuration.SITE_CONFIGURATION_LAST_UPDATE
+        old_stamp = Configuration.instance.get(last_update)
+        Configuration.instance[last_update] = datetime.datetime.utcnow()
+        cache = LaneTreeSnapshot.enable_cache()
+        try:
+            eq_(lane.id, lane.snapshot.id)
+            eq_(0, len(cache))
+
+            # Once things have settled down, it is.
+            Configuration.instance[last_update] = datetime.datetime(
+                2019, 1, 1
+            )
+            eq_(lane.id, lane.snapshot.id)
+            eq_(1, len(cache))
+        finally:
+            LaneTreeSnapshot.disable_cache()
+            Configuration.instance[last_update] = old_stamp
+
+    def test_lists_from_datasource(self):
+        # A Lane that takes every CustomList from a DataSource can
+        # gain a list without any change to the site configuration,
+        # so its CustomList IDs are looked up every time.
+        source = DataSource.lookup(self._db, DataSource.NYT)
+        list1, ignore = self._customlist(data_source_name=DataSource.NYT,
+                                         num_entries=0)
+        parent = self._lane()
+        parent.list_datasource = source
+        child = self._lane(parent=parent)
+        self._db.flush()
+
+        last_update = Configuration.SITE_CONFIGURATION_LAST_UPDATE
+        old_stamp = Configuration.instance.get(last_update)
+        Configuration.instance[last_update] = datetime.datetime(2019, 1, 1)
+        LaneTreeSnapshot.enable_cache()
+        try:
+            eq_(True, parent.snapshot.lists_from_datasource)
+            eq_(False, child.snapshot.lists_from_datasource)
+            assert 'customlist_ids' not in child.snapshot.inherited_values
+            eq_([list1.id], parent.customlist_ids)
+            eq_([[list1.id]], child.inherited_values('customlist_ids'))
+
+            list2, ignore = self._customlist(
+                data_source_name=DataSource.NYT, num_entries=0
+            )
+            self._db.flush()
+            eq_(datetime.datetime(2019, 1, 1),
+                Configuration.instance[last_update])
+            # (A Lane object remembers its own CustomList IDs, but the
+            # next request will get a new Lane object.)
+            del parent._customlist_ids
+            eq_(set([list1.id, list2.id]), set(parent.customlist_ids))
+            [ids] = child.inherited_values('customlist_ids')
+            eq_(set([list1.id, list2.id]), set(ids))
+        finally:
+            LaneTreeSnapshot.disable_cache()
+            Configuration.instance[last_update] = old_stamp
+
+    def test_customlist_change_is_configuration_change(self):
+        # Changing the CustomLists associated with a Lane counts as a
+        # change to the site configuration, so that snapshots of the
+        # lane tree are rebuilt.
+        lane = self._lane()
+        customlist, ignore = self._customlist(num_entries=0)
+
+        last_update = Configuration.SITE_CONFIGURATION_LAST_UPDATE
+        old_stamp = Configuration.instance.get(last_update)
+        try:
+            Configuration.instance[last_update] = datetime.datetime(
+                2020, 1, 1
+            )
+            lane.customlists.append(customlist)
+            assert Configuration.instance[last_update] > datetime.datetime(
+                2020, 1, 1
+            )
+        finally:
+            Configuration.instance[last_update] = old_stamp
+
+
 class TestWorkListGroupsEndToEnd(EndToEndSearchTest):
     # A comprehensive end-to-end test of WorkList.groups()
     # using a real Elasticsearch index.
@@ -4258,6 +4744,96 @@ class TestWorkListGroups(DatabaseTest):
         eq_(int(self._default_library.featured_lane_size * 1.10),
             pagination.size)
 
+    def test_groups_for_lanes_batches_separate_queries(self):
+        # Non-queryable children that find their works with an
+        # ordinary search have that search run in the same request as
+        # the main query, and all the results are turned into Works at
+        # once.
+        class MockSearchEngine(object):
+            def __init__(self):
+                self.calls = []
+
+            def query_works_multi(self, queries, debug=False):
+                self.calls.append(queries)
+                return [["result %d" % i] for i in range(len(queries))]
+
+        class MockParent(WorkList):
+            works_for_resultsets_calls = []
+            def works_for_resultsets(self, _db, resultsets, facets=None):
+                self.works_for_resultsets_calls.append(resultsets)
+                return [[MockWork(x[0])] for x in resultsets]
+
+        class SpecialChild(WorkList):
+            # This WorkList finds its works in some special way, so
+            # its groups() needs to be called.
+            def works(self, _db, pagination, facets, *args, **kwargs):
+                return [MockWork("special")]
+
+        ordinary = WorkList()
+        ordinary.initialize(self._default_library, display_name="Ordinary")
+        special = SpecialChild()
+        special.initialize(self._default_library, display_name="Special")
+        lane = self._lane("Lane")
+        lane.inherit_parent_restrictions = False
+        lane.languages = ["spa"]
+        excluded = self._lane("Excluded")
+        excluded.include_self_in_grouped_feed = False
+
+        parent = MockParent()
+        children = [ordinary, special, lane, excluded]
+        parent.initialize(self._default_library, children=children)
+        pagination = Pagination(size=2)
+        facets = FeaturedFacets(0)
+        search = MockSearchEngine()
+        groups = list(parent._groups_for_lanes(
+            self._db, children, [], pagination, facets, search_engine=search
+        ))
+
+        # The ordinary WorkList and the Lane were searched in a single
+        # request.
+        [queries] = search.calls
+        eq_(2, len(queries))
+        [(q1, filter1, p1), (q2, filter2, p2)] = queries
+        eq_(None, q1)
+        eq_((pagination, pagination), (p1, p2))
+        eq_(None, filter1.languages)
+        eq_(["spa"], filter2.languages)
+        eq_(1, len(parent.works_for_resultsets_calls))
+
+        # The results are yielded in the order of the children.
+        eq_([("result 0", ordinary), ("special", special), ("result 1", lane)],
+            [(work.id, wl) for work, wl in groups])
+
+    def test_featured_works_query(self):
+        facets = FeaturedFacets(0)
+        pagination = Pagination(size=2)
+
+        # An ordinary WorkList can describe the search for its
+        # contribution to a grouped feed.
+        wl = WorkList()
+        wl.initialize(self._default_library)
+        query_string, filter, p = wl._featured_works_query(
+            self._db, pagination, facets
+        )
+        eq_(None, query_string)
+        eq_(pagination, p)
+        assert isinstance(filter, Filter)
+
+        # A subclass that changes how works are found can't.
+        class Special(WorkList):
+            def works_for_resultsets(self, *args, **kwargs):
+                return []
+        special = Special()
+        special.initialize(self._default_library)
+        eq_(None, special._featured_works_query(self._db, pagination, facets))
+
+        # Neither can a Lane that doesn't contribute anything to a
+        # grouped feed.
+        lane = self._lane()
+        assert lane._featured_works_query(self._db, pagination, facets)
+        lane.include_self_in_grouped_feed = False
+        eq_(None, lane._featured_works_query(self._db, pagination, facets))
+
     def test_featured_works_with_lanes(self):
         # _featured_works_with_lanes builds a list of queries and
         # passes the list into search_engine.works_query_multi(). It
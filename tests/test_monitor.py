@@ -1,11 +1,21 @@
 import datetime
 
+from mock import MagicMock
 from nose.tools import (
     assert_raises,
     assert_raises_regexp,
     eq_,
     ok_,
 )
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    Table,
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.orm.interfaces import ONETOMANY
 
 from . import DatabaseTest
 from ..config import Configuration
@@ -18,10 +28,13 @@ from ..model import (
     ConfigurationSetting,
     Credential,
     DataSource,
+    DRMDeviceIdentifier,
     Edition,
     ExternalIntegration,
     Genre,
     Identifier,
+    LicensePool,
+    Loan,
     Measurement,
     Patron,
     Subject,
@@ -33,6 +46,7 @@ from ..model import (
     get_one_or_create,
 )
 from ..monitor import (
+    CachedFeedPrewarmMonitor,
     CachedFeedReaper,
     CirculationEventLocationScrubber,
     CollectionMonitor,
@@ -53,6 +67,7 @@ from ..monitor import (
     PermanentWorkIDRefreshMonitor,
     PresentationReadyWorkSweepMonitor,
     ReaperMonitor,
+    ScrubberMonitor,
     SubjectSweepMonitor,
     SweepMonitor,
     TimelineMonitor,
@@ -912,6 +927,71 @@ class TestCustomListEntryWorkUpdateMonitor(DatabaseTest):
         eq_(old_work, entry.work)
 
 
+class MockCachedFeedPrewarmMonitor(CachedFeedPrewarmMonitor):
+
+    def __init__(self, *args, **kwargs):
+        super(MockCachedFeedPrewarmMonitor, self).__init__(*args, **kwargs)
+        self.regenerated = []
+
+    def regenerate(self, feed):
+        if feed.unique_key == u"broken":
+            raise Exception("I'm broken")
+        self.regenerated.append(feed)
+
+
+class TestCachedFeedPrewarmMonitor(DatabaseTest):
+
+    def _feed(self, hits, expires_in, type=CachedFeed.GROUPS_TYPE,
+              unique_key=None):
+        feed, ignore = create(
+            self._db, CachedFeed, type=type, pagination=u"",
+            facets=self._str, library=self._default_library, hits=hits,
+            unique_key=unique_key
+        )
+        if expires_in is not None:
+            feed.expires = (
+                datetime.datetime.utcnow()
+                + datetime.timedelta(minutes=expires_in)
+            )
+        return feed
+
+    def test_query(self):
+        popular = self._feed(100, 5)
+        less_popular = self._feed(10, -60)
+        unpopular = self._feed(0, 5)
+        not_expiring_soon = self._feed(100, 60)
+        never_expires = self._feed(100, None)
+        wrong_type = self._feed(100, 5, type=CachedFeed.PAGE_TYPE)
+
+        monitor = MockCachedFeedPrewarmMonitor(self._db)
+        eq_([popular, less_popular], monitor.query().all())
+
+        monitor.limit = 1
+        eq_([popular], monitor.query().all())
+
+    def test_run_once(self):
+        popular = self._feed(100, 5)
+        broken = self._feed(50, 5, unique_key=u"broken")
+        less_popular = self._feed(11, 5)
+
+        sleeps = []
+        monitor = MockCachedFeedPrewarmMonitor(
+            self._db, sleep=sleeps.append
+        )
+        result = monitor.run_once()
+        eq_([popular, less_popular], monitor.regenerated)
+        eq_("Feeds regenerated: 2. Failures: 1", result.achievements)
+
+        # The monitor waited between regenerations.
+        eq_(2, len(sleeps))
+        interval = 60.0 / monitor.MAX_REGENERATIONS_PER_MINUTE
+        for delay in sleeps:
+            assert 0 < delay <= interval
+
+        # The hit counts decayed.
+        eq_([50, 25, 5], [x.hits for x in (popular, broken, less_popular)])
+
+
 class MockReaperMonitor(ReaperMonitor):
     MODEL_CLASS = Timestamp
     TIMESTAMP_FIELD = 'timestamp'
@@ -1001,6 +1081,152 @@ class TestReaperMonitor(DatabaseTest):
 
         eq_([], self._db.query(Credential).all())
 
+    def test_delete_rows(self):
+        # Rows are deleted without being loaded into the session, but
+        # related rows are handled the way the ORM would handle them.
+        patron = self._patron()
+        work = self._work(with_license_pool=True)
+        [pool] = work.license_pools
+        loan, ignore = pool.loan_to(patron)
+        credential = self._credential(patron=patron)
+        device, ignore = credential.register_drm_device_identifier(u"device")
+        other_patron = self._patron()
+        other_loan, ignore = pool.loan_to(other_patron)
+        self._db.commit()
+        ids = [patron.id]
+        other_patron_id = other_patron.id
+        other_loan_id = other_loan.id
+        self._db.expunge_all()
+
+        m = PatronRecordReaper(self._db)
+        m.delete_rows(Patron, ids)
+        self._db.commit()
+
+        # The patron is gone, and so are their loan and their
+        # credential, which the ORM would have deleted along with them.
+        eq_([other_patron_id], [x.id for x in self._db.query(Patron)])
+        eq_([other_loan_id], [x.id for x in self._db.query(Loan)])
+        eq_([], self._db.query(Credential).all())
+
+        # The DRM device identifier survives, but it no longer has a
+        # credential.
+        [device] = self._db.query(DRMDeviceIdentifier).all()
+        eq_(None, device.credential_id)
+
+    def test_check_bulk_delete(self):
+        # Every reaper that deletes rows in bulk deletes rows the ORM
+        # wouldn't need to see.
+        for reaper in ReaperMonitor.REGISTRY:
+            if reaper.USE_ORM or issubclass(reaper, ScrubberMonitor):
+                continue
+            ReaperMonitor.check_bulk_delete(class_mapper(reaper.MODEL_CLASS))
+
+        # A LicensePool has an after_delete listener, so it can't be
+        # deleted in bulk.
+        assert_raises_regexp(
+            ValueError, "LicensePool has a delete listener",
+            ReaperMonitor.check_bulk_delete, class_mapper(LicensePool)
+        )
+
+        # Neither can a row whose delete cascade loops back on itself.
+        class MockMapper(object):
+            def __init__(self, name):
+                self.class_ = type(str(name), (object,), {})
+                self.local_table = Table(name, MetaData())
+                self.dispatch = MagicMock(
+                    before_delete=[], after_delete=[]
+                )
+                self.relationships = []
+
+        class MockRelationship(object):
+            viewonly = passive_deletes = False
+            secondary = None
+            direction = ONETOMANY
+            cascade = MagicMock(delete=True)
+            def __init__(self, mapper):
+                self.mapper = mapper
+
+        parent = MockMapper("parent")
+        child = MockMapper("child")
+        parent.relationships.append(MockRelationship(child))
+        ReaperMonitor.check_bulk_delete(parent)
+
+        child.relationships.append(MockRelationship(parent))
+        assert_raises_regexp(
+            ValueError, "Delete cascade from parent loops back through parent",
+            ReaperMonitor.check_bulk_delete, parent
+        )
+
+    def test_referring(self):
+        # Rows that refer to the rows being deleted are found through
+        # every column of a composite foreign key.
+        metadata = MetaData()
+        parent = Table(
+            "parent", metadata,
+            Column("a", Integer, primary_key=True),
+            Column("b", Integer, primary_key=True),
+        )
+        child = Table(
+            "child", metadata,
+            Column("id", Integer, primary_key=True),
+            Column("parent_a", Integer),
+            Column("parent_b", Integer),
+        )
+        mapper = MagicMock(primary_key=[parent.c.a, parent.c.b])
+        pairs = [(parent.c.a, child.c.parent_a), (parent.c.b, child.c.parent_b)]
+        clause = ReaperMonitor._referring(pairs, mapper, [(1, 2)])
+        sql = str(clause.compile(dialect=postgresql.dialect()))
+        assert sql.startswith("(child.parent_a, child.parent_b) IN (SELECT parent.a, parent.b")
+        assert "WHERE (parent.a, parent.b) IN" in sql
+
+        # A simple foreign key to the primary key is matched directly
+        # against the ids.
+        mapper = MagicMock(primary_key=[parent.c.a])
+        clause = ReaperMonitor._referring(
+            [(parent.c.a, child.c.parent_a)], mapper, [1, 2]
+        )
+        sql = str(clause.compile(dialect=postgresql.dialect()))
+        assert sql.startswith("child.parent_a IN (")
+        assert "SELECT" not in sql
+
+    def test_batches(self):
+        # Rows are deleted a batch at a time, and each batch is
+        # committed.
+        now = datetime.datetime.utcnow()
+        for i in range(3):
+            credential = self._credential()
+            credential.expires = now - datetime.timedelta(days=10)
+        commits = []
+        class Mock(CredentialReaper):
+            BATCH_SIZE = 2
+            def delete_rows(self, model_class, ids):
+                commits.append(len(ids))
+                return super(Mock, self).delete_rows(model_class, ids)
+        result = Mock(self._db).run_once()
+        eq_("Items deleted: 3", result.achievements)
+        eq_([2, 1], commits)
+
+    def test_use_orm(self):
+        # Reapers that need more than a simple delete load each row
+        # and pass it into delete().
+        eq_(False, CredentialReaper.USE_ORM)
+        eq_(True, WorkReaper.USE_ORM)
+        eq_(True, CollectionReaper.USE_ORM)
+
+        expired = self._credential()
+        expired.expires = datetime.datetime.utcnow() - datetime.timedelta(
+            days=10
+        )
+        class Mock(CredentialReaper):
+            USE_ORM = True
+            deleted = []
+            def delete(self, row):
+                self.deleted.append(row)
+                super(Mock, self).delete(row)
+        result = Mock(self._db).run_once()
+        eq_("Items deleted: 1", result.achievements)
+        eq_([expired], Mock.deleted)
+
 
 class TestWorkReaper(DatabaseTest):
 
@@ -1246,6 +1472,19 @@ class TestScrubberMonitor(DatabaseTest):
         for untouched in (new, recent):
             eq_("loc", untouched.location)
 
+    def test_batches(self):
+        m = CirculationEventLocationScrubber(self._db)
+        m.BATCH_SIZE = 2
+        long_ago = m.cutoff - datetime.timedelta(days=1)
+        events = [
+            create(self._db, CirculationEvent, start=long_ago,
+                   location="loc")[0]
+            for i in range(5)
+        ]
+        timestamp = m.run_once()
+        eq_("Items scrubbed: 5", timestamp.achievements)
+        eq_([None] * 5, [x.location for x in events])
+
     def test_specific_scrubbers(self):
         # Check that all specific ScrubberMonitors are set up
         # correctly.
@@ -33,7 +33,10 @@ from ..entrypoint import (
     EntryPoint,
     EverythingEntryPoint,
 )
-from ..external_search import MockExternalSearchIndex
+from ..external_search import (
+    MockExternalSearchIndex,
+    WorkSearchResult,
+)
 from ..facets import FacetConstants
 from ..lane import (
     Facets,
@@ -43,6 +46,7 @@ from ..lane import (
     WorkList,
 )
 from ..lcp.credential import LCPCredentialFactory
+from ..testing import QueryCounter
 from ..model import (
     CachedFeed,
     Contributor,
@@ -1003,6 +1007,81 @@ class TestOPDS(DatabaseTest):
             eq_(lane.display_name, links[i+1].get("title"))
             eq_(TestAnnotator.lane_url(lane), links[i+1].get("href"))
 
+    def test_page_feed_splices_cached_entries(self):
+        # A paginated feed made with a real annotator has its works'
+        # cached entries spliced in, as-is, without being parsed.
+        lane = self.contemporary_romance
+        work1 = self._work(genre=Contemporary_Romance, with_open_access_download=True)
+        work2 = self._work(genre=Contemporary_Romance, with_open_access_download=True)
+
+        search_engine = MockExternalSearchIndex()
+        search_engine.bulk_update([work1, work2])
+
+        # Fill up the cache, then change one of the cached entries
+        # in a way that would be normalized away if it were parsed
+        # and serialized again.
+        AcquisitionFeed(
+            self._db, "test", self._url, [work1, work2], TestAnnotator
+        )
+        work1.simple_opds_entry = work1.simple_opds_entry.replace(
+            u"</entry>", u"<simplified:spliced  flag='yes'/></entry>"
+        )
+
+        response = AcquisitionFeed.page(
+            self._db, "test", self._url, lane, TestAnnotator,
+            search_engine=search_engine
+        )
+        feed = response.data.decode("utf8")
+        assert u"<simplified:spliced  flag='yes'/>" in feed
+        assert u"splice:" not in feed
+
+        # The spliced feed is still a good feed, and the entries are
+        # annotated as usual.
+        parsed = feedparser.parse(response.data)
+        eq_([work1.title, work2.title],
+            [x['title'] for x in parsed['entries']])
+        for entry, work in zip(parsed['entries'], [work1, work2]):
+            eq_(work.license_pools[0].identifier.urn, entry['id'])
+            eq_(work.license_pools[0].data_source.name,
+                entry['bibframe_distribution']['providername'])
+
+    def test_page_feed_streamed(self):
+        # A paginated feed can be sent to the client as it's
+        # generated, and cached once it's been sent.
+        lane = self.contemporary_romance
+        work1 = self._work(genre=Contemporary_Romance, with_open_access_download=True)
+        work2 = self._work(genre=Contemporary_Romance, with_open_access_download=True)
+
+        search_engine = MockExternalSearchIndex()
+        search_engine.bulk_update([work1, work2])
+
+        pagination = Pagination(size=1)
+        response = AcquisitionFeed.page(
+            self._db, "test", self._url, lane, TestAnnotator,
+            pagination=pagination, search_engine=search_engine,
+            stream=True
+        )
+        assert response.is_streamed
+        eq_([], self._db.query(CachedFeed).all())
+
+        parsed = feedparser.parse(response.data)
+        eq_(work1.title, parsed['entries'][0]['title'])
+        [next_link] = self.links(parsed, 'next')
+
+        # Now that the feed has been sent, it's in the cache.
+        [cached] = self._db.query(CachedFeed).all()
+        eq_(response.data.decode("utf8"), cached.content)
+
+        # The next time the feed is requested, it comes from the cache
+        # rather than being streamed.
+        response = AcquisitionFeed.page(
+            self._db, "test", self._url, lane, TestAnnotator,
+            pagination=pagination, search_engine=search_engine,
+            stream=True
+        )
+        eq_(False, response.is_streamed)
+        eq_(cached.content, response.data.decode("utf8"))
+
     def test_page_feed_for_worklist(self):
         # Test the ability to create a paginated feed of works for a
         # WorkList instead of a Lane.
@@ -1504,6 +1583,65 @@ class TestAcquisitionFeed(DatabaseTest):
         # This means the 'activeFacet' attribute is not present.
         assert '{http://opds-spec.org/2010/catalog}activeFacet' not in l
 
+    def test_facet_counts(self):
+        # If the number of works under each facet is known, it's
+        # added to the facet links as thr:count.
+        count = '{%s}count' % AtomFeed.THR_NS
+        facets = Facets(
+            self._default_library, Facets.COLLECTION_FULL,
+            Facets.AVAILABLE_ALL, Facets.ORDER_TITLE,
+            enabled_facets={
+                Facets.ORDER_FACET_GROUP_NAME : [
+                    Facets.ORDER_TITLE, Facets.ORDER_AUTHOR
+                ],
+                Facets.AVAILABILITY_FACET_GROUP_NAME : [
+                    Facets.AVAILABLE_ALL, Facets.AVAILABLE_NOW
+                ],
+                Facets.COLLECTION_FACET_GROUP_NAME : [],
+            }
+        )
+        facets.facet_counts = {
+            (Facets.AVAILABILITY_FACET_GROUP_NAME, Facets.AVAILABLE_NOW): 5,
+            (Facets.ENTRY_POINT_FACET_GROUP_NAME,
+             EbooksEntryPoint.INTERNAL_NAME): 7,
+        }
+
+        class MockAnnotator(object):
+            def facet_url(self, new_facets):
+                return "http://facet/"
+
+        links = dict(
+            ((x['{%s}facetGroup' % AtomFeed.OPDS_NS], x['title']), x)
+            for x in AcquisitionFeed.facet_links(MockAnnotator(), facets)
+        )
+        available_now = links[("Availability", "Available now")]
+        eq_("5", available_now[count])
+
+        # Facets that weren't counted, like sort orders, get no count.
+        assert count not in links[("Availability", "All")]
+        assert count not in links[("Sort by", "Title")]
+
+        # Entry point links work the same way.
+        feed = OPDSFeed("title", "url")
+        AcquisitionFeed.add_entrypoint_links(
+            feed, lambda ep: "http://ep/",
+            [AudiobooksEntryPoint, EbooksEntryPoint], EbooksEntryPoint,
+            facet_counts=facets.facet_counts
+        )
+        audiobooks, ebooks = [
+            x for x in feed.feed.findall('link')
+            if x.get('rel') == AcquisitionFeed.FACET_REL
+        ]
+        eq_(None, audiobooks.get(count))
+        eq_("7", ebooks.get(count))
+
+        # The thr namespace is declared only on the links that use it,
+        # so feeds and entries that don't use it aren't affected.
+        output = unicode(feed)
+        eq_(1, output.count('xmlns:thr="%s"' % AtomFeed.THR_NS))
+        assert 'thr:count="7"' in output
+        assert 'thr' not in AtomFeed.ENTRY_START_TAG
+
     def test_license_tags_no_loan_or_hold(self):
         edition, pool = self._edition(with_license_pool=True)
         availability, holds, copies = AcquisitionFeed.license_tags(
@@ -1803,6 +1941,205 @@ class TestAcquisitionFeed(DatabaseTest):
         )
         eq_(entry_string, etree.tounicode(full_entry))
 
+    def test_is_append_only(self):
+        # The annotators this repo ships only append to entries.
+        eq_(True, Annotator.is_append_only(Annotator))
+        eq_(True, Annotator.is_append_only(VerboseAnnotator))
+        eq_(True, Annotator.is_append_only(TestAnnotator()))
+
+        # A subclass that doesn't touch annotate_work_entry() keeps
+        # its superclass's promise.
+        eq_(True, Annotator.is_append_only(TestAnnotatorWithGroup))
+
+        # A subclass that overrides annotate_work_entry() doesn't,
+        # unless it makes the promise itself.
+        class Overrides(Annotator):
+            def annotate_work_entry(self, *args, **kwargs):
+                pass
+        eq_(False, Annotator.is_append_only(Overrides))
+
+        class Promises(Overrides):
+            append_only = True
+        eq_(True, Annotator.is_append_only(Promises))
+
+        class Declines(Annotator):
+            append_only = False
+        eq_(False, Annotator.is_append_only(Declines))
+
+    def test_splice_cached_entries(self):
+        # Cached entries can be spliced into a feed as strings,
+        # without being parsed, if the annotator promises to only
+        # append to them.
+        works = [
+            self._work(with_open_access_download=True) for i in range(3)
+        ]
+        # Fill up the cache.
+        AcquisitionFeed(
+            self._db, self._str, self._url, works, Annotator
+        )
+        for work in works:
+            assert work.simple_opds_entry is not None
+
+        # This work's entry was cached with an old set of namespaces,
+        # so it can't be spliced.
+        works[2].simple_opds_entry = "<entry><foo>bar</foo></entry>"
+
+        url = self._url
+        def make_feeds(annotator):
+            slow = AcquisitionFeed(
+                self._db, "title", url, works, annotator
+            )
+            fast = AcquisitionFeed(
+                self._db, "title", url, works, annotator,
+                splice_cached_entries=True
+            )
+            # Make sure the feeds weren't generated in different seconds.
+            fast.feed.find("updated").text = slow.feed.find("updated").text
+            return slow, fast
+
+        slow, fast = make_feeds(Annotator)
+        eq_(2, len(fast.spliced_entries))
+        eq_([], slow.spliced_entries)
+
+        # The spliced feed is the same as the unspliced one, except
+        # that the content of each spliced entry isn't indented.
+        fast_feed = unicode(fast)
+        slow_feed = unicode(slow)
+        assert "splice:" not in fast_feed
+        def normalize(feed):
+            return re.sub(r">\s+<", "><", feed)
+        eq_(normalize(slow_feed), normalize(fast_feed))
+
+        # Everything around the spliced content is pretty-printed the
+        # same way, so the entries start at the same indentation.
+        eq_(3, fast_feed.count(u"\n  <entry"))
+        eq_(slow_feed.split(u"\n  <entry")[0],
+            fast_feed.split(u"\n  <entry")[0])
+        assert fast_feed.endswith(u"</entry>\n</feed>\n")
+        assert 'schema:additionalType="http://schema.org/EBook"' in fast_feed
+
+        # An annotator that might look at what's already in an entry
+        # has its entries parsed, even if splicing is requested.
+        class ReadsEntries(Annotator):
+            def annotate_work_entry(self, *args, **kwargs):
+                super(ReadsEntries, self).annotate_work_entry(
+                    *args, **kwargs
+                )
+        slow, fast = make_feeds(ReadsEntries)
+        eq_([], fast.spliced_entries)
+        eq_(unicode(slow), unicode(fast))
+
+        # A single entry is never spliced.
+        entry = AcquisitionFeed.single_entry(
+            self._db, works[0], Annotator, raw=True
+        )
+        assert entry.find("{%s}title" % AtomFeed.ATOM_NS) is not None
+        eq_([], entry.xpath("comment()"))
+
+    def test_query_count_does_not_depend_on_number_of_works(self):
+        # Everything the annotator needs is loaded for all of a
+        # feed's works at once, so a big feed doesn't take more
+        # queries than a small one.
+        for i in range(6):
+            self._work(
+                authors=["Author %d" % i], genre="Science Fiction",
+                with_open_access_download=True
+            )
+        self._db.flush()
+
+        def queries_for_feed(how_many, use_cache):
+            self._db.flush()
+            self._db.expunge_all()
+            works = self._db.query(Work).order_by(Work.id).limit(
+                how_many
+            ).all()
+            if not use_cache:
+                for work in works:
+                    work.simple_opds_entry = None
+            with QueryCounter(self.connection) as counter:
+                AcquisitionFeed(
+                    self._db, "title", "url", works, Annotator
+                )
+            return counter.count
+
+        for use_cache in (False, True):
+            small = queries_for_feed(2, use_cache)
+            eq_(small, queries_for_feed(6, use_cache))
+
+        # With cached entries, there's less to load.
+        assert queries_for_feed(6, True) < queries_for_feed(6, False)
+
+    def test_preload(self):
+        # Lookup feeds and search results wrap their works in other
+        # objects, but the works can still be preloaded.
+        work = self._work(with_open_access_download=True)
+        search_result = WorkSearchResult(work, None)
+        feed = AcquisitionFeed(self._db, "title", "url", [], Annotator)
+        eq_(work, feed._work_for(search_result))
+        eq_(work, feed._work_for(work))
+
+        lookup = LookupAcquisitionFeed(
+            self._db, "title", "url", [], Annotator
+        )
+        eq_(work, lookup._work_for((work.license_pools[0].identifier, work)))
+
+        class Mock(AcquisitionFeed):
+            def _work_for(self, item):
+                self.called_with.append(item)
+                return item
+        mock = Mock(self._db, "title", "url", [], Annotator)
+
+        # Nothing happens if the list of works is really a query,
+        # since it can only be run through once.
+        mock.called_with = []
+        mock.preload(self._db, self._db.query(Work))
+        eq_([], mock.called_with)
+
+        mock.preload(self._db, [work, None])
+        eq_([work, None], mock.called_with)
+
+    def test_stream_works(self):
+        works = [
+            self._work(with_open_access_download=True) for i in range(2)
+        ]
+        works.append(self._work())
+        message = OPDSMessage("urn", 404, "Not found")
+        # Fill up the cache.
+        AcquisitionFeed(
+            self._db, self._str, self._url, works, Annotator
+        )
+
+        url = self._url
+        feed = AcquisitionFeed(
+            self._db, "title", url, works, Annotator,
+            precomposed_entries=[message]
+        )
+        streaming = AcquisitionFeed(
+            self._db, "title", url, [], Annotator,
+            splice_cached_entries=True
+        )
+        streaming.feed.find("updated").text = feed.feed.find("updated").text
+        chunks = streaming.stream_works(works, [message])
+
+        # Nothing is generated until the chunks are asked for.
+        eq_([], streaming.spliced_entries)
+        chunks = list(chunks)
+
+        # The feed header, an entry for each work (the third one is
+        # a message because the work has no license pool), the
+        # precomposed entry, and the footer.
+        eq_(6, len(chunks))
+        eq_(u"</feed>", chunks[-1])
+        assert chunks[1].startswith(u'<entry schema:additionalType=')
+        assert u"<simplified:message>" in chunks[3]
+
+        # Put together, the chunks make the same feed that would have
+        # been generated all at once.
+        eq_(etree.tounicode(feed.feed), u"".join(chunks))
+
+        # The spliced entries were let go once they were sent.
+        eq_([None, None], streaming.spliced_entries)
+
     def test_exception_during_entry_creation_is_not_reraised(self):
         # This feed will raise an exception whenever it's asked
         # to create an entry.
@@ -2371,8 +2708,9 @@ class TestEntrypointLinkInsertion(DatabaseTest):
 
         # Mock for AcquisitionFeed.add_entrypoint_links
         class Mock(object):
-            def add_entrypoint_links(self, *args):
+            def add_entrypoint_links(self, *args, **kwargs):
                 self.called_with = args
+                self.called_with_kwargs = kwargs
         self.mock = Mock()
 
         # A WorkList with no EntryPoints -- should not call the mock method.
@@ -1,4 +1,5 @@
 import datetime
+import multiprocessing
 import os
 import random
 import shutil
@@ -20,7 +21,11 @@ from ..classifier import Classifier
 from ..config import (
     CannotLoadConfiguration,
 )
-from ..external_search import MockExternalSearchIndex
+from ..entrypoint import EntryPoint
+from ..external_search import (
+    MockExternalSearchIndex,
+    mock_search_index,
+)
 from ..lane import (
     Lane,
     WorkList,
@@ -84,6 +89,7 @@ from ..scripts import (
     RunMonitorScript,
     RunMultipleMonitorsScript,
     RunReaperMonitorsScript,
+    RunMultiprocessCoverageProviderScript,
     RunThreadedCollectionCoverageProviderScript,
     RunWorkCoverageProviderScript,
     Script,
@@ -741,6 +747,111 @@ class TestRunThreadedCollectionCoverageProviderScript(DatabaseTest):
         assert new_timestamp > original_timestamp
 
 
+class MockProcessPool(object):
+    """Runs each job as soon as it's put in, in this process and with
+    the test's database session.
+    """
+
+    def __init__(self, _db, broken=False):
+        self._db = _db
+        self.broken = broken
+        self.jobs = []
+        self.results = []
+        self.job_total = 0
+        self.error_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    def put(self, job):
+        self.job_total += 1
+        self.jobs.append(job)
+        if self.broken:
+            self.error_count += 1
+        else:
+            self.results.append(job.run(self._db))
+
+
+class TestRunMultiprocessCoverageProviderScript(DatabaseTest):
+
+    def test_constructor(self):
+        script = RunMultiprocessCoverageProviderScript(
+            AlwaysSuccessfulWorkCoverageProvider, _db=self._db,
+            batch_size=123
+        )
+        # By default there's one worker process per CPU.
+        eq_(multiprocessing.cpu_count(), script.worker_size)
+        eq_(dict(batch_size=123), script.provider_kwargs)
+
+        [(collection_id, provider)] = list(script.providers())
+        eq_(None, collection_id)
+        eq_(123, provider.batch_size)
+
+    def test_run(self):
+        provider_class = AlwaysSuccessfulCollectionCoverageProvider
+        collection = self._collection()
+        identifiers = []
+        for i in range(3):
+            edition, lp = self._edition(
+                collection=collection, with_license_pool=True
+            )
+            identifiers.append(edition.primary_identifier)
+        identifiers.sort(key=lambda x: x.id)
+
+        script = RunMultiprocessCoverageProviderScript(
+            provider_class, worker_size=1, _db=self._db
+        )
+        pool = MockProcessPool(self._db)
+        script.run(pool=pool)
+
+        # The provider's Collections are the default collection and
+        # the new one. Nothing in the default collection needs
+        # coverage, so each identifier in the new collection was
+        # given its own range of IDs.
+        eq_(3, pool.job_total)
+        eq_([collection.id] * 3, [job.collection_id for job in pool.jobs])
+        eq_([(None, identifiers[1].id-1),
+             (identifiers[1].id, identifiers[2].id-1),
+             (identifiers[2].id, None)],
+            [(job.min_id, job.max_id) for job in pool.jobs])
+
+        source = DataSource.lookup(self._db, provider_class.DATA_SOURCE_NAME)
+        for identifier in identifiers:
+            record = CoverageRecord.lookup(identifier, source)
+            eq_(CoverageRecord.SUCCESS, record.status)
+
+        # The results of all the jobs were combined into the
+        # provider's Timestamp.
+        timestamp = Timestamp.lookup(
+            self._db, provider_class.SERVICE_NAME,
+            Timestamp.COVERAGE_PROVIDER_TYPE, collection
+        )
+        eq_("Items processed: 3. Successes: 3, transient failures: 0, persistent failures: 0",
+            timestamp.achievements)
+        eq_(None, timestamp.exception)
+
+    def test_run_records_failed_jobs(self):
+        provider_class = AlwaysSuccessfulWorkCoverageProvider
+        self._work()
+        self._work()
+        script = RunMultiprocessCoverageProviderScript(
+            provider_class, worker_size=1, _db=self._db
+        )
+        pool = MockProcessPool(self._db, broken=True)
+        script.run(pool=pool)
+
+        # The failed jobs are noted in the Timestamp.
+        eq_(2, pool.job_total)
+        timestamp = Timestamp.lookup(
+            self._db, provider_class.SERVICE_NAME,
+            Timestamp.COVERAGE_PROVIDER_TYPE, None
+        )
+        eq_("2 of 2 ID ranges could not be covered.", timestamp.exception)
+
+
 class TestRunWorkCoverageProviderScript(DatabaseTest):
 
     def test_constructor(self):
@@ -2873,11 +2984,18 @@ class TestRebuildSearchIndexScript(DatabaseTest):
             wcr.operation==wcr.UPDATE_SEARCH_INDEX_OPERATION
         )
         original_coverage = [x.id for x in coverage_qu]
+        work.search_document_fingerprint = "an old fingerprint"
+        self._db.flush()
 
         # Run the script.
         script = RebuildSearchIndexScript(self._db, search_index_client=index)
         [progress] = script.do_run()
 
+        # The fingerprint of the old search document was cleared, so
+        # the document will definitely be uploaded to the new index.
+        self._db.refresh(work)
+        eq_(None, work.search_document_fingerprint)
+
         # The mock methods were called with the values we expect.
         eq_(True, index.setup_index_called)
         eq_(set([work, work2]), set(index.bulk_update_called_with))
@@ -2897,6 +3015,60 @@ class TestRebuildSearchIndexScript(DatabaseTest):
         eq_(2, len(new_coverage))
         assert set(new_coverage) != set(original_coverage)
 
+    def test_do_run_streamed(self):
+        # With --streamed, the works' search documents are streamed
+        # out of the database and uploaded without the works ever
+        # being loaded.
+        class MockSearchIndex(MockExternalSearchIndex):
+            def setup_index(self):
+                self.setup_index_called = True
+
+            def bulk_update(self, works):
+                raise Exception("The works should not be loaded.")
+
+        index = MockSearchIndex()
+        work = self._work(with_license_pool=True)
+        work2 = self._work(with_license_pool=True)
+        script = RebuildSearchIndexScript(
+            self._db, search_index_client=index, cmd_args=['--streamed']
+        )
+        [progress] = script.do_run()
+        eq_(True, index.setup_index_called)
+        eq_(set([work.id, work2.id]),
+            set(doc['_id'] for doc in index.docs.values()))
+        eq_(
+            'Items processed: 2. Successes: 2, transient failures: 0, persistent failures: 0',
+            progress.achievements
+        )
+
+    def test_streamed(self):
+        # By default, the works are loaded and their search documents
+        # created the same way as in a normal run.
+        index = MockExternalSearchIndex()
+        script = RebuildSearchIndexScript(
+            self._db, search_index_client=index, cmd_args=[]
+        )
+        [provider] = script.providers
+        eq_(False, provider.streamed)
+        eq_(None, provider.uploaders)
+
+        # Streaming has to be asked for.
+        script = RebuildSearchIndexScript(
+            self._db, search_index_client=index, cmd_args=['--streamed']
+        )
+        [provider] = script.providers
+        eq_(True, provider.streamed)
+
+        # If uploaders are specified, a SearchIndexPipeline is used
+        # instead.
+        script = RebuildSearchIndexScript(
+            self._db, search_index_client=index, uploaders=2,
+            cmd_args=['--streamed']
+        )
+        [provider] = script.providers
+        eq_(False, provider.streamed)
+        eq_(2, provider.uploaders)
+
 
 class TestSearchIndexCoverageRemover(DatabaseTest):
 
@@ -2914,15 +3086,20 @@ class TestSearchIndexCoverageRemover(DatabaseTest):
                 wcr.add_for(
                     w, operation, status=random.choice(wcr.ALL_STATUSES)
                 )
+        wcr.add_for(
+            work, wcr.UPDATE_SEARCH_INDEX_LICENSEPOOLS_OPERATION,
+            status=wcr.REGISTERED
+        )
 
         # Run the script.
         script = SearchIndexCoverageRemover(self._db)
         result = script.do_run()
         assert isinstance(result, TimestampData)
-        eq_("Coverage records deleted: 2", result.achievements)
+        eq_("Coverage records deleted: 3", result.achievements)
 
-        # UPDATE_SEARCH_INDEX_OPERATION records have been removed.
-        # No other records are affected.
+        # UPDATE_SEARCH_INDEX_OPERATION and
+        # UPDATE_SEARCH_INDEX_LICENSEPOOLS_OPERATION records have been
+        # removed. No other records are affected.
         for w in (work, work2):
             remaining = [x.operation for x in w.coverage_records]
             eq_(sorted(remaining), sorted(decoys))
@@ -2936,6 +3113,31 @@ class TestUpdateLaneSizeScript(DatabaseTest):
         UpdateLaneSizeScript(self._db).do_run(cmd_args=[])
         eq_(0, lane.size)
 
+    def test_process_library(self):
+        # All of a library's lanes are sized with a single call to
+        # Lane.update_sizes.
+        parent = self._lane()
+        child = self._lane(parent=parent)
+        other_library = self._lane(library=self._library())
+        other_library.size = 55
+
+        class Mock(MockExternalSearchIndex):
+            calls = []
+            def count_works_multi(self, filters):
+                self.calls.append(filters)
+                return [7] * len(filters)
+
+        search = Mock()
+        with mock_search_index(search):
+            UpdateLaneSizeScript(self._db).process_library(
+                self._default_library
+            )
+        [filters] = search.calls
+        eq_(2 * len(EntryPoint.ENTRY_POINTS), len(filters))
+        eq_(7, parent.size)
+        eq_(7, child.size)
+        eq_(55, other_library.size)
+
     def test_should_process_lane(self):
         """Only Lane objects can have their size updated."""
         lane = self._lane()
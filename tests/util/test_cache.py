@@ -0,0 +1,196 @@
+from nose.tools import (
+    assert_raises_regexp,
+    eq_,
+    set_trace,
+)
+import threading
+
+from ...util.cache import (
+    LRUCache,
+    SingleFlight,
+)
+
+
+class MockClock(object):
+    """A clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(object):
+
+    def test_constructor(self):
+        assert_raises_regexp(
+            ValueError, "must be able to hold at least one item",
+            LRUCache, 0
+        )
+
+    def test_get_and_set(self):
+        cache = LRUCache(2)
+        eq_(None, cache.get("a"))
+        eq_("default", cache.get("a", "default"))
+        eq_(2, cache.misses)
+
+        cache.set("a", 1)
+        cache["b"] = 2
+        eq_(1, cache.get("a"))
+        eq_(2, cache.get("b"))
+        eq_(2, cache.hits)
+        assert "a" in cache
+        assert "c" not in cache
+        eq_(2, len(cache))
+
+    def test_least_recently_used_item_is_evicted(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        # Looking up "a" makes "b" the least recently used item.
+        cache.get("a")
+        cache.set("c", 3)
+        eq_(["a", "c"], cache.keys())
+        eq_(1, cache.evictions)
+
+        # Overwriting an item doesn't evict anything.
+        cache.set("a", 4)
+        eq_(["c", "a"], cache.keys())
+        eq_(1, cache.evictions)
+        eq_(4, cache.get("a"))
+
+    def test_max_age(self):
+        clock = MockClock()
+        cache = LRUCache(10, max_age=60, clock=clock)
+        cache.set("a", 1)
+        clock.now += 59
+        eq_(1, cache.get("a"))
+
+        clock.now += 1
+        assert "a" not in cache
+        eq_(None, cache.get("a"))
+        eq_(1, cache.expirations)
+
+        # The expired item is gone for good.
+        eq_([], cache.keys())
+
+    def test_is_valid(self):
+        cache = LRUCache(10)
+        cache.set("a", 1)
+        eq_(1, cache.get("a", is_valid=lambda x: x == 1))
+
+        # An item that fails the test is removed and counts as a miss.
+        eq_("nope", cache.get("a", "nope", is_valid=lambda x: x == 2))
+        eq_(1, cache.hits)
+        eq_(1, cache.misses)
+        eq_(1, cache.expirations)
+        eq_([], cache.keys())
+
+    def test_remove(self):
+        cache = LRUCache(10)
+        for key in (1, 2, 3, 4):
+            cache.set(key, "value")
+        eq_(True, cache.remove(1))
+        eq_(False, cache.remove(1))
+
+        eq_(2, cache.remove_where(lambda key: key % 2 == 0))
+        eq_([3], cache.keys())
+
+        cache.clear()
+        eq_(0, len(cache))
+
+    def test_stats(self):
+        cache = LRUCache(1)
+        eq_(0, cache.hit_rate)
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("b")
+        cache.set("b", 2)
+        eq_(
+            dict(size=1, max_size=1, hits=1, misses=1, evictions=1,
+                 expirations=0, hit_rate=0.5),
+            cache.stats
+        )
+
+        cache.reset_stats()
+        eq_(0, cache.hits)
+        eq_(0, cache.evictions)
+
+
+class TestSingleFlight(object):
+
+    def test_concurrent_calls_are_coalesced(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return "result"
+
+        results = []
+        def call():
+            results.append(flight.run("key", slow))
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait()
+        eq_(True, flight.in_progress("key"))
+        eq_(False, flight.in_progress("other key"))
+
+        followers = [threading.Thread(target=call) for i in range(3)]
+        for t in followers:
+            t.start()
+
+        # Wait until all three followers are waiting on the leader.
+        while flight.followers < 3:
+            pass
+        release.set()
+        for t in [leader] + followers:
+            t.join()
+
+        # The function was only called once, but everyone got the result.
+        eq_(1, len(calls))
+        eq_(["result"] * 4, results)
+        eq_(1, flight.leaders)
+        eq_(3, flight.followers)
+        eq_(False, flight.in_progress("key"))
+
+        # Once the work is done, the next call does the work again.
+        release.set()
+        eq_("result", flight.run("key", slow))
+        eq_(2, len(calls))
+
+    def test_exception(self):
+        flight = SingleFlight()
+        def broken():
+            raise ValueError("oops")
+        assert_raises_regexp(ValueError, "oops", flight.run, "key", broken)
+
+        # The failed call doesn't stick around.
+        eq_(False, flight.in_progress("key"))
+
+    def test_timeout(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        def slow():
+            started.set()
+            release.wait()
+            return "leader's"
+        leader = threading.Thread(target=flight.run, args=("key", slow))
+        leader.start()
+        started.wait()
+
+        # If the leader takes too long, a follower does the work itself.
+        eq_("mine", flight.run("key", lambda: "mine", timeout=0.01))
+
+        # If the leader finishes in time, its result is used.
+        threading.Timer(0.01, release.set).start()
+        eq_("leader's", flight.run("key", lambda: "mine", timeout=5))
+        leader.join()
@@ -6,14 +6,25 @@ from nose.tools import (
     set_trace,
 )
 import datetime
+import flask
 import time
-from flask import Response as FlaskResponse
+from flask import (
+    Flask,
+    Response as FlaskResponse,
+)
 from wsgiref.handlers import format_date_time
 from ...util.flask_util import (
     OPDSEntryResponse,
     OPDSFeedResponse,
     Response,
+    client_accepts_gzip,
+    client_has_current_version,
+    gzip_compress,
+    gzip_decompress,
+    gzip_stream,
+    is_conditional_request,
 )
+from werkzeug.http import http_date
 from ...util.opds_writer import OPDSFeed
 
 class TestResponse(object):
@@ -87,6 +98,116 @@ class TestResponse(object):
         obj = Response(u"some data")
         eq_(u"some data", unicode(obj))
 
+    def test_compressed_response(self):
+        # A Response can be given a precompressed version of its
+        # entity-body, to be used if the client accepts gzip.
+        compressed = gzip_compress(u"some data")
+        app = Flask(__name__)
+
+        # Outside of a request, nothing is known about the client, so
+        # the uncompressed version is used.
+        response = Response(u"some data", compressed_response=compressed)
+        eq_("some data", response.data)
+        eq_("Accept-Encoding", response.headers['Vary'])
+
+        with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+            response = Response(u"some data", compressed_response=compressed)
+            eq_(compressed, response.data)
+            eq_("gzip", response.headers['Content-Encoding'])
+
+        # If there's only a compressed version and the client doesn't
+        # accept gzip, the data is decompressed.
+        with app.test_request_context(headers={"Accept-Encoding": "br"}):
+            response = Response(compressed_response=compressed)
+            eq_("some data", response.data)
+            assert 'Content-Encoding' not in response.headers
+
+        # A Vary header that was already set is added to, not replaced.
+        response = Response(
+            u"some data", compressed_response=compressed,
+            headers={"Vary": "Accept-Language"}
+        )
+        eq_("Accept-Language, Accept-Encoding", response.headers['Vary'])
+        for already in ("accept-encoding", "Cookie, Accept-Encoding", "*"):
+            response = Response(
+                u"some data", compressed_response=compressed,
+                headers={"vary": already}
+            )
+            eq_(already, response.headers['Vary'])
+
+    def test_streamed_response(self):
+        # A Response can be made from a generator, in which case the
+        # entity-body is sent as it's generated.
+        def body():
+            yield u"some "
+            yield u"data"
+        response = Response(body())
+        assert response.is_streamed
+        eq_("some data", response.data)
+
+        # Within a request, the generator is wrapped so the request
+        # is kept around until the generator is exhausted.
+        app = Flask(__name__)
+        def needs_request():
+            yield flask.request.path
+        with app.test_request_context("/a-path"):
+            response = Response(needs_request())
+        eq_("/a-path", response.data)
+
+
+class TestGzip(object):
+
+    def test_compress_and_decompress(self):
+        compressed = gzip_compress(u"caf\xe9")
+        eq_(u"caf\xe9".encode("utf8"), gzip_decompress(compressed))
+        eq_(b"bytes", gzip_decompress(gzip_compress(b"bytes")))
+
+    def test_gzip_stream(self):
+        chunks = list(gzip_stream([u"caf\xe9", b" ", b"au lait"]))
+        eq_(u"caf\xe9 au lait".encode("utf8"), gzip_decompress(b"".join(chunks)))
+
+    def test_client_accepts_gzip(self):
+        eq_(False, client_accepts_gzip())
+        app = Flask(__name__)
+        with app.test_request_context(headers={"Accept-Encoding": "GZIP, br"}):
+            eq_(True, client_accepts_gzip())
+        with app.test_request_context():
+            eq_(False, client_accepts_gzip())
+
+
+class TestConditionalRequest(object):
+
+    def test_client_has_current_version(self):
+        app = Flask(__name__)
+        m = client_has_current_version
+        now = datetime.datetime.utcnow()
+        earlier = now - datetime.timedelta(minutes=1)
+
+        # Outside of a request, or in an unconditional request, the
+        # client is assumed not to have any version of the document.
+        eq_(False, is_conditional_request())
+        eq_(False, m("etag", now))
+        with app.test_request_context():
+            eq_(False, is_conditional_request())
+            eq_(False, m("etag", now))
+
+        with app.test_request_context(headers={"If-None-Match": '"etag"'}):
+            eq_(True, is_conditional_request())
+            eq_(True, m("etag", now))
+            eq_(False, m("other", now))
+
+        with app.test_request_context(headers={"If-None-Match": '*'}):
+            eq_(True, m("etag", now))
+
+        with app.test_request_context(
+            headers={"If-Modified-Since": http_date(now)}
+        ):
+            eq_(True, is_conditional_request())
+            eq_(True, m("etag", now))
+            eq_(True, m("etag", earlier))
+            eq_(False, m("etag", now + datetime.timedelta(seconds=1)))
+            eq_(False, m("etag", None))
+
 
 class TestOPDSFeedResponse(object):
     """Test the OPDS feed-specific specialization of Response."""
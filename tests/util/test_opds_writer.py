@@ -63,3 +63,41 @@ class TestAtomFeed(object):
         assert tag.startswith('<author')
         assert 'xmlns:opf="http://www.idpf.org/2007/opf"' in tag
         assert tag.endswith('opf:role="ctb"/>')
+
+    def test_stream(self):
+        feed = AtomFeed("A feed", "http://url/")
+        entries = [
+            AtomFeed.entry(AtomFeed.title("An entry")),
+            None,
+            u"<entry>Already a string</entry>",
+            OPDSMessage("urn", 200, "message").tag,
+        ]
+        chunks = list(feed.stream(entries))
+
+        # First comes everything that was already in the feed.
+        header = chunks.pop(0)
+        assert header.startswith('<feed xmlns:')
+        assert '<title>A feed</title>' in header
+        assert not header.endswith('</feed>')
+
+        # Then the entries, without the namespace declarations the
+        # feed has already made. None is ignored.
+        eq_(
+            [u"<entry><title>An entry</title></entry>",
+             u"<entry>Already a string</entry>"],
+            chunks[:2]
+        )
+        assert chunks[2].startswith(u"<simplified:message><id>urn</id>")
+
+        # Then the footer.
+        eq_(u"</feed>", chunks[3])
+
+        # It all adds up to a valid feed.
+        parsed = etree.fromstring(u"".join([header] + chunks))
+        eq_(2, len(parsed.findall("{%s}entry" % AtomFeed.ATOM_NS)))
+
+    def test_element_to_unicode(self):
+        # An element that declares different namespaces from the
+        # feed keeps its declarations.
+        element = etree.Element("{http://foo/}bar", nsmap={None: "http://foo/"})
+        eq_(u'<bar xmlns="http://foo/"/>', AtomFeed.element_to_unicode(element))
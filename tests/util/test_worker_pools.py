@@ -1,3 +1,4 @@
+import os
 import threading
 from contextlib import contextmanager
 
@@ -13,9 +14,11 @@ from ...model import (
 from ...util.worker_pools import (
     DatabaseJob,
     DatabasePool,
+    DatabaseProcessPool,
     DatabaseWorker,
     Job,
     Pool,
+    ProcessPool,
     Queue,
     Worker,
 )
@@ -85,6 +88,29 @@ class TestPool(object):
         eq_(1/3.0, pool.success_rate)
 
 
+    def test_max_queue_size(self):
+        started = threading.Event()
+        release = threading.Event()
+        def blocking_task():
+            started.set()
+            release.wait()
+
+        pool = Pool(1, max_queue_size=1)
+        try:
+            # The worker picks up the first job and the second job
+            # waits in the queue.
+            pool.put(blocking_task)
+            started.wait()
+            pool.put(blocking_task)
+
+            # There's no room for a third job.
+            eq_(True, pool.jobs.full())
+        finally:
+            release.set()
+            pool.join()
+        eq_(0, pool.error_count)
+
+
 class TestDatabasePool(DatabaseTest):
 
     def test_workers_are_created_with_sessions(self):
@@ -99,6 +125,68 @@ class TestDatabasePool(DatabaseTest):
             pool.join()
 
 
+# Jobs for a ProcessPool are pickled, so they're defined at module level.
+
+def process_id():
+    return os.getpid()
+
+def broken_process_task():
+    raise RuntimeError("Wakanda forever")
+
+class DatabaseProcessJob(DatabaseJob):
+    def do_run(self, _db):
+        return _db.execute("SELECT 1").scalar()
+
+
+class TestProcessPool(object):
+
+    def test_jobs_run_in_other_processes(self):
+        with ProcessPool(2) as pool:
+            for i in range(4):
+                pool.put(process_id)
+            eq_(4, pool.job_total)
+
+        # Each job's return value was collected once the pool was
+        # joined, and none of the jobs ran in this process.
+        eq_(4, len(pool.results))
+        assert os.getpid() not in pool.results
+        eq_(0, pool.error_count)
+
+    def test_pool_tracks_error_count(self):
+        pool = ProcessPool(2)
+        try:
+            pool.put(broken_process_task)
+            pool.put(process_id)
+        finally:
+            pool.join()
+
+        # The failed job counts as an error and has no result.
+        eq_(1, pool.error_count)
+        eq_(1, len(pool.results))
+        eq_(0.5, pool.success_rate)
+
+    def test_pool_can_be_reused_after_join(self):
+        pool = ProcessPool(1)
+        pool.put(process_id)
+        pool.join()
+        eq_(None, pool.processes)
+
+        with pool:
+            pool.put(process_id)
+        eq_(2, len(pool.results))
+
+
+class TestDatabaseProcessPool(object):
+
+    def test_jobs_are_run_with_sessions(self):
+        # Each worker process connects to the database on its own,
+        # and the job is run with that session.
+        with DatabaseProcessPool(2) as pool:
+            pool.put(DatabaseProcessJob())
+        eq_([1], pool.results)
+        eq_(0, pool.error_count)
+
+
 class MockQueue(Queue):
     error_count = 0
 
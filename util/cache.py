@@ -0,0 +1,216 @@
+"""Bounded in-process caches, and tools for avoiding duplicate work."""
+from collections import OrderedDict
+from nose.tools import set_trace
+from threading import (
+    Event,
+    Lock,
+    RLock,
+)
+import time
+
+
+class LRUCache(object):
+    """A dictionary-like cache that holds at most `max_size` items,
+    discarding the least recently used item when it gets full.
+
+    Items may optionally expire after `max_age` seconds. The cache
+    keeps counts of hits, misses and evictions so that callers can
+    judge whether it's pulling its weight.
+    """
+
+    def __init__(self, max_size=1000, max_age=None, clock=time.time):
+        """Constructor.
+
+        :param max_size: The maximum number of items to keep.
+        :param max_age: If this is set, an item older than this many
+            seconds is treated as missing.
+        :param clock: A function that returns the current time in
+            seconds. Only used in tests.
+        """
+        if max_size < 1:
+            raise ValueError("An LRUCache must be able to hold at least one item.")
+        self.max_size = max_size
+        self.max_age = max_age
+        self.clock = clock
+        self._lock = RLock()
+        self._data = OrderedDict()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Reset the hit, miss, eviction and expiration counts."""
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def hit_rate(self):
+        """What proportion of lookups found a usable item?"""
+        total = self.hits + self.misses
+        if not total:
+            return 0.0
+        return self.hits / float(total)
+
+    @property
+    def stats(self):
+        """A dictionary summarizing the performance of the cache,
+        suitable for logging or for a JSON status document.
+        """
+        with self._lock:
+            return dict(
+                size=len(self._data), max_size=self.max_size,
+                hits=self.hits, misses=self.misses,
+                evictions=self.evictions, expirations=self.expirations,
+                hit_rate=self.hit_rate,
+            )
+
+    def get(self, key, default=None, is_valid=None):
+        """Look up an item, marking it as recently used.
+
+        :param is_valid: An optional function that takes the cached
+            value and returns False if it should no longer be used. An
+            invalid item is removed from the cache and counts as a miss.
+        :return: The cached value, or `default` if there is none.
+        """
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            stored_at, value = self._data.pop(key)
+            if self._expired(stored_at) or (
+                is_valid is not None and not is_valid(value)
+            ):
+                self.expirations += 1
+                self.misses += 1
+                return default
+            # Reinsert the item so it becomes the most recently used.
+            self._data[key] = (stored_at, value)
+            self.hits += 1
+            return value
+
+    def __contains__(self, key):
+        with self._lock:
+            if key not in self._data:
+                return False
+            stored_at, value = self._data[key]
+            return not self._expired(stored_at)
+
+    def __len__(self):
+        return len(self._data)
+
+    def set(self, key, value):
+        """Store an item, evicting the least recently used item if
+        the cache is full.
+        """
+        with self._lock:
+            if key in self._data:
+                del self._data[key]
+            self._data[key] = (self.clock(), value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    __setitem__ = set
+
+    def remove(self, key):
+        """Remove an item from the cache, if it's present.
+
+        :return: True if an item was removed; False otherwise.
+        """
+        with self._lock:
+            if key in self._data:
+                del self._data[key]
+                return True
+            return False
+
+    def remove_where(self, condition):
+        """Remove every item whose key meets `condition`.
+
+        :param condition: A function that takes a key and returns a boolean.
+        :return: The number of items removed.
+        """
+        with self._lock:
+            doomed = [key for key in self._data if condition(key)]
+            for key in doomed:
+                del self._data[key]
+            return len(doomed)
+
+    def keys(self):
+        """List the keys currently in the cache, least recently used first."""
+        with self._lock:
+            return list(self._data.keys())
+
+    def clear(self):
+        """Remove every item from the cache. The statistics are kept."""
+        with self._lock:
+            self._data.clear()
+
+    def _expired(self, stored_at):
+        return (
+            self.max_age is not None
+            and stored_at + self.max_age <= self.clock()
+        )
+
+
+class SingleFlight(object):
+    """Make sure that when several threads want to do the same piece
+    of work at once, only one of them does it.
+
+    The first thread to call run() for a given key (the 'leader') runs
+    the function. Any thread that calls run() with the same key while
+    the leader is working waits for the leader to finish, and gets the
+    leader's result (or exception) instead of doing the work itself.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+
+    class _Call(object):
+        def __init__(self):
+            self.done = Event()
+            self.result = None
+            self.exception = None
+
+    def in_progress(self, key):
+        """Is some thread currently doing the work for `key`?"""
+        with self._lock:
+            return key in self._calls
+
+    def run(self, key, function, timeout=None):
+        """Run `function`, unless another thread is already running
+        the function for `key`, in which case wait for its result.
+
+        :param timeout: Wait this many seconds for another thread to
+            finish. If it hasn't finished by then, give up waiting and
+            run `function` in this thread.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = self._Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not is_leader:
+            if call.done.wait(timeout) or call.done.is_set():
+                if call.exception is not None:
+                    raise call.exception
+                return call.result
+            # The leader is taking too long; do the work ourselves.
+            return function()
+
+        try:
+            call.result = function()
+            return call.result
+        except Exception, e:
+            call.exception = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
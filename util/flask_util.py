@@ -1,17 +1,100 @@
 """Utilities for Flask applications."""
+from collections import Iterator
 import datetime
 import flask
+import gzip
+from io import BytesIO
 from lxml import etree
 from nose.tools import set_trace
 from flask import Response as FlaskResponse
 from wsgiref.handlers import format_date_time
 import time
+import zlib
 
 from . import (
     problem_detail,
 )
 from opds_writer import OPDSFeed
 
+def gzip_compress(data):
+    """Compress a string with gzip.
+
+    :param data: A bytestring or a Unicode string. A Unicode string
+        will be encoded as UTF-8.
+    :return: A bytestring.
+    """
+    if isinstance(data, unicode):
+        data = data.encode("utf8")
+    buffer = BytesIO()
+    gzipped = gzip.GzipFile(mode='wb', fileobj=buffer)
+    gzipped.write(data)
+    gzipped.close()
+    return buffer.getvalue()
+
+def gzip_decompress(data):
+    """Decompress a gzipped bytestring.
+
+    :return: A bytestring.
+    """
+    return gzip.GzipFile(mode='rb', fileobj=BytesIO(data)).read()
+
+def gzip_stream(chunks):
+    """Compress a sequence of strings with gzip, a piece at a time.
+
+    :param chunks: An iterable of bytestrings or Unicode strings.
+        Unicode strings will be encoded as UTF-8.
+    :yield: Bytestrings which, put together, make up a gzip file.
+    """
+    # A window size of 16+MAX_WBITS makes zlib write a gzip header
+    # and trailer.
+    compressor = zlib.compressobj(
+        zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+    )
+    for chunk in chunks:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode("utf8")
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def client_accepts_gzip():
+    """Has the client making the current request announced that it
+    can handle a gzipped entity-body?
+    """
+    if not flask.has_request_context():
+        return False
+    accept_encoding = flask.request.headers.get('Accept-Encoding', '')
+    return 'gzip' in accept_encoding.lower()
+
+def is_conditional_request():
+    """Did the client making the current request send If-None-Match
+    or If-Modified-Since?
+    """
+    if not flask.has_request_context():
+        return False
+    request = flask.request
+    return bool(request.if_none_match or request.if_modified_since)
+
+def client_has_current_version(etag, last_modified):
+    """Does the client making the current request already have the
+    current version of a document, according to the validators it sent?
+
+    :param etag: The current ETag of the document, without quotes.
+    :param last_modified: A naive UTC datetime: the time the current
+        version of the document was created.
+    """
+    if not is_conditional_request():
+        return False
+    request = flask.request
+    if request.if_none_match:
+        # If-None-Match takes precedence over If-Modified-Since.
+        return bool(etag) and request.if_none_match.contains_weak(etag)
+    if last_modified is None:
+        return False
+    # HTTP dates only have a resolution of one second.
+    return last_modified.replace(microsecond=0) <= request.if_modified_since
+
 def problem_raw(type, status, title, detail=None, instance=None, headers={}):
     data = problem_detail.json(type, status, title, detail, instance)
     final_headers = { "Content-Type" : problem_detail.JSON_MEDIA_TYPE }
@@ -37,7 +120,7 @@ class Response(FlaskResponse):
 
     def __init__(self, response=None, status=None, headers=None, mimetype=None,
                  content_type=None, direct_passthrough=False, max_age=0,
-                 private=None):
+                 private=None, compressed_response=None):
         """Constructor.
 
         All parameters are the same as for the Flask/Werkzeug Response class,
@@ -49,6 +132,13 @@ class Response(FlaskResponse):
         :param private: If this is True, then the response contains
             information from an authenticated client and should not be stored
             in intermediate caches.
+        :param compressed_response: A gzipped version of `response`.
+            If the client accepts gzip, this will be sent as-is instead
+            of compressing `response` all over again.
+
+        `response` may also be a generator of strings, in which case
+        the response will be streamed to the client as the strings
+        are generated.
         """
         max_age = max_age or 0
         try:
@@ -65,16 +155,31 @@ class Response(FlaskResponse):
                 private = False
         self.private = private
 
+        headers = dict(headers or {})
         body = response
+        if compressed_response is not None:
+            if client_accepts_gzip():
+                body = compressed_response
+                headers['Content-Encoding'] = 'gzip'
+            elif body is None:
+                body = gzip_decompress(compressed_response)
+            self._add_vary(headers, 'Accept-Encoding')
+
         if isinstance(body, etree._Element):
             body = etree.tostring(body)
+        elif isinstance(body, Iterator):
+            # Generating the body may need the database session and
+            # anything else that goes away when the request is over,
+            # so keep the request around until the body has been sent.
+            if flask.has_request_context():
+                body = flask.stream_with_context(body)
         elif not isinstance(body, (bytes, unicode)):
             body = unicode(body)
 
         super(Response, self).__init__(
             response=body,
             status=status,
-            headers=self._headers(headers or {}),
+            headers=self._headers(headers),
             mimetype=mimetype,
             content_type=content_type,
             direct_passthrough=direct_passthrough
@@ -87,6 +192,20 @@ class Response(FlaskResponse):
         """
         return self.data
 
+    @classmethod
+    def _add_vary(cls, headers, field):
+        """Add a request header to the Vary header in `headers`, keeping
+        any that are already there.
+        """
+        for name, value in headers.items():
+            if name.lower() != 'vary':
+                continue
+            fields = [x.strip().lower() for x in value.split(',')]
+            if field.lower() not in fields and '*' not in fields:
+                headers[name] = value + ', ' + field
+            return
+        headers['Vary'] = field
+
     def _headers(self, headers={}):
         """Build an appropriate set of HTTP response headers."""
         # Don't modify the underlying dictionary; it came from somewhere else.
@@ -125,7 +244,7 @@ class OPDSFeedResponse(Response):
     """A convenience specialization of Response for typical OPDS feeds."""
     def __init__(self, response=None, status=None, headers=None, mimetype=None,
                  content_type=None, direct_passthrough=False, max_age=None,
-                 private=None):
+                 private=None, compressed_response=None):
 
         mimetype = mimetype or OPDSFeed.ACQUISITION_FEED_TYPE
         status = status or 200
@@ -135,7 +254,7 @@ class OPDSFeedResponse(Response):
             response=response, status=status, headers=headers,
             mimetype=mimetype, content_type=content_type,
             direct_passthrough=direct_passthrough, max_age=max_age,
-            private=private
+            private=private, compressed_response=compressed_response
         )
 
 
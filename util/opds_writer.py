@@ -41,6 +41,9 @@ class AtomFeed(object):
 
     LCP_NS = 'http://readium.org/lcp-specs/ns'
 
+    # Used for the number of works under a facet.
+    THR_NS = 'http://purl.org/syndication/thread/1.0'
+
     nsmap = {
         None: ATOM_NS,
         'app': APP_NS,
@@ -53,7 +56,7 @@ class AtomFeed(object):
         'bibframe' : BIBFRAME_NS,
         'bib': BIB_SCHEMA_NS,
         'opensearch': OPENSEARCH_NS,
-        'lcp': LCP_NS
+        'lcp': LCP_NS,
     }
 
     default_typemap = {datetime: lambda e, v: _strftime(v)}
@@ -61,6 +64,18 @@ class AtomFeed(object):
     SIMPLIFIED = ElementMaker(typemap=default_typemap, nsmap=nsmap, namespace=SIMPLIFIED_NS)
     SCHEMA = ElementMaker(typemap=default_typemap, nsmap=nsmap, namespace=SCHEMA_NS)
 
+    # Only facet links use the thr namespace, so only they declare it;
+    # feeds and entries keep the declarations in nsmap.
+    THR = ElementMaker(typemap=default_typemap, nsmap=dict(nsmap, thr=THR_NS))
+
+    # The start tag of an <entry> that declares all the namespaces
+    # declared by a feed, and no others.
+    ENTRY_START_TAG = etree.tounicode(E.entry())[:-2]
+
+    # The namespace declarations that every element created by E
+    # carries when it's serialized on its own.
+    NAMESPACE_DECLARATIONS = ENTRY_START_TAG[len("<entry"):]
+
     @classmethod
     def _strftime(self, date):
         """
@@ -71,7 +86,10 @@ class AtomFeed(object):
 
     @classmethod
     def add_link_to_feed(cls, feed, children=None, **kwargs):
-        link = cls.E.link(**kwargs)
+        maker = cls.E
+        if any(k.startswith('{%s}' % cls.THR_NS) for k in kwargs):
+            maker = cls.THR
+        link = maker.link(**kwargs)
         feed.append(link)
         if children:
             for i in children:
@@ -172,6 +190,47 @@ class AtomFeed(object):
 
         return etree.tounicode(self.feed, pretty_print=True)
 
+    def stream(self, entries):
+        """Serialize this feed a piece at a time, so it can be sent to
+        the client before the whole thing has been generated.
+
+        Everything already in the feed goes out first, followed by
+        `entries` and then the closing tag. The feed is not
+        pretty-printed.
+
+        :param entries: An iterable of elements (or strings) to go
+            inside the feed. This is consumed lazily, so it may be a
+            generator that does the expensive work of building each
+            entry.
+        :yield: A sequence of Unicode strings which, put together,
+            make up the feed.
+        """
+        serialized = etree.tounicode(self.feed)
+        footer = u"</%s>" % self.feed.tag.split("}")[-1]
+        yield serialized[:-len(footer)]
+        for entry in entries:
+            if entry is None:
+                continue
+            if isinstance(entry, etree._Element):
+                entry = self.element_to_unicode(entry)
+            yield entry
+        yield footer
+
+    @classmethod
+    def element_to_unicode(cls, element):
+        """Serialize an element that's going inside a feed, leaving out
+        the namespace declarations the feed has already made.
+        """
+        serialized = etree.tounicode(element)
+        start_tag_end = serialized.find(u">")
+        declarations = serialized.find(cls.NAMESPACE_DECLARATIONS)
+        if -1 < declarations < start_tag_end:
+            serialized = (
+                serialized[:declarations]
+                + serialized[declarations+len(cls.NAMESPACE_DECLARATIONS):]
+            )
+        return serialized
+
 
 class OPDSFeed(AtomFeed):
 
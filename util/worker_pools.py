@@ -1,4 +1,5 @@
 import logging
+import multiprocessing
 from contextlib import contextmanager
 from nose.tools import set_trace
 from threading import (
@@ -12,8 +13,11 @@ from Queue import Queue
 # https://github.com/shazow/workerpool, with
 # great appreciation.
 
-# TODO: Consider supporting multiprocessing as well as
-# (or instead of) multithreading.
+# Pool and DatabasePool run jobs in threads, which is good enough for
+# jobs that spend most of their time waiting on the network or the
+# database. ProcessPool and DatabaseProcessPool run jobs in separate
+# processes, for CPU-bound jobs that would otherwise be held back by
+# the GIL.
 
 
 class Worker(Thread):
@@ -74,8 +78,13 @@ class Pool(object):
 
     log = logging.getLogger(__name__)
 
-    def __init__(self, size, worker_factory=None):
-        self.jobs = Queue()
+    def __init__(self, size, worker_factory=None, max_queue_size=0):
+        """Constructor.
+
+        :param max_queue_size: If this is set, put() will block
+            while this many jobs are waiting for a worker.
+        """
+        self.jobs = Queue(max_queue_size)
 
         self.size = size
         self.workers = list()
@@ -129,6 +138,9 @@ class Pool(object):
 
     def join(self):
         self.jobs.join()
+        self.log_success_rate()
+
+    def log_success_rate(self):
         self.log.info(
             "%d/%d job errors occurred. %.2f%% success rate.",
             self.error_count, self.job_total, self.success_rate*100
@@ -150,6 +162,115 @@ class DatabasePool(Pool):
         return self.worker_factory(self, worker_session)
 
 
+# The database session used by jobs in one of a DatabaseProcessPool's
+# worker processes. Each worker process creates its own.
+_process_session = None
+
+
+def _initialize_database_process(url):
+    """Give a DatabaseProcessPool's worker process its own database
+    session.
+
+    The process was forked from the parent, so it must not use any of
+    the parent's database connections. It gets a new engine instead.
+    """
+    global _process_session
+    from ..model import SessionManager
+    _process_session = SessionManager.sessionmaker(url=url)()
+
+
+def _run_job_in_process(job):
+    """Run a job in one of a ProcessPool's worker processes.
+
+    :return: A 2-tuple (success, result). If the job raised an
+        exception, `result` is a string describing the exception.
+    """
+    args = []
+    if _process_session is not None:
+        args.append(_process_session)
+    try:
+        if callable(job):
+            return True, job(*args)
+        return True, job.run(*args)
+    except Exception as e:
+        logging.error("Job raised error: %r", e, exc_info=e)
+        # The exception itself might not survive the trip back to
+        # the parent process.
+        return False, repr(e)
+
+
+class ProcessPool(Pool):
+    """A pool of worker processes to run CPU-bound jobs.
+
+    A job is pickled on its way to a worker process, so it must be a
+    module-level function or a picklable Job. Whatever the job returns
+    is pickled on the way back and collected in .results once the pool
+    is joined.
+    """
+
+    def __init__(self, size, initializer=None, initargs=()):
+        self.size = size
+        self.initializer = initializer
+        self.initargs = initargs
+
+        self.processes = None
+        self.pending = list()
+        self.results = list()
+
+        self.job_total = 0
+        self.error_count = 0
+        self.restart()
+
+    def restart(self):
+        if self.processes is None:
+            self.processes = multiprocessing.Pool(
+                self.size, self.initializer, self.initargs
+            )
+        return self
+
+    __enter__ = restart
+
+    def put(self, job):
+        self.restart()
+        self.job_total += 1
+        self.pending.append(
+            self.processes.apply_async(_run_job_in_process, (job,))
+        )
+
+    def join(self):
+        if self.processes is not None:
+            self.processes.close()
+            for pending in self.pending:
+                success, result = pending.get()
+                if success:
+                    self.results.append(result)
+                else:
+                    self.inc_error()
+            self.processes.join()
+            self.processes = None
+            self.pending = list()
+        self.log_success_rate()
+
+
+class DatabaseProcessPool(ProcessPool):
+    """A pool of worker processes, each with its own database session.
+
+    As with a DatabaseWorker, each job is run with the session as its
+    only argument.
+    """
+
+    def __init__(self, size, url=None):
+        """Constructor.
+
+        :param url: The database URL for the worker processes. By
+            default, the configured database is used.
+        """
+        self.url = url
+        super(DatabaseProcessPool, self).__init__(
+            size, initializer=_initialize_database_process, initargs=(url,)
+        )
+
+
 class Job(object):
     """Abstract parent class for a bit o' work that can be run in a Thread.
     For use with Worker.
@@ -169,12 +290,13 @@ class Job(object):
 
     def run(self, *args, **kwargs):
         try:
-            self.do_run(*args, **kwargs)
+            result = self.do_run(*args, **kwargs)
         except Exception:
             self.rollback(*args, **kwargs)
             raise
         else:
             self.finalize(*args, **kwargs)
+        return result
 
 
 class DatabaseJob(Job):